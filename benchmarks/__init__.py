@@ -0,0 +1 @@
+"""Benchmarks and simulations for the provisioner and SmartDNS services."""
@@ -0,0 +1,68 @@
+"""Import-time regression check for service entry points.
+
+Runs ``python -X importtime -c "import <module>"`` in fresh interpreters and reports the median
+cumulative import time plus the slowest modules as JSON. With ``--max-ms`` the script exits with
+status 1 when the median exceeds the budget, so it can gate CI.
+
+    python -m benchmarks.import_time provisioner.app --runs 5 --max-ms 800
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+def measure(module: str) -> Tuple[float, Dict[str, float]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative: Dict[str, float] = {}
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|")
+        milliseconds = int(cumulative_us) / 1000
+        cumulative[name.strip()] = milliseconds
+        if not name[1:2].isspace():
+            # Nested imports are indented; the top-level entries add up to the whole import.
+            total += milliseconds
+    return total, cumulative
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=["provisioner.app"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail when the median exceeds this budget")
+    args = parser.parse_args(argv)
+
+    report = {}
+    over_budget = False
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.runs)]
+        median_ms = statistics.median(total for total, _ in runs)
+        slowest = sorted(runs[-1][1].items(), key=lambda item: item[1], reverse=True)[: args.top]
+        report[module] = {
+            "median_ms": round(median_ms, 1),
+            "runs_ms": [round(total, 1) for total, _ in runs],
+            "slowest_modules_ms": {name: round(value, 1) for name, value in slowest},
+        }
+        if args.max_ms is not None and median_ms > args.max_ms:
+            over_budget = True
+    print(json.dumps(report, indent=2))
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Latency and throughput of the local object store versus S3 through a local stand-in.
+
+The S3 side uses ``S3Uploader`` against moto's threaded server (``pip install "moto[server]"``),
+so requests take the same botocore and HTTP path as against a real endpoint. Each backend
+uploads ``--objects`` config-sized payloads from ``--threads`` threads, signs a URL for every
+key and reads every object back (presigned GET for S3, the file the ``/objects`` endpoint
+would send for the local store), then deletes everything.
+
+    python -m benchmarks.object_store --objects 2000 --threads 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from provisioner.storage import LocalObjectStore, ObjectStore
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _timed(operation: Callable[[str], None], keys: List[str], threads: int) -> Dict[str, float]:
+    def run(key: str) -> float:
+        start = time.perf_counter()
+        operation(key)
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(run, keys))
+    elapsed = time.perf_counter() - started
+    return {
+        "ops_per_sec": round(len(keys) / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def run_backend(store: ObjectStore, read: Callable[[str], bytes], objects: int, size: int, threads: int) -> dict:
+    keys = [f"configs/{uuid.uuid4()}.conf" for _ in range(objects)]
+    payloads = {key: os.urandom(size) for key in keys}
+    report = {
+        "upload": _timed(lambda key: store.upload_bytes(key, payloads[key], content_type="text/plain"), keys, threads),
+        "presign": _timed(store.generate_presigned_url, keys, threads),
+    }
+
+    def check(key: str) -> None:
+        if read(key) != payloads[key]:
+            raise AssertionError(f"{key} came back corrupted")
+
+    report["read"] = _timed(check, keys, threads)
+    started = time.perf_counter()
+    failed = store.delete_objects(keys)
+    report["delete_all_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    report["delete_failures"] = len(failed)
+    return report
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=2048, help="payload size in bytes")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        local = LocalObjectStore(root, base_url="http://localhost:8000", secret="bench", presign_ttl=900)
+
+        def read_local(key: str) -> bytes:
+            with local.open(key) as handle:
+                return handle.read()
+
+        results["local"] = run_backend(local, read_local, args.objects, args.size, args.threads)
+
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        results["s3"] = "skipped: moto[server] is not installed"
+    else:
+        import httpx
+
+        from provisioner.s3 import S3Uploader
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        server = ThreadedMotoServer(port=0, verbose=False)
+        server.start()
+        try:
+            host, port = server.get_host_and_port()
+            s3 = S3Uploader(
+                access_key="bench",
+                secret_key="bench",
+                bucket="bench",
+                region="us-east-1",
+                presign_ttl=900,
+                endpoint_url=f"http://{host}:{port}",
+            )
+            s3.client.create_bucket(Bucket="bench")
+            http = httpx.Client(limits=httpx.Limits(max_connections=args.threads))
+
+            def read_s3(key: str) -> bytes:
+                response = http.get(s3.generate_presigned_url(key))
+                response.raise_for_status()
+                return response.content
+
+            results["s3"] = run_backend(s3, read_s3, args.objects, args.size, args.threads)
+            http.close()
+        finally:
+            server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Simulate device placement and report how evenly traffic ends up spread across nodes.
+
+Compares the legacy ``current_devices ASC`` placement with :class:`provisioner.placement.PlacementEngine`.
+Nodes start with an uneven mix of heavy and idle devices; new devices with heavy-tailed traffic
+arrive in bursts between score refreshes, like provisions between two stats reports.
+
+    python -m benchmarks.placement_simulation --nodes 8 --devices 2000 --seed 7
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import statistics
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from provisioner.placement import NodeLoad, PlacementEngine
+
+
+@dataclass
+class SimNode:
+    node_id: int
+    max_devices: int
+    rates: List[float] = field(default_factory=list)
+    transferred: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return sum(self.rates)
+
+
+def _device_rate(rng: random.Random) -> float:
+    # Most devices are idle phones, a few are streamers pulling orders of magnitude more.
+    return rng.paretovariate(1.2) * 20_000
+
+
+def _seed_nodes(rng: random.Random, count: int, capacity: int) -> List[SimNode]:
+    nodes = [SimNode(node_id=idx + 1, max_devices=capacity) for idx in range(count)]
+    for idx, node in enumerate(nodes):
+        if idx % 2 == 0:
+            node.rates.extend(rng.uniform(1_000_000, 2_000_000) for _ in range(capacity // 8))
+        else:
+            node.rates.extend(rng.uniform(500, 5_000) for _ in range(capacity // 4))
+    return nodes
+
+
+def _loads(nodes: List[SimNode]) -> List[NodeLoad]:
+    return [
+        NodeLoad(
+            node_id=node.node_id,
+            max_devices=node.max_devices,
+            current_devices=len(node.rates),
+            transferred_bytes=int(node.transferred),
+            active_peers=sum(1 for rate in node.rates if rate > 10_000),
+        )
+        for node in nodes
+    ]
+
+
+def simulate(strategy: str, *, nodes: int, devices: int, capacity: int, burst: int, seed: int) -> Dict[str, float]:
+    rng = random.Random(seed)
+    cluster = _seed_nodes(rng, nodes, capacity)
+    by_id = {node.node_id: node for node in cluster}
+    engine = PlacementEngine(session_factory=None)  # type: ignore[arg-type]
+    now = 0.0
+    engine.update(_loads(cluster), now=now)
+    placed = 0
+    while placed < devices:
+        for node in cluster:
+            node.transferred += node.throughput * 10.0
+        now += 10.0
+        engine.update(_loads(cluster), now=now)
+        for _ in range(min(burst, devices - placed)):
+            if strategy == "traffic":
+                node_id = engine.choose()
+                target = by_id[node_id] if node_id is not None else None
+            else:
+                free = [node for node in cluster if len(node.rates) < node.max_devices]
+                target = min(free, key=lambda node: len(node.rates)) if free else None
+            if target is None:
+                break
+            target.rates.append(_device_rate(rng))
+            placed += 1
+        else:
+            continue
+        break
+    throughput = [node.throughput for node in cluster]
+    mean = statistics.mean(throughput)
+    return {
+        "placed": placed,
+        "throughput_cv": statistics.pstdev(throughput) / mean if mean else 0.0,
+        "throughput_max_over_mean": max(throughput) / mean if mean else 0.0,
+        "devices_min": min(len(node.rates) for node in cluster),
+        "devices_max": max(len(node.rates) for node in cluster),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=8)
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--capacity", type=int, default=512)
+    parser.add_argument("--burst", type=int, default=25, help="devices placed between two refreshes")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    results = {
+        strategy: simulate(
+            strategy,
+            nodes=args.nodes,
+            devices=args.devices,
+            capacity=args.capacity,
+            burst=args.burst,
+            seed=args.seed,
+        )
+        for strategy in ("devices", "traffic")
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Cost of presigning object URLs: botocore versus the cached SigV4 signer.
+
+No request leaves the process. Reports milliseconds per ``--urls`` distinct keys for botocore's
+``generate_presigned_url``, for :class:`SigV4Presigner` with its per-day signing key, and for
+``S3Uploader.generate_presigned_url`` when every key is already in the presign cache.
+
+    python -m benchmarks.presign --urls 10000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import uuid
+from typing import Callable, List
+
+from provisioner.s3 import S3Uploader
+
+
+def _measure(sign: Callable[[str], str], keys: List[str]) -> float:
+    start = time.perf_counter()
+    for key in keys:
+        sign(key)
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--urls", type=int, default=10000)
+    parser.add_argument("--endpoint-url", default=None)
+    parser.add_argument("--sse-kms-key-id", default=None)
+    args = parser.parse_args(argv)
+
+    uploader = S3Uploader(
+        access_key="bench",
+        secret_key="bench",
+        bucket="bench",
+        region="eu-central-1",
+        presign_ttl=900,
+        endpoint_url=args.endpoint_url,
+        sse_algorithm="aws:kms" if args.sse_kms_key_id else "AES256",
+        sse_kms_key_id=args.sse_kms_key_id,
+        presign_cache_size=args.urls,
+    )
+    keys = [f"configs/{uuid.uuid4()}.conf" for _ in range(args.urls)]
+    presigner = uploader.presigner
+    report = {
+        "urls": args.urls,
+        "botocore_ms": _measure(uploader._botocore_presign, keys),
+        "sigv4_presigner_ms": _measure(lambda key: presigner.presign(key, 900), keys) if presigner else None,
+        "first_call_ms": _measure(uploader.generate_presigned_url, keys),
+        "cache_hit_ms": _measure(uploader.generate_presigned_url, keys),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""SmartDNS throughput: the asyncio frontend versus dnslib's threaded server.
+
+A stand-in upstream (answers every A query after ``--upstream-delay-ms``), the SmartDNS server
+and the load generator each run in their own process, so the numbers are not skewed by sharing
+one GIL. ``--concurrency`` clients send ``--queries`` queries in total; ``--rule-ratio`` of them
+match a SmartDNS rule, the rest are forwarded (drawn from ``--names`` distinct names, answered
+from the response cache when ``--cache-size`` is set; a short ``--answer-ttl`` shows what
+prefetching, off with ``--prefetch-concurrency 0``, saves when entries expire). Reports queries per
+second, latency percentiles and lost queries (no answer within 2 s) for every ``--frontend``.
+
+    python -m benchmarks.smartdns_frontend --queries 20000 --concurrency 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import time
+from typing import List
+
+from dnslib import DNSRecord
+
+ANSWER = b"\xc0\x0c\x00\x01\x00\x01\x00\x00\x01\x2c\x00\x04\xc0\x00\x02\x01"
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class _Upstream(asyncio.DatagramProtocol):
+    def __init__(self, delay: float, ttl: int) -> None:
+        self.delay = delay
+        self.answer = ANSWER[:6] + struct.pack("!I", ttl) + ANSWER[10:]
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        # Built by hand so the stand-in costs as little CPU as possible: the query with QR/RA
+        # set, one answer and the A record pointing back at the question name.
+        packet = data[:2] + b"\x81\x80\x00\x01\x00\x01\x00\x00\x00\x00" + data[12:] + self.answer
+        if self.delay:
+            asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, packet, addr)
+        else:
+            self.transport.sendto(packet, addr)
+
+
+async def _serve_upstream(port: int, delay: float, ttl: int) -> None:
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: _Upstream(delay, ttl), local_addr=("127.0.0.1", port))
+    print("ready", flush=True)
+    await asyncio.Event().wait()
+
+
+class _StaticRules:
+    def __init__(self, count: int) -> None:
+        from smartdns.rules import Rule
+
+        self.rules = [Rule(pattern=f"rule{index}.bench", ip_address="198.51.100.1") for index in range(count)]
+
+    def load(self):
+        return self.rules
+
+
+async def _serve_smartdns(
+    frontend: str,
+    port: int,
+    upstream_port: int,
+    max_concurrency: int,
+    cache_size: int,
+    prefetch_concurrency: int,
+) -> None:
+    from smartdns.cache import ResponseCache
+    from smartdns.dns_server import create_dns_server
+    from smartdns.frontend import create_dns_frontend
+    from smartdns.rules import RuleStore
+    from smartdns.upstreams import Upstream, UpstreamManager
+
+    store = RuleStore(_StaticRules(1000))
+    store.reload()
+    upstreams = UpstreamManager([Upstream(host="127.0.0.1", port=upstream_port)], timeout=2.0)
+    cache = ResponseCache(maxsize=cache_size) if cache_size else None
+    if frontend == "asyncio":
+        server = create_dns_frontend(store, upstreams, "127.0.0.1", port, False, max_concurrency, cache, prefetch_concurrency)
+        await server.start()
+    else:
+        for server in create_dns_server(store, upstreams, "127.0.0.1", port, False, cache):
+            server.start_thread()
+    print("ready", flush=True)
+    await asyncio.Event().wait()
+
+
+class _Client(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.waiting: asyncio.Future | None = None
+        self.transaction_id = b""
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        # A reply that arrives after its query timed out must not complete the next one.
+        if data[:2] == self.transaction_id and self.waiting is not None and not self.waiting.done():
+            self.waiting.set_result(data)
+
+
+async def _load(port: int, queries: List[bytes], concurrency: int) -> dict:
+    loop = asyncio.get_running_loop()
+    latencies: List[float] = []
+    lost = 0
+    cursor = iter(queries)
+
+    async def worker() -> None:
+        nonlocal lost
+        transport, protocol = await loop.create_datagram_endpoint(_Client, remote_addr=("127.0.0.1", port))
+        try:
+            for packet in cursor:
+                protocol.waiting = loop.create_future()
+                protocol.transaction_id = packet[:2]
+                start = time.perf_counter()
+                transport.sendto(packet)
+                try:
+                    await asyncio.wait_for(protocol.waiting, 2.0)
+                except asyncio.TimeoutError:
+                    lost += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+        finally:
+            transport.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "qps": round(len(latencies) / elapsed),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        "lost": lost,
+    }
+
+
+def _spawn(*args: str) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.smartdns_frontend", *args], stdout=subprocess.PIPE, text=True)
+    if process.stdout.readline().strip() != "ready":
+        process.kill()
+        raise RuntimeError(f"{' '.join(args)} failed to start")
+    return process
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frontend", action="append", choices=("threaded", "asyncio"))
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rule-ratio", type=float, default=0.2)
+    parser.add_argument("--upstream-delay-ms", type=float, default=2.0)
+    parser.add_argument("--names", type=int, default=1 << 20, help="distinct forwarded names; lower it to exercise the cache")
+    parser.add_argument("--cache-size", type=int, default=0)
+    parser.add_argument("--answer-ttl", type=int, default=300)
+    parser.add_argument("--prefetch-concurrency", type=int, default=16)
+    parser.add_argument("--max-concurrency", type=int, default=1024)
+    parser.add_argument("--role", choices=("upstream", "server"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--upstream-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.role == "upstream":
+        asyncio.run(_serve_upstream(args.port, args.upstream_delay_ms / 1000, args.answer_ttl))
+        return
+    if args.role == "server":
+        asyncio.run(
+            _serve_smartdns(
+                args.frontend[0],
+                args.port,
+                args.upstream_port,
+                args.max_concurrency,
+                args.cache_size,
+                args.prefetch_concurrency,
+            )
+        )
+        return
+
+    rng = random.Random(1)
+    queries = []
+    for _ in range(args.queries):
+        if rng.random() < args.rule_ratio:
+            name = f"rule{rng.randrange(1000)}.bench"
+        else:
+            name = f"host{rng.randrange(args.names)}.example.com"
+        queries.append(DNSRecord.question(name).pack())
+
+    upstream_port = _free_port()
+    upstream = _spawn(
+        "--role",
+        "upstream",
+        "--port",
+        str(upstream_port),
+        "--upstream-delay-ms",
+        str(args.upstream_delay_ms),
+        "--answer-ttl",
+        str(args.answer_ttl),
+    )
+    report = {
+        "queries": args.queries,
+        "concurrency": args.concurrency,
+        "rule_ratio": args.rule_ratio,
+        "upstream_delay_ms": args.upstream_delay_ms,
+        "names": args.names,
+        "cache_size": args.cache_size,
+        "answer_ttl": args.answer_ttl,
+        "prefetch_concurrency": args.prefetch_concurrency,
+    }
+    try:
+        for frontend in args.frontend or ["threaded", "asyncio"]:
+            port = _free_port()
+            server = _spawn(
+                "--role",
+                "server",
+                "--frontend",
+                frontend,
+                "--port",
+                str(port),
+                "--upstream-port",
+                str(upstream_port),
+                "--max-concurrency",
+                str(args.max_concurrency),
+                "--cache-size",
+                str(args.cache_size),
+                "--prefetch-concurrency",
+                str(args.prefetch_concurrency),
+            )
+            try:
+                report[frontend] = asyncio.run(_load(port, queries, args.concurrency))
+            finally:
+                server.kill()
+                server.wait()
+    finally:
+        upstream.kill()
+        upstream.wait()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
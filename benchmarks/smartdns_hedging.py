@@ -0,0 +1,105 @@
+"""SmartDNS upstream selection when the first configured upstream is degraded.
+
+Upstreams are simulated in-process (``asyncio.sleep`` plus a drop probability), so only the
+selection logic is measured. The first upstream answers in ``--degraded-ms`` but drops
+``--drop-rate`` of the queries, the second answers in ``--healthy-ms``. Compares the previous
+strictly ordered forwarding (each upstream gets the full timeout) with ``UpstreamManager``.
+
+    python -m benchmarks.smartdns_hedging --queries 2000 --drop-rate 0.3
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from smartdns.upstreams import Upstream, UpstreamManager
+
+REPLY = b"\x00\x00\x81\x80" + b"\x00" * 8
+
+
+def _simulated(profiles: Dict[str, tuple], rng: random.Random) -> Callable[[Upstream, bytes, float], Awaitable[bytes]]:
+    async def send(upstream: Upstream, packet: bytes, timeout: float) -> bytes:
+        delay, drop_rate = profiles[upstream.host]
+        if rng.random() < drop_rate:
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError
+        await asyncio.sleep(delay * rng.uniform(0.8, 1.5))
+        return packet[:2] + REPLY[2:]
+
+    return send
+
+
+async def _run(query: Callable[[bytes], Awaitable[bytes]], queries: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    failed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int) -> None:
+        nonlocal failed
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await query(index.to_bytes(2, "big") + b"\x01\x00" + b"\x00" * 8)
+            except Exception:
+                failed += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(index) for index in range(queries)))
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "failed": failed,
+    }
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    parser.add_argument("--degraded-ms", type=float, default=30.0)
+    parser.add_argument("--drop-rate", type=float, default=0.3)
+    parser.add_argument("--healthy-ms", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    profiles = {"degraded": (args.degraded_ms / 1000, args.drop_rate), "healthy": (args.healthy_ms / 1000, 0.0)}
+    upstreams = [Upstream(host="degraded", port=53), Upstream(host="healthy", port=53)]
+    send = _simulated(profiles, random.Random(1))
+
+    async def ordered(packet: bytes) -> bytes:
+        last_error: Exception | None = None
+        for upstream in upstreams:
+            try:
+                return await send(upstream, packet, args.timeout)
+            except Exception as exc:
+                last_error = exc
+        raise last_error  # type: ignore[misc]
+
+    manager = UpstreamManager(upstreams, timeout=args.timeout, send=send)
+    report = {
+        "queries": args.queries,
+        "drop_rate": args.drop_rate,
+        "ordered": asyncio.run(_run(ordered, args.queries, args.concurrency)),
+        "hedged": asyncio.run(_run(manager.query, args.queries, args.concurrency)),
+        "hedged_upstream_state": {
+            health.upstream.host: {
+                "latency_ms": round((health.latency or 0) * 1000, 1),
+                "failure_rate": round(health.failure_rate, 3),
+            }
+            for health in manager.health
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""SmartDNS rule lookup: ``RuleIndex`` versus the previous per-suffix string building.
+
+Builds ``--rules`` synthetic rules (a quarter of them wildcards) and reports lookups per second
+for both implementations on names that hit an exact rule, hit a wildcard three labels down,
+miss entirely, or miss six labels below an exact rule. Both must agree on every answer.
+
+    python -m benchmarks.smartdns_lookup --rules 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from typing import Callable, Dict, List
+
+from smartdns.rules import Rule, RuleIndex
+
+
+class LegacyRuleIndex:
+    """The lookup ``RuleStore`` used before ``RuleIndex``: split the name and join every suffix."""
+
+    def __init__(self, rules: List[Rule]) -> None:
+        self._rules: Dict[str, Rule] = {rule.pattern.rstrip("."): rule for rule in rules}
+
+    def lookup(self, domain: str) -> Rule | None:
+        domain = domain.rstrip(".").lower()
+        rule = self._rules.get(domain)
+        if rule:
+            return rule
+        labels = domain.split(".")
+        for idx in range(1, len(labels)):
+            candidate = "*." + ".".join(labels[idx:])
+            rule = self._rules.get(candidate)
+            if rule:
+                return rule
+        return None
+
+
+def _rules(count: int, rng: random.Random) -> List[Rule]:
+    rules = []
+    for index in range(count):
+        zone = f"zone{index}.{rng.choice(('com', 'net', 'org', 'ru', 'io'))}"
+        pattern = f"*.{zone}" if index % 4 == 0 else f"host{index}.{zone}"
+        rules.append(Rule(pattern=pattern, ip_address=f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"))
+    return rules
+
+
+def _queries(rules: List[Rule], count: int, rng: random.Random) -> Dict[str, List[str]]:
+    exact = [rule.pattern for rule in rules if not rule.pattern.startswith("*.")]
+    wildcard = [rule.pattern[2:] for rule in rules if rule.pattern.startswith("*.")]
+    return {
+        "exact": [f"{rng.choice(exact)}." for _ in range(count)],
+        "wildcard": [f"a.b.c.{rng.choice(wildcard)}." for _ in range(count)],
+        "miss": [f"www.{rng.randrange(1 << 30)}.example.com." for _ in range(count)],
+        "deep_miss": [f"x.y.z.w.v.u.{rng.choice(exact)}." for _ in range(count)],
+    }
+
+
+def _measure(lookup: Callable[[str], Rule | None], queries: List[str]) -> int:
+    start = time.perf_counter()
+    for name in queries:
+        lookup(name)
+    return round(len(queries) / (time.perf_counter() - start))
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200000, help="per kind of query")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    rules = _rules(args.rules, rng)
+    queries = _queries(rules, args.queries, rng)
+
+    start = time.perf_counter()
+    legacy = LegacyRuleIndex(rules)
+    legacy_build = time.perf_counter() - start
+    start = time.perf_counter()
+    index = RuleIndex(rules)
+    index_build = time.perf_counter() - start
+
+    report = {
+        "rules": args.rules,
+        "queries": args.queries,
+        "legacy_build_ms": round(legacy_build * 1000, 1),
+        "index_build_ms": round(index_build * 1000, 1),
+        "lookups_per_sec": {},
+        "mismatches": 0,
+    }
+    for kind, names in queries.items():
+        report["mismatches"] += sum(1 for name in names[:10000] if legacy.lookup(name) != index.lookup(name))
+        report["lookups_per_sec"][kind] = {
+            "legacy": _measure(legacy.lookup, names),
+            "index": _measure(index.lookup, names),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""SmartDNS rule reloads: full versus incremental.
+
+Seeds a temporary SQLite database (or ``--database-url``) and a rules file with ``--rules`` rules
+each, last modified an hour ago. Then, for ``--rounds`` rounds, times a reload with nothing
+changed and a reload after ``--changes`` rules were edited. Compares the previous behaviour
+(every reload reads all active rows as ORM objects or the whole file, and rebuilds the index when
+anything differs) with the incremental sources, which use the ``updated_at`` watermark and the
+file's inode/size/mtime and patch a copy of the index. Reports median milliseconds per reload.
+
+    python -m benchmarks.smartdns_reload --rules 100000 --changes 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+
+class _FullReload:
+    """Hides ``changes`` so :class:`RuleStore` falls back to a complete load every time."""
+
+    def __init__(self, load: Callable[[], list]) -> None:
+        self.load = load
+
+
+def _legacy_database_load() -> list:
+    from db import read_session_scope
+    from db.models import SmartDNSRule
+    from smartdns.rules import Rule
+
+    with read_session_scope() as session:
+        rows = session.query(SmartDNSRule).filter(SmartDNSRule.is_active.is_(True)).order_by(SmartDNSRule.id.asc()).all()
+        return [Rule(pattern=row.pattern.lower(), ip_address=row.ip_address, ttl=row.ttl) for row in rows]
+
+
+def _seed_database(rules: int) -> None:
+    from sqlalchemy import delete, insert
+
+    from db import ENGINE, session_scope
+    from db.models import Base, SmartDNSRule
+
+    Base.metadata.create_all(ENGINE)
+    old = datetime.utcnow() - timedelta(hours=1)
+    with session_scope() as session:
+        session.execute(delete(SmartDNSRule))
+        session.execute(
+            insert(SmartDNSRule),
+            [
+                {"pattern": f"host{index}.example.com", "ip_address": "198.51.100.1", "ttl": 60, "is_active": True, "updated_at": old}
+                for index in range(rules)
+            ],
+        )
+
+
+def _edit_database(rng: random.Random, rules: int, changes: int, round_: int) -> None:
+    from sqlalchemy import update
+
+    from db import session_scope
+    from db.models import SmartDNSRule
+
+    patterns = [f"host{rng.randrange(rules)}.example.com" for _ in range(changes)]
+    with session_scope() as session:
+        session.execute(
+            update(SmartDNSRule)
+            .where(SmartDNSRule.pattern.in_(patterns))
+            .values(ip_address=f"203.0.113.{round_ % 250}", updated_at=datetime.utcnow())
+        )
+
+
+def _write_file(path: Path, lines: List[str]) -> None:
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def _time(store) -> float:
+    start = time.perf_counter()
+    store.reload()
+    return (time.perf_counter() - start) * 1000
+
+
+def _compare(stores: Dict[str, object], edit: Callable[[int], None], rounds: int) -> dict:
+    samples: Dict[str, Dict[str, List[float]]] = {name: {"unchanged": [], "changed": []} for name in stores}
+    for store in stores.values():
+        store.reload()
+    for round_ in range(rounds):
+        for name, store in stores.items():
+            samples[name]["unchanged"].append(_time(store))
+        edit(round_)
+        for name, store in stores.items():
+            samples[name]["changed"].append(_time(store))
+    return {
+        name: {kind: round(statistics.median(values), 2) for kind, values in kinds.items()}
+        for name, kinds in samples.items()
+    }
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=100000)
+    parser.add_argument("--changes", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--database-url")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="smartdns-reload-") as workdir:
+        # db reads DATABASE_URL when it is first imported, so set it before anything imports it.
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir}/bench.db"
+        from smartdns.rules import DatabaseRuleSource, FileRuleSource, RuleStore
+
+        rng = random.Random(1)
+        _seed_database(args.rules)
+        database = _compare(
+            {
+                "full": RuleStore(_FullReload(_legacy_database_load)),
+                "incremental": RuleStore(DatabaseRuleSource()),
+            },
+            lambda round_: _edit_database(rng, args.rules, args.changes, round_),
+            args.rounds,
+        )
+
+        path = Path(workdir) / "smartdns.rules"
+        lines = [f"host{index}.example.com 198.51.100.1 60\n" for index in range(args.rules)]
+        _write_file(path, lines)
+
+        def edit_file(round_: int) -> None:
+            for _ in range(args.changes):
+                lines[rng.randrange(args.rules)] = f"host{rng.randrange(args.rules)}.example.com 203.0.113.{round_ % 250} 60\n"
+            _write_file(path, lines)
+
+        rule_file = _compare(
+            {
+                "full": RuleStore(_FullReload(FileRuleSource(str(path)).load)),
+                "incremental": RuleStore(FileRuleSource(str(path))),
+            },
+            edit_file,
+            args.rounds,
+        )
+
+    report = {
+        "rules": args.rules,
+        "changes": args.changes,
+        "database_ms": database,
+        "file_ms": rule_file,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
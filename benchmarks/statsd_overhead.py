@@ -0,0 +1,107 @@
+"""Per-call overhead of the stock StatsD client versus :class:`BufferedStatsClient`.
+
+Both clients send to a local UDP sink that counts datagrams and metric lines. Every thread
+calls ``incr`` the given number of times, the way request handlers do, and the report gives
+the mean cost per call as seen by the caller plus what reached the sink.
+
+    python -m benchmarks.statsd_overhead --threads 8 --calls 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import socket
+import threading
+import time
+from typing import Callable, Dict, List
+
+from statsd import StatsClient
+
+from provisioner.stats_emitter import BufferedStatsClient
+
+
+class UDPSink:
+    def __init__(self) -> None:
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.2)
+        self.port = self.socket.getsockname()[1]
+        self.packets = 0
+        self.counted = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                data = self.socket.recv(65535)
+            except socket.timeout:
+                continue
+            self.packets += 1
+            for line in data.decode().splitlines():
+                self.counted += int(line.split(":", 1)[1].split("|", 1)[0])
+
+    def close(self) -> None:
+        time.sleep(0.3)
+        self._stopped.set()
+        self._thread.join()
+        self.socket.close()
+
+
+def run(make_client: Callable[[int], object], threads: int, calls: int) -> Dict[str, float]:
+    sink = UDPSink()
+    client = make_client(sink.port)
+    barrier = threading.Barrier(threads)
+    elapsed: List[float] = []
+
+    def worker() -> None:
+        barrier.wait()
+        start = time.perf_counter()
+        for _ in range(calls):
+            client.incr("provision.success")
+        elapsed.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if isinstance(client, BufferedStatsClient):
+        client.stop()
+    sink.close()
+    total_calls = threads * calls
+    return {
+        "ns_per_call": round(sum(elapsed) / total_calls * 1e9),
+        "calls": total_calls,
+        "counted_by_sink": sink.counted,
+        "datagrams": sink.packets,
+    }
+
+
+def main(argv: List[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--calls", type=int, default=20000, help="incr calls per thread")
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    report = {
+        "statsd.StatsClient": run(
+            lambda port: StatsClient("127.0.0.1", port, prefix="provisioner"), args.threads, args.calls
+        ),
+        "BufferedStatsClient": run(
+            lambda port: BufferedStatsClient(
+                "127.0.0.1", port, prefix="provisioner", flush_interval=args.flush_interval
+            ),
+            args.threads,
+            args.calls,
+        ),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 """Database utilities for the provisioner service."""
 
-from .config import ENGINE, SessionLocal, session_scope
+from .config import ENGINE, READ_ROUTER, SessionLocal, read_session_scope, session_scope
 from .models import Base
 
-__all__ = ["ENGINE", "SessionLocal", "session_scope", "Base"]
+__all__ = ["ENGINE", "READ_ROUTER", "SessionLocal", "read_session_scope", "session_scope", "Base"]
@@ -1,24 +1,217 @@
 from __future__ import annotations
 
+import logging
 import os
+import threading
+import time
 from contextlib import contextmanager
-from typing import Iterator
+from typing import Any, Dict, Iterator, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import URL, Engine, make_url
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+logger = logging.getLogger(__name__)
+
+
+SQLITE_BEGIN_MODES = ("deferred", "immediate", "exclusive")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _sqlite_begin_mode(value: str) -> str:
+    mode = value.lower()
+    if mode not in SQLITE_BEGIN_MODES:
+        raise ValueError(f"SQLite begin mode must be one of {SQLITE_BEGIN_MODES}, got {value!r}")
+    return mode
+
+
+def _sqlite_options(url: URL) -> Dict[str, Any]:
+    busy_timeout_ms = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+    options: Dict[str, Any] = {
+        "connect_args": {"check_same_thread": False, "timeout": busy_timeout_ms / 1000},
+    }
+    if url.database in (None, "", ":memory:"):
+        # Every new connection to :memory: is a separate database, so share a single one.
+        options["poolclass"] = StaticPool
+    else:
+        # WAL lets readers run next to the single writer; connections are cheap to keep around.
+        options["poolclass"] = QueuePool
+        options["pool_size"] = _env_int("DB_POOL_SIZE", 10)
+        options["max_overflow"] = _env_int("DB_MAX_OVERFLOW", 30)
+        options["pool_timeout"] = _env_int("DB_POOL_TIMEOUT", 30)
+    return options
+
+
+def _configure_sqlite(engine: Engine, begin_mode: str) -> None:
+    busy_timeout_ms = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
+    mmap_size = _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+    cache_size_kb = _env_int("SQLITE_CACHE_SIZE_KB", 64 * 1024)
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, _record) -> None:
+        # Let SQLAlchemy emit BEGIN itself so the locking mode below is honoured.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+        cursor.execute(f"PRAGMA cache_size=-{cache_size_kb}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn) -> None:
+        # A deferred transaction that reads and then writes fails with "database is locked"
+        # without waiting on busy_timeout; taking the write lock up front makes writers queue.
+        # Read-only sessions opt out with the ``sqlite_begin`` execution option.
+        mode = _sqlite_begin_mode(conn.get_execution_options().get("sqlite_begin", begin_mode))
+        conn.exec_driver_sql(f"BEGIN {mode.upper()}")
+
+
+def _postgres_options(url: URL) -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "poolclass": QueuePool,
+        "pool_size": _env_int("DB_POOL_SIZE", 20),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 20),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": True,
+        "pool_use_lifo": True,
+    }
+    if url.get_driver_name() == "psycopg":
+        # Server-side prepared statements after N executions of the same query.
+        options["connect_args"] = {"prepare_threshold": _env_int("DB_PREPARE_THRESHOLD", 5)}
+    return options
+
+
+def create_db_engine(database_url: str, *, read_only: bool = False) -> Engine:
+    """Build an engine with the tuned profile for the database backend.
+
+    ``read_only`` engines on SQLite start deferred transactions so readers never queue behind writers;
+    others use ``SQLITE_BEGIN_MODE`` (``immediate`` by default).
+    """
+    url = make_url(database_url)
+    options: Dict[str, Any] = {"future": True, "query_cache_size": _env_int("DB_STATEMENT_CACHE_SIZE", 1200)}
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        options.update(_sqlite_options(url))
+    elif backend == "postgresql":
+        options.update(_postgres_options(url))
+    engine = create_engine(url, **options)
+    if backend == "sqlite":
+        begin_mode = "deferred" if read_only else _sqlite_begin_mode(os.getenv("SQLITE_BEGIN_MODE", "immediate"))
+        _configure_sqlite(engine, begin_mode)
+    return engine
 
 
 def _build_engine() -> tuple:
     database_url = os.getenv("DATABASE_URL", "sqlite:///./provisioner.db")
-    connect_args = {"check_same_thread": False} if database_url.startswith("sqlite") else {}
-    engine = create_engine(database_url, connect_args=connect_args, future=True)
+    engine = create_db_engine(database_url)
     session_factory = scoped_session(
         sessionmaker(bind=engine, autocommit=False, autoflush=False, expire_on_commit=False)
     )
     return engine, session_factory
 
 
+class ReplicaRouter:
+    """Routes read-only sessions to a replica while it is reachable and fresh enough.
+
+    Replication lag is probed at most every ``check_interval`` seconds and cached, so routing
+    a session costs no extra round trip. When the probe fails or the lag exceeds the caller's
+    staleness bound, reads fall back to the primary. Read sessions are never the thread's
+    scoped ``SessionLocal``, so a read scope opened inside a write scope cannot end it.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        replica: Optional[Engine] = None,
+        *,
+        max_lag: float = 5.0,
+        check_interval: float = 2.0,
+    ) -> None:
+        self.replica_engine = replica
+        # Reads that fall back to the primary must not take SQLite's write lock.
+        self._primary = sessionmaker(
+            bind=primary.execution_options(sqlite_begin="deferred"), autoflush=False, expire_on_commit=False
+        )
+        self._replica = sessionmaker(bind=replica, autoflush=False, expire_on_commit=False) if replica else None
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._lag: Optional[float] = None
+        self._checked_at = float("-inf")
+
+    def lag(self) -> Optional[float]:
+        """Return the cached replica lag in seconds, or ``None`` while the replica is unusable."""
+        if self.replica_engine is None:
+            return None
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return self._lag
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._lag = self._probe(self.replica_engine)
+                self._checked_at = time.monotonic()
+        return self._lag
+
+    def session_factory(self, max_staleness: Optional[float] = None) -> sessionmaker:
+        bound = self.max_lag if max_staleness is None else max_staleness
+        lag = self.lag()
+        if self._replica is not None and lag is not None and lag <= bound:
+            return self._replica
+        return self._primary
+
+    def _probe(self, engine: Engine) -> Optional[float]:
+        if engine.dialect.name == "postgresql":
+            # Equal LSNs only mean "caught up" while the receiver is streaming; a replica that lost
+            # its upstream has replayed everything it received and still falls behind.
+            query = text(
+                "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+            )
+        else:
+            query = text("SELECT 0")
+        try:
+            with engine.connect() as conn:
+                lag = conn.execute(query).scalar()
+        except Exception:
+            logger.warning("Read replica is unreachable, routing reads to the primary", exc_info=True)
+            return None
+        if lag is None:
+            logger.warning("Read replica is not streaming from the primary, routing reads to the primary")
+            return None
+        lag = float(lag)
+        if lag > self.max_lag:
+            logger.warning("Read replica lags %.1fs behind, routing reads to the primary", lag)
+        return lag
+
+
+def _build_router(engine: Engine) -> ReplicaRouter:
+    read_url = os.getenv("DATABASE_READ_URL")
+    if read_url:
+        return ReplicaRouter(
+            engine,
+            create_db_engine(read_url, read_only=True),
+            max_lag=float(os.getenv("DATABASE_READ_MAX_LAG", "5")),
+            check_interval=float(os.getenv("DATABASE_READ_CHECK_INTERVAL", "2")),
+        )
+    if engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        # No replica, but reads on the same file can skip the write lock taken by the primary engine.
+        return ReplicaRouter(create_db_engine(engine.url.render_as_string(hide_password=False), read_only=True))
+    return ReplicaRouter(engine)
+
+
 ENGINE, SessionLocal = _build_engine()
+READ_ROUTER = _build_router(ENGINE)
 
 
 @contextmanager
@@ -32,3 +225,14 @@ def session_scope() -> Iterator:
         raise
     finally:
         session.close()
+
+
+@contextmanager
+def read_session_scope(max_staleness: Optional[float] = None) -> Iterator:
+    """Session for read-only work, served by the replica when it is within ``max_staleness`` seconds."""
+    session = READ_ROUTER.session_factory(max_staleness)()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
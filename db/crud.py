@@ -1,13 +1,28 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import List, Optional
+import base64
+import binascii
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple
 
-from sqlalchemy import func, select
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 
-from .models import ActivePeer, KeyPool, Node, Provision, ProvisionStatus
+from .models import (
+    ActivePeer,
+    CACertificate,
+    KeyPool,
+    Node,
+    Provision,
+    ProvisionStatus,
+    QuotaAction,
+    TrafficQuota,
+    UserTraffic,
+)
 
 
 class KeyPoolEmpty(RuntimeError):
@@ -44,6 +59,19 @@ def count_user_devices_on_node(session: Session, telegram_id: int, node_id: int)
     return session.execute(query).scalar_one()
 
 
+def count_active_devices(session: Session, telegram_ids: Iterable[int]) -> Dict[Tuple[int, int], int]:
+    """Active provisions per ``(telegram_id, node_id)`` for all given users in one query."""
+    telegram_ids = list(telegram_ids)
+    if not telegram_ids:
+        return {}
+    query = (
+        select(Provision.telegram_id, Provision.node_id, func.count(Provision.id))
+        .where(Provision.telegram_id.in_(telegram_ids), Provision.status == ProvisionStatus.ACTIVE)
+        .group_by(Provision.telegram_id, Provision.node_id)
+    )
+    return {(telegram_id, node_id): count for telegram_id, node_id, count in session.execute(query)}
+
+
 def allocate_key(session: Session, node_id: int) -> KeyPool:
     query = (
         select(KeyPool)
@@ -61,6 +89,89 @@ def allocate_key(session: Session, node_id: int) -> KeyPool:
     return key
 
 
+def allocate_keys(session: Session, node_id: int, count: int) -> List[KeyPool]:
+    """Allocate up to ``count`` free keys of a node with a single ``SKIP LOCKED`` query.
+
+    Fewer keys are returned when the pool runs short. CA certificates are loaded eagerly so the
+    keys can be rendered outside the session's thread.
+    """
+    if count <= 0:
+        return []
+    query = (
+        select(KeyPool)
+        .where(KeyPool.node_id == node_id, KeyPool.allocated.is_(False))
+        .order_by(KeyPool.created_at.asc())
+        .limit(count)
+        .options(selectinload(KeyPool.ca))
+        .with_for_update(skip_locked=True, of=KeyPool)
+    )
+    keys = list(session.execute(query).scalars().all())
+    now = datetime.utcnow()
+    for key in keys:
+        key.allocated = True
+        key.allocated_at = now
+    return keys
+
+
+def normalize_pem(pem: str) -> str:
+    return "\n".join(line.strip() for line in pem.strip().splitlines())
+
+
+def ca_fingerprint(pem: str) -> str:
+    """SHA-256 over the DER body of a PEM certificate, or over the text if it is not valid base64."""
+    pem = normalize_pem(pem)
+    body = "".join(line for line in pem.splitlines() if not line.startswith("-----"))
+    try:
+        payload = base64.b64decode(body, validate=True)
+    except (binascii.Error, ValueError):
+        payload = pem.encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def get_or_create_ca_certificate(session: Session, pem: str) -> CACertificate:
+    fingerprint = ca_fingerprint(pem)
+    ca = session.execute(
+        select(CACertificate).where(CACertificate.fingerprint == fingerprint)
+    ).scalars().first()
+    if ca is None:
+        ca = CACertificate(fingerprint=fingerprint, pem=normalize_pem(pem))
+        session.add(ca)
+        session.flush()
+    return ca
+
+
+def insert_keys(session: Session, node_id: int, rows: Sequence[Mapping[str, Optional[str]]]) -> int:
+    """Insert key pool rows and return how many were new.
+
+    Rows whose ``public_key`` is already stored are skipped by the database itself (``ON CONFLICT
+    DO NOTHING`` on the unique index), so concurrent imports of the same keys cannot both insert.
+    """
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    ca_ids: dict[str, int] = {}
+    values = []
+    for row in rows:
+        row = dict(row)
+        ca_pem = row.pop("ca_certificate", None)
+        if ca_pem and ca_pem not in ca_ids:
+            ca_ids[ca_pem] = get_or_create_ca_certificate(session, ca_pem).id
+        row["ca_id"] = ca_ids[ca_pem] if ca_pem else None
+        values.append({**row, "node_id": node_id, "allocated": False, "created_at": now})
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        statement = (postgresql if dialect == "postgresql" else sqlite).insert(KeyPool.__table__)
+        statement = statement.on_conflict_do_nothing(index_elements=[KeyPool.public_key]).returning(KeyPool.id)
+        return len(session.execute(statement, values).all())
+    # No portable upsert elsewhere: skip the keys seen now and let the unique index reject races.
+    query = select(KeyPool.public_key).where(KeyPool.public_key.in_([value["public_key"] for value in values]))
+    existing = set(session.execute(query).scalars().all())
+    values = [value for value in values if value["public_key"] not in existing]
+    if values:
+        session.execute(insert(KeyPool), values)
+    return len(values)
+
+
 def release_key(session: Session, key_id: int) -> None:
     key = session.get(KeyPool, key_id)
     if key:
@@ -124,27 +235,238 @@ def get_active_provision(session: Session, telegram_id: int, provision_id: int)
     return provision
 
 
-def update_peer_stats(
-    session: Session,
-    provision_id: int,
-    *,
-    rx_bytes: int,
-    tx_bytes: int,
-    latest_handshake: datetime,
-) -> None:
-    peer = session.execute(
-        select(ActivePeer).where(ActivePeer.provision_id == provision_id)
-    ).scalars().first()
-    if peer is None:
-        provision = session.get(Provision, provision_id)
-        if provision is None:
-            return
-        peer = ActivePeer(provision_id=provision_id, node_id=provision.node_id)
-    peer.rx_bytes = rx_bytes
-    peer.tx_bytes = tx_bytes
-    peer.latest_handshake = latest_handshake
-    session.add(peer)
+def get_provisions(session: Session, provision_ids: Iterable[int]) -> List[Provision]:
+    return session.execute(select(Provision).where(Provision.id.in_(list(provision_ids)))).scalars().all()
+
+
+def node_load_stats(session: Session, handshake_since: datetime) -> List[tuple]:
+    """Return ``(node_id, max_devices, current_devices, transferred_bytes, active_peers)`` per active node."""
+    peers = (
+        select(
+            ActivePeer.node_id.label("node_id"),
+            func.sum(ActivePeer.rx_bytes + ActivePeer.tx_bytes).label("transferred_bytes"),
+            func.sum(case((ActivePeer.latest_handshake >= handshake_since, 1), else_=0)).label("active_peers"),
+        )
+        .group_by(ActivePeer.node_id)
+        .subquery()
+    )
+    query = (
+        select(
+            Node.id,
+            Node.max_devices,
+            Node.current_devices,
+            func.coalesce(peers.c.transferred_bytes, 0),
+            func.coalesce(peers.c.active_peers, 0),
+        )
+        .outerjoin(peers, peers.c.node_id == Node.id)
+        .where(Node.is_active.is_(True))
+    )
+    return [tuple(row) for row in session.execute(query).all()]
 
 
 def list_active_nodes(session: Session) -> List[Node]:
     return session.execute(select(Node).where(Node.is_active.is_(True))).scalars().all()
+
+
+def list_referenced_s3_keys(session: Session, keys: Iterable[str]) -> Set[str]:
+    """Return the subset of ``keys`` still referenced by active provisions."""
+    keys = list(keys)
+    if not keys:
+        return set()
+    active = Provision.status == ProvisionStatus.ACTIVE
+    config_keys = select(Provision.config_s3_key).where(active, Provision.config_s3_key.in_(keys))
+    qr_keys = select(Provision.qr_s3_key).where(active, Provision.qr_s3_key.in_(keys))
+    return set(session.execute(config_keys.union(qr_keys)).scalars().all())
+
+
+@dataclass(frozen=True)
+class QuotaChange:
+    telegram_id: int
+    action: Optional[QuotaAction]
+    throttle_kbps: Optional[int] = None
+    previous_action: Optional[QuotaAction] = None
+
+
+def apply_peer_stats(
+    session: Session,
+    reports: Mapping[int, Tuple[int, int, datetime]],
+) -> Dict[int, int]:
+    """Store ``(rx_bytes, tx_bytes, latest_handshake)`` per provision and return transferred bytes per user.
+
+    The whole report costs one query for the existing peers (plus one for peers seen for the
+    first time). The delta is computed against the stored counters; a counter that went backwards
+    was reset on the node and counts from zero.
+    """
+    if not reports:
+        return {}
+    rows = session.execute(
+        select(ActivePeer, Provision.telegram_id)
+        .join(Provision, Provision.id == ActivePeer.provision_id)
+        .where(ActivePeer.provision_id.in_(list(reports)))
+    ).all()
+    peers = {peer.provision_id: (peer, telegram_id) for peer, telegram_id in rows}
+    missing = [provision_id for provision_id in reports if provision_id not in peers]
+    if missing:
+        for provision in session.execute(select(Provision).where(Provision.id.in_(missing))).scalars():
+            peer = ActivePeer(provision_id=provision.id, node_id=provision.node_id, rx_bytes=0, tx_bytes=0)
+            peers[provision.id] = (peer, provision.telegram_id)
+    deltas: Dict[int, int] = {}
+    for provision_id, (peer, telegram_id) in peers.items():
+        rx_bytes, tx_bytes, latest_handshake = reports[provision_id]
+        previous = (peer.rx_bytes or 0) + (peer.tx_bytes or 0)
+        current = rx_bytes + tx_bytes
+        delta = current - previous if current >= previous else current
+        if delta:
+            deltas[telegram_id] = deltas.get(telegram_id, 0) + delta
+        peer.rx_bytes = rx_bytes
+        peer.tx_bytes = tx_bytes
+        peer.latest_handshake = latest_handshake
+        session.add(peer)
+    return deltas
+
+
+def ensure_user_traffic(
+    session: Session,
+    telegram_id: int,
+    plan: str,
+    *,
+    changes: Optional[List[QuotaChange]] = None,
+    now: Optional[datetime] = None,
+) -> UserTraffic:
+    """The user's counter, created for ``plan`` if missing and moved to a new period if the current one is over.
+
+    A user released from an enforced quota that way is appended to ``changes``.
+    """
+    now = now or datetime.utcnow()
+    traffic = session.get(UserTraffic, telegram_id)
+    if traffic is None:
+        traffic = UserTraffic(telegram_id=telegram_id, plan=plan, used_bytes=0, period_start=now)
+        session.add(traffic)
+        return traffic
+    change = roll_over_quota_period(traffic, get_traffic_quota(session, traffic.plan), now)
+    if change is not None and changes is not None:
+        changes.append(change)
+    return traffic
+
+
+def ensure_users_traffic(
+    session: Session,
+    plans: Mapping[int, str],
+    *,
+    changes: Optional[List[QuotaChange]] = None,
+    now: Optional[datetime] = None,
+) -> Dict[int, UserTraffic]:
+    """Bulk variant of :func:`ensure_user_traffic` for a ``{telegram_id: plan}`` mapping."""
+    if not plans:
+        return {}
+    now = now or datetime.utcnow()
+    query = select(UserTraffic).where(UserTraffic.telegram_id.in_(list(plans)))
+    rows = {traffic.telegram_id: traffic for traffic in session.execute(query).scalars()}
+    if rows:
+        query = select(TrafficQuota).where(TrafficQuota.plan.in_({traffic.plan for traffic in rows.values()}))
+        quotas = {quota.plan: quota for quota in session.execute(query).scalars()}
+        for traffic in rows.values():
+            change = roll_over_quota_period(traffic, quotas.get(traffic.plan), now)
+            if change is not None and changes is not None:
+                changes.append(change)
+    for telegram_id, plan in plans.items():
+        if telegram_id not in rows:
+            rows[telegram_id] = UserTraffic(telegram_id=telegram_id, plan=plan, used_bytes=0, period_start=now)
+            session.add(rows[telegram_id])
+    return rows
+
+
+def roll_over_quota_period(traffic: UserTraffic, quota: Optional[TrafficQuota], now: datetime) -> Optional[QuotaChange]:
+    """Start a new period once ``quota.period_days`` have passed: reset the counter and lift the enforcement.
+
+    Returns the release to apply to the user's devices if a quota was enforced. Usage reports
+    are not enough to notice the end of a period, since a revoked user has no devices to report.
+    """
+    period = timedelta(days=quota.period_days if quota else 30)
+    if now - traffic.period_start < period:
+        return None
+    traffic.period_start = now
+    traffic.used_bytes = 0
+    if traffic.enforced_action is None:
+        return None
+    change = QuotaChange(traffic.telegram_id, None, previous_action=traffic.enforced_action)
+    traffic.enforced_action = None
+    traffic.enforced_at = None
+    return change
+
+
+def accumulate_usage(
+    session: Session,
+    deltas: Mapping[int, int],
+    *,
+    default_plan: str,
+    now: Optional[datetime] = None,
+) -> List[QuotaChange]:
+    """Add ``deltas`` to the users' counters and return users whose quota state changed.
+
+    Costs two queries per report regardless of how many peers it carried: the quota rules and
+    the affected users' counters. The counters are read ``FOR UPDATE``, so concurrent reports
+    for the same user wait for each other instead of overwriting each other's increments (SQLite
+    serialises writers anyway). A user crossing the quota is marked as enforced right away so
+    that concurrent reports do not enforce twice; a user whose period rolled over is released.
+    """
+    if not deltas:
+        return []
+    now = now or datetime.utcnow()
+    quotas = {quota.plan: quota for quota in session.execute(select(TrafficQuota)).scalars()}
+    query = (
+        select(UserTraffic)
+        .where(UserTraffic.telegram_id.in_(sorted(deltas)))
+        .order_by(UserTraffic.telegram_id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    counters = {traffic.telegram_id: traffic for traffic in session.execute(query).scalars()}
+    changes: List[QuotaChange] = []
+    for telegram_id, delta in deltas.items():
+        traffic = counters.get(telegram_id)
+        if traffic is None:
+            traffic = UserTraffic(telegram_id=telegram_id, plan=default_plan, used_bytes=0, period_start=now)
+        quota = quotas.get(traffic.plan)
+        release = roll_over_quota_period(traffic, quota, now)
+        if release is not None:
+            changes.append(release)
+        traffic.used_bytes = (traffic.used_bytes or 0) + delta
+        if quota and traffic.enforced_action is None and traffic.used_bytes >= quota.quota_bytes:
+            traffic.enforced_action = quota.action
+            traffic.enforced_at = now
+            changes.append(QuotaChange(telegram_id, quota.action, throttle_kbps=quota.throttle_kbps))
+        session.add(traffic)
+    return changes
+
+
+def list_user_active_provisions(session: Session, telegram_id: int) -> List[Provision]:
+    query = select(Provision).where(
+        Provision.telegram_id == telegram_id,
+        Provision.status == ProvisionStatus.ACTIVE,
+    )
+    return session.execute(query).scalars().all()
+
+
+def get_traffic_quota(session: Session, plan: str) -> Optional[TrafficQuota]:
+    return session.execute(select(TrafficQuota).where(TrafficQuota.plan == plan)).scalars().first()
+
+
+def upsert_traffic_quota(
+    session: Session,
+    *,
+    plan: str,
+    quota_bytes: int,
+    period_days: int,
+    action: QuotaAction,
+    throttle_kbps: Optional[int],
+) -> TrafficQuota:
+    quota = get_traffic_quota(session, plan)
+    if quota is None:
+        quota = TrafficQuota(plan=plan)
+    quota.quota_bytes = quota_bytes
+    quota.period_days = period_days
+    quota.action = action
+    quota.throttle_kbps = throttle_kbps
+    session.add(quota)
+    return quota
@@ -0,0 +1,121 @@
+"""One-off schema and data migrations for databases created before a model change.
+
+``Base.metadata.create_all`` only creates missing tables, so columns and indexes added to
+existing tables are applied here. Every step is idempotent::
+
+    python -m db.migrations
+"""
+
+from __future__ import annotations
+
+import logging
+
+from sqlalchemy import and_, delete, exists, func, inspect, or_, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
+
+from .config import ENGINE, session_scope
+from .crud import get_or_create_ca_certificate
+from .models import Base, KeyPool, Provision, SmartDNSRule
+
+logger = logging.getLogger(__name__)
+
+
+def add_key_pool_ca_column(engine: Engine) -> None:
+    columns = {column["name"] for column in inspect(engine).get_columns("key_pools")}
+    if "ca_id" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE key_pools ADD COLUMN ca_id INTEGER REFERENCES ca_certificates(id)"))
+    logger.info("Added key_pools.ca_id")
+
+
+def make_key_pool_public_keys_unique(engine: Engine) -> None:
+    """Replace the plain ``key_pools.public_key`` index with the unique one of the model.
+
+    Duplicates have to go first. For each key the allocated row is kept, or else one that a
+    provision references, or else the oldest; free copies that no provision references are
+    deleted. Duplicates that are all in use have to be resolved by hand.
+    """
+    index = next(
+        (index for index in inspect(engine).get_indexes("key_pools") if index["column_names"] == ["public_key"]),
+        None,
+    )
+    if index is not None and index["unique"]:
+        return
+    other = aliased(KeyPool)
+    with session_scope() as session:
+        removed = session.execute(
+            delete(KeyPool)
+            .where(
+                KeyPool.allocated.is_(False),
+                KeyPool.public_key.is_not(None),
+                exists().where(
+                    other.public_key == KeyPool.public_key,
+                    other.id != KeyPool.id,
+                    or_(other.allocated.is_(True), exists().where(Provision.key_id == other.id), other.id < KeyPool.id),
+                ),
+                ~exists().where(Provision.key_id == KeyPool.id),
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        remaining = session.execute(
+            select(func.count())
+            .select_from(KeyPool)
+            .where(exists().where(and_(other.public_key == KeyPool.public_key, other.id != KeyPool.id)))
+        ).scalar()
+    if removed:
+        logger.info("Deleted %s duplicate free keys from key_pools", removed)
+    if remaining:
+        raise RuntimeError(f"{remaining} key_pools rows share a public key with another row in use; resolve them first")
+    if index is not None:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+    for model_index in KeyPool.__table__.indexes:
+        if [column.name for column in model_index.columns] == ["public_key"]:
+            model_index.create(bind=engine)
+    logger.info("Made key_pools.public_key unique")
+
+
+def create_missing_indexes(engine: Engine) -> None:
+    for model in (KeyPool, SmartDNSRule):
+        for index in model.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def deduplicate_ca_certificates(batch_size: int = 1000) -> int:
+    """Move inline ``key_pools.ca_certificate`` values into ``ca_certificates`` and return the rows updated."""
+    migrated = 0
+    while True:
+        with session_scope() as session:
+            rows = session.execute(
+                select(KeyPool.id, KeyPool.ca_certificate)
+                .where(KeyPool.ca_certificate.is_not(None), KeyPool.ca_id.is_(None))
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return migrated
+            by_ca: dict[int, list[int]] = {}
+            for key_id, pem in rows:
+                by_ca.setdefault(get_or_create_ca_certificate(session, pem).id, []).append(key_id)
+            for ca_id, key_ids in by_ca.items():
+                session.execute(
+                    update(KeyPool)
+                    .where(KeyPool.id.in_(key_ids))
+                    .values(ca_id=ca_id, ca_certificate=None)
+                )
+        migrated += len(rows)
+        logger.info("Linked %s key pool rows to ca_certificates", migrated)
+
+
+def migrate(engine: Engine = ENGINE) -> None:
+    Base.metadata.create_all(bind=engine)
+    add_key_pool_ca_column(engine)
+    make_key_pool_public_keys_unique(engine)
+    create_missing_indexes(engine)
+    deduplicate_ca_certificates()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate()
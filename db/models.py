@@ -48,21 +48,33 @@ class Node(Base):
     provisions = relationship("Provision", back_populates="node", cascade="all, delete-orphan")
 
 
+class CACertificate(Base):
+    __tablename__ = "ca_certificates"
+
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String(64), unique=True, nullable=False, index=True)
+    pem = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class KeyPool(Base):
     __tablename__ = "key_pools"
 
     id = Column(Integer, primary_key=True, index=True)
     node_id = Column(Integer, ForeignKey("nodes.id"), nullable=False, index=True)
-    public_key = Column(String(255))
+    public_key = Column(String(255), unique=True, index=True)
     private_key = Column(String(255))
     preshared_key = Column(String(255))
     certificate = Column(Text)
+    # Legacy inline CA; new rows reference ``ca_certificates`` through ``ca_id`` instead.
     ca_certificate = Column(Text)
+    ca_id = Column(Integer, ForeignKey("ca_certificates.id"), index=True)
     allocated = Column(Boolean, nullable=False, default=False)
     allocated_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
     node = relationship("Node", back_populates="key_pool")
+    ca = relationship("CACertificate")
     provision = relationship("Provision", back_populates="key", uselist=False)
 
 
@@ -104,6 +116,33 @@ class ActivePeer(Base):
     provision = relationship("Provision", back_populates="peer")
 
 
+class QuotaAction(str, enum.Enum):
+    THROTTLE = "throttle"
+    REVOKE = "revoke"
+
+
+class TrafficQuota(Base):
+    __tablename__ = "traffic_quotas"
+
+    id = Column(Integer, primary_key=True, index=True)
+    plan = Column(String(64), unique=True, nullable=False)
+    quota_bytes = Column(BigInteger, nullable=False)
+    period_days = Column(Integer, nullable=False, default=30)
+    action = Column(Enum(QuotaAction), nullable=False, default=QuotaAction.THROTTLE)
+    throttle_kbps = Column(Integer)
+
+
+class UserTraffic(Base):
+    __tablename__ = "user_traffic"
+
+    telegram_id = Column(BigInteger, primary_key=True)
+    plan = Column(String(64), nullable=False)
+    period_start = Column(DateTime, default=datetime.utcnow, nullable=False)
+    used_bytes = Column(BigInteger, nullable=False, default=0)
+    enforced_action = Column(Enum(QuotaAction))
+    enforced_at = Column(DateTime)
+
+
 class SmartDNSRule(Base):
     __tablename__ = "smartdns_rules"
 
@@ -113,5 +152,5 @@ class SmartDNSRule(Base):
     ttl = Column(Integer, nullable=False, default=60)
     is_active = Column(Boolean, nullable=False, default=True, index=True)
     source = Column(String(32))
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
 
@@ -0,0 +1,5 @@
+"""Runtime diagnostics shared by the provisioner and SmartDNS."""
+
+from .profiler import ProfileResult, ProfilerBusy, SamplingProfiler, start_profile_server
+
+__all__ = ["ProfileResult", "ProfilerBusy", "SamplingProfiler", "start_profile_server"]
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import CodeType, FrameType
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+@dataclass
+class ProfileResult:
+    stacks: Counter = field(default_factory=Counter)
+    samples: int = 0
+    duration: float = 0.0
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed format, one ``thread;outer;...;inner count`` line per stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": self.samples,
+            "duration": round(self.duration, 3),
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler over every thread of the process.
+
+    Nothing is installed while no profile runs: :meth:`profile` samples
+    ``sys._current_frames()`` from the calling thread every ``interval`` seconds and returns,
+    so the cost when idle is zero. Blocked threads are sampled too, which is what shows where
+    a slow request waits. Only one profile runs at a time.
+    """
+
+    def __init__(self, *, interval: float = 0.005, max_depth: int = 128) -> None:
+        self.interval = interval
+        self.max_depth = max_depth
+        self._running = threading.Lock()
+        self._labels: Dict[CodeType, str] = {}
+
+    def profile(self, seconds: float, *, thread_prefix: Optional[str] = None) -> ProfileResult:
+        if not self._running.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            return self._sample(seconds, thread_prefix)
+        finally:
+            self._running.release()
+
+    def _sample(self, seconds: float, thread_prefix: Optional[str]) -> ProfileResult:
+        result = ProfileResult()
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        started = time.monotonic()
+        deadline = started + seconds
+        while True:
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {thread.ident: thread.name for thread in threading.enumerate() if thread.ident}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if thread_prefix and not name.startswith(thread_prefix):
+                    continue
+                result.stacks[self._stack(name, frame)] += 1
+            result.samples += 1
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            time.sleep(min(self.interval, deadline - now))
+        result.duration = time.monotonic() - started
+        return result
+
+    def _stack(self, thread_name: str, frame: Optional[FrameType]) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        labels.append(thread_name.replace(";", ":").replace(" ", "_"))
+        return ";".join(reversed(labels))
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            name = getattr(code, "co_qualname", code.co_name)
+            # Collapsed stacks are split on ';' and the count follows the last space.
+            label = f"{name}({module}:{code.co_firstlineno})".replace(";", ":").replace(" ", "_")
+            self._labels[code] = label
+        return label
+
+
+def start_profile_server(
+    profiler: SamplingProfiler,
+    *,
+    host: str,
+    port: int,
+    token: str,
+    max_seconds: float = 60.0,
+) -> ThreadingHTTPServer:
+    """Serve ``GET /debug/profile?seconds=N&format=collapsed|json`` from a daemon thread.
+
+    For processes without a web framework. Requests need ``Authorization: Bearer <token>``.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802 - http.server naming
+            url = urlsplit(self.path)
+            if url.path != "/debug/profile":
+                self._reply(404, "text/plain", b"not found\n")
+                return
+            scheme, _, supplied = (self.headers.get("Authorization") or "").partition(" ")
+            if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.encode(), token.encode()):
+                self._reply(401, "text/plain", b"invalid token\n")
+                return
+            query = parse_qs(url.query)
+            try:
+                seconds = float(query.get("seconds", ["5"])[0])
+            except ValueError:
+                self._reply(400, "text/plain", b"seconds must be a number\n")
+                return
+            if not 0 < seconds <= max_seconds:
+                self._reply(400, "text/plain", f"seconds must be in (0, {max_seconds}]\n".encode())
+                return
+            try:
+                result = profiler.profile(seconds, thread_prefix=query.get("thread", [None])[0])
+            except ProfilerBusy as exc:
+                self._reply(409, "text/plain", f"{exc}\n".encode())
+                return
+            if query.get("format", ["collapsed"])[0] == "json":
+                self._reply(200, "application/json", json.dumps(result.to_dict()).encode())
+            else:
+                self._reply(200, "text/plain", result.collapsed().encode())
+
+        def _reply(self, status: int, content_type: str, body: bytes) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:  # noqa: A002 - http.server signature
+            logger.debug("profile server: " + format, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="profile-server", daemon=True).start()
+    return server
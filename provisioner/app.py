@@ -1,62 +1,153 @@
 from __future__ import annotations
 
+import asyncio
+import hmac
 import logging
 import os
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import AsyncIterator, BinaryIO
 
-from fastapi import FastAPI, HTTPException
+import anyio
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.concurrency import run_in_threadpool
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
-from statsd import StatsClient
-
-from db import session_scope
 
 from .config import ProvisionerSettings, get_settings
 
-SETTINGS = get_settings()
-os.environ.setdefault("DATABASE_URL", SETTINGS.database_url)
+# db builds its engine from DATABASE_URL when first imported, so a value set only in .env has to
+# reach the environment before that.
+os.environ.setdefault("DATABASE_URL", get_settings().database_url)
+
+from db import ENGINE, Base, read_session_scope, session_scope
+from diagnostics import ProfilerBusy, SamplingProfiler
 
+from .cleanup import S3DeletionQueue
+from .keys_import import KeyImportError, import_keys, iter_lines, iter_records
 from .metrics import PROVISION_ERRORS
-from .s3 import S3Uploader
+from .placement import PlacementEngine
 from .schemas import (
+    BatchProvisionRequest,
+    BatchProvisionResponse,
+    KeyImportResponse,
     ProvisionRequest,
     ProvisionResponse,
     RevokeRequest,
     RevokeResponse,
     StatsUpdateRequest,
     SwitchNodeRequest,
+    TrafficQuotaRequest,
+    TrafficQuotaResponse,
 )
 from .service import ProvisioningError, ProvisioningService
+from .stats_emitter import BufferedStatsClient
+from .storage import LocalObjectStore, build_object_store
 
 logger = logging.getLogger(__name__)
 
 
 def _build_service(settings: ProvisionerSettings) -> ProvisioningService:
-    statsd_client = StatsClient(host=settings.statsd_host, port=settings.statsd_port, prefix=settings.statsd_prefix)
-    s3_uploader = S3Uploader(
-        access_key=settings.s3_access_key,
-        secret_key=settings.s3_secret_key,
-        bucket=settings.s3_bucket,
-        region=settings.s3_region,
-        presign_ttl=settings.s3_presign_ttl,
-        endpoint_url=settings.s3_endpoint_url,
-        sse_algorithm=settings.s3_sse_algorithm,
-        sse_kms_key_id=settings.s3_sse_kms_key_id,
+    statsd_client = BufferedStatsClient(
+        host=settings.statsd_host,
+        port=settings.statsd_port,
+        prefix=settings.statsd_prefix,
+        flush_interval=settings.statsd_flush_interval,
+        max_packet_size=settings.statsd_max_packet_size,
+    )
+    s3_uploader = build_object_store(settings)
+    deletion_queue = S3DeletionQueue(
+        s3_uploader,
+        batch_size=settings.s3_delete_batch_size,
+        flush_interval=settings.s3_delete_flush_interval,
+        max_attempts=settings.s3_delete_max_attempts,
     )
+    placement = None
+    if settings.placement_strategy == "traffic":
+        placement = PlacementEngine(
+            read_session_scope,
+            refresh_interval=settings.placement_refresh_interval,
+            handshake_window=timedelta(minutes=settings.placement_handshake_window_minutes),
+        )
     return ProvisioningService(
         session_factory=session_scope,
         settings=settings,
         s3_uploader=s3_uploader,
         statsd=statsd_client,
+        deletion_queue=deletion_queue,
+        placement=placement,
+        read_session_factory=read_session_scope,
     )
 
 
-def create_app() -> FastAPI:
-    service = _build_service(SETTINGS)
-    app = FastAPI(title="Provisioner", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    settings: ProvisionerSettings = app.state.settings
+    if settings.auto_create_schema:
+        await run_in_threadpool(Base.metadata.create_all, bind=ENGINE)
+    service = await run_in_threadpool(_build_service, settings)
+    app.state.service = service
+    if service.placement is not None:
+        service.placement.start()
+    try:
+        yield
+    finally:
+        if service.placement is not None:
+            await run_in_threadpool(service.placement.stop)
+        if service.deletion_queue is not None:
+            await run_in_threadpool(service.deletion_queue.stop)
+        await run_in_threadpool(service.statsd.stop)
+
+
+class SendfileResponse(Response):
+    """Streams an open file, handing it to the server for ``sendfile`` when it supports zero-copy sends."""
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, handle: BinaryIO, *, media_type: str) -> None:
+        self.handle = handle
+        size = os.fstat(handle.fileno()).st_size
+        super().__init__(media_type=media_type, headers={"content-length": str(size)})
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD":
+                await send({"type": "http.response.body", "body": b""})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": self.handle})
+            else:
+                while chunk := await anyio.to_thread.run_sync(self.handle.read, self.chunk_size):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            self.handle.close()
+
+
+def get_service(request: Request) -> ProvisioningService:
+    return request.app.state.service
+
+
+def require_admin_token(request: Request, authorization: str | None = Header(None)) -> None:
+    expected = request.app.state.settings.admin_token
+    if not expected:
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def create_app(settings: ProvisionerSettings | None = None) -> FastAPI:
+    """Build the application; clients, background workers and the schema are set up in :func:`lifespan`."""
+    app = FastAPI(title="Provisioner", version="1.0.0", lifespan=lifespan)
+    app.state.settings = settings or get_settings()
+    app.state.profiler = SamplingProfiler()
 
     @app.post("/provision", response_model=ProvisionResponse)
-    async def provision_endpoint(request: ProvisionRequest) -> ProvisionResponse:
+    async def provision_endpoint(
+        request: ProvisionRequest,
+        service: ProvisioningService = Depends(get_service),
+    ) -> ProvisionResponse:
         try:
             return await run_in_threadpool(service.provision, request)
         except ProvisioningError as exc:
@@ -69,8 +160,26 @@ def create_app() -> FastAPI:
             logger.exception("Provision failed")
             raise HTTPException(status_code=500, detail="Internal server error")
 
+    @app.post("/provision/batch", response_model=BatchProvisionResponse)
+    async def provision_batch_endpoint(
+        request: BatchProvisionRequest,
+        service: ProvisioningService = Depends(get_service),
+    ) -> BatchProvisionResponse:
+        try:
+            return await run_in_threadpool(service.provision_batch, request.items)
+        except ProvisioningError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        except Exception:
+            PROVISION_ERRORS.inc(len(request.items))
+            service.statsd.incr("provision.error", len(request.items))
+            logger.exception("Batch provision failed")
+            raise HTTPException(status_code=500, detail="Internal server error")
+
     @app.post("/revoke", response_model=RevokeResponse)
-    async def revoke_endpoint(request: RevokeRequest) -> RevokeResponse:
+    async def revoke_endpoint(
+        request: RevokeRequest,
+        service: ProvisioningService = Depends(get_service),
+    ) -> RevokeResponse:
         try:
             await run_in_threadpool(service.revoke, request.telegram_id, request.device_id)
             return RevokeResponse(device_id=request.device_id, status="revoked")
@@ -81,7 +190,10 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail="Internal server error")
 
     @app.post("/switch_node", response_model=ProvisionResponse)
-    async def switch_node(request: SwitchNodeRequest) -> ProvisionResponse:
+    async def switch_node(
+        request: SwitchNodeRequest,
+        service: ProvisioningService = Depends(get_service),
+    ) -> ProvisionResponse:
         try:
             return await run_in_threadpool(service.switch_node, request)
         except ProvisioningError as exc:
@@ -91,14 +203,136 @@ def create_app() -> FastAPI:
             raise HTTPException(status_code=500, detail="Internal server error")
 
     @app.post("/stats/peers")
-    async def stats_endpoint(request: StatsUpdateRequest) -> JSONResponse:
+    async def stats_endpoint(
+        request: StatsUpdateRequest,
+        service: ProvisioningService = Depends(get_service),
+    ) -> JSONResponse:
         await run_in_threadpool(service.refresh_peer_stats, request.peers)
         return JSONResponse({"status": "ok"})
 
     @app.get("/nodes")
-    async def list_nodes() -> JSONResponse:
-        data = await run_in_threadpool(service.list_nodes)
-        return JSONResponse(data)
+    async def list_nodes(request: Request, service: ProvisioningService = Depends(get_service)) -> Response:
+        directory = service.directory
+        snapshot = directory.current() or await run_in_threadpool(directory.get)
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+        requested = {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}
+        if snapshot.etag in requested or "*" in requested:
+            return Response(status_code=304, headers=headers)
+        return Response(snapshot.body, media_type="application/json", headers=headers)
+
+    @app.get("/nodes/events")
+    async def node_events(request: Request, service: ProvisioningService = Depends(get_service)) -> StreamingResponse:
+        directory = service.directory
+        keepalive = service.settings.node_events_keepalive
+
+        async def stream():
+            loop = asyncio.get_running_loop()
+            changed = directory.subscribe()
+            last_version = 0
+            last_write = loop.time()
+            try:
+                while not await request.is_disconnected():
+                    snapshot = directory.current() or await run_in_threadpool(directory.get)
+                    if snapshot.version != last_version:
+                        last_version = snapshot.version
+                        last_write = loop.time()
+                        yield b"id: %d\nevent: nodes\ndata: %s\n\n" % (snapshot.version, snapshot.body)
+                    elif loop.time() - last_write >= keepalive:
+                        last_write = loop.time()
+                        yield b": keepalive\n\n"
+                    try:
+                        await asyncio.wait_for(changed.wait(), timeout=directory.ttl)
+                    except asyncio.TimeoutError:
+                        pass
+                    changed.clear()
+            finally:
+                directory.unsubscribe(changed)
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @app.post(
+        "/nodes/{node_id}/keys/import",
+        response_model=KeyImportResponse,
+        dependencies=[Depends(require_admin_token)],
+    )
+    async def import_keys_endpoint(
+        node_id: int,
+        request: Request,
+        fmt: str = Query("ndjson", alias="format"),
+        service: ProvisioningService = Depends(get_service),
+    ) -> KeyImportResponse:
+        body = request.stream()
+
+        async def next_chunk() -> bytes | None:
+            try:
+                return await body.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        def read_body():
+            # Runs in the worker thread and pulls the request body from the event loop chunk by chunk.
+            while (chunk := anyio.from_thread.run(next_chunk)) is not None:
+                yield chunk
+
+        try:
+            return await run_in_threadpool(
+                import_keys,
+                session_scope,
+                node_id,
+                iter_records(iter_lines(read_body()), fmt),
+                batch_size=service.settings.key_import_batch_size,
+            )
+        except KeyImportError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+    @app.put(
+        "/quotas/{plan}",
+        response_model=TrafficQuotaResponse,
+        dependencies=[Depends(require_admin_token)],
+    )
+    async def set_quota(
+        plan: str,
+        request: TrafficQuotaRequest,
+        service: ProvisioningService = Depends(get_service),
+    ) -> TrafficQuotaResponse:
+        return await run_in_threadpool(service.set_traffic_quota, plan, request)
+
+    @app.api_route("/objects/{key:path}", methods=["GET", "HEAD"])
+    async def object_endpoint(
+        key: str,
+        expires: int = Query(...),
+        signature: str = Query(...),
+        service: ProvisioningService = Depends(get_service),
+    ) -> Response:
+        store = service.s3
+        if not isinstance(store, LocalObjectStore):
+            raise HTTPException(status_code=404, detail="Not found")
+        if not store.verify(key, expires, signature):
+            raise HTTPException(status_code=403, detail="Invalid or expired signature")
+        handle = await run_in_threadpool(store.open, key)
+        if handle is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        return SendfileResponse(handle, media_type=store.content_type(key))
+
+    @app.get("/debug/profile", dependencies=[Depends(require_admin_token)])
+    async def profile_endpoint(
+        request: Request,
+        seconds: float = Query(5.0, gt=0),
+        format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+        thread: str | None = Query(None, description="only threads whose name starts with this"),
+    ) -> Response:
+        settings: ProvisionerSettings = request.app.state.settings
+        if not settings.profiler_enabled:
+            raise HTTPException(status_code=404, detail="Not found")
+        if seconds > settings.profiler_max_seconds:
+            raise HTTPException(status_code=400, detail=f"seconds must not exceed {settings.profiler_max_seconds}")
+        try:
+            result = await run_in_threadpool(request.app.state.profiler.profile, seconds, thread_prefix=thread)
+        except ProfilerBusy as exc:
+            raise HTTPException(status_code=409, detail=str(exc))
+        if format == "json":
+            return JSONResponse(result.to_dict())
+        return PlainTextResponse(result.collapsed())
 
     @app.get("/metrics")
     async def metrics() -> Response:
@@ -111,4 +345,9 @@ def create_app() -> FastAPI:
     return app
 
 
-app = create_app()
+def __getattr__(name: str) -> FastAPI:
+    # Keeps ``uvicorn provisioner.app:app`` working without building the app on every import.
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
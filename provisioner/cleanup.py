@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Deque, Iterable, List, Optional, Sequence
+
+from db.crud import list_referenced_s3_keys
+
+from .metrics import S3_DELETE_FAILURES, S3_OBJECTS_DELETED
+from .s3 import MAX_DELETE_BATCH
+from .storage import ObjectStore, build_object_store
+
+logger = logging.getLogger(__name__)
+
+OBJECT_PREFIXES = ("configs/", "qrs/")
+
+
+class S3DeletionQueue:
+    """Collects object keys of revoked provisions and deletes them in DeleteObjects batches.
+
+    Keys are flushed from a background thread once ``batch_size`` keys are pending or
+    ``flush_interval`` seconds have passed. Keys that still fail after the uploader's retries
+    are dropped and left for :func:`sweep_orphaned_objects` to reconcile.
+    """
+
+    def __init__(
+        self,
+        uploader: ObjectStore,
+        *,
+        batch_size: int = MAX_DELETE_BATCH,
+        flush_interval: float = 5.0,
+        max_attempts: int = 3,
+    ) -> None:
+        self.uploader = uploader
+        self.batch_size = min(batch_size, MAX_DELETE_BATCH)
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._pending: Deque[str] = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, keys: Iterable[Optional[str]]) -> None:
+        with self._lock:
+            self._pending.extend(key for key in keys if key)
+            pending = len(self._pending)
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(target=self._run, name="s3-deletion-queue", daemon=True)
+                self._thread.start()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Delete everything pending right now and return the number of removed objects."""
+        deleted = 0
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return deleted
+                failed = self.uploader.delete_objects(batch, max_attempts=self.max_attempts)
+                deleted += len(batch) - len(failed)
+                S3_OBJECTS_DELETED.inc(len(batch) - len(failed))
+                if failed:
+                    S3_DELETE_FAILURES.inc(len(failed))
+                    logger.error("Failed to delete %s S3 objects, leaving them to the sweeper", len(failed))
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _take_batch(self) -> List[str]:
+        with self._lock:
+            count = min(self.batch_size, len(self._pending))
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("S3 deletion flush failed")
+
+
+@dataclass
+class SweepReport:
+    scanned: int = 0
+    orphaned: int = 0
+    deleted: int = 0
+    failed: int = 0
+
+
+def sweep_orphaned_objects(
+    session_factory: Callable,
+    uploader: ObjectStore,
+    *,
+    prefixes: Sequence[str] = OBJECT_PREFIXES,
+    grace_seconds: int = 3600,
+    dry_run: bool = False,
+    max_attempts: int = 3,
+) -> SweepReport:
+    """Delete bucket objects that no active provision references.
+
+    The listing is streamed page by page and each page costs one lookup query, so memory stays
+    bounded by the page size. Objects younger than ``grace_seconds`` are skipped because a
+    provision uploads its files before the row is committed.
+    """
+    report = SweepReport()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+    for prefix in prefixes:
+        for page in uploader.iter_object_pages(prefix):
+            report.scanned += len(page)
+            candidates = [item["Key"] for item in page if item["LastModified"] < cutoff]
+            if not candidates:
+                continue
+            with session_factory() as session:
+                referenced = list_referenced_s3_keys(session, candidates)
+            orphans = [key for key in candidates if key not in referenced]
+            report.orphaned += len(orphans)
+            if dry_run or not orphans:
+                continue
+            failed = uploader.delete_objects(orphans, max_attempts=max_attempts)
+            report.deleted += len(orphans) - len(failed)
+            report.failed += len(failed)
+            S3_OBJECTS_DELETED.inc(len(orphans) - len(failed))
+            if failed:
+                S3_DELETE_FAILURES.inc(len(failed))
+    return report
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    from db import session_scope
+
+    from .config import get_settings
+
+    parser = argparse.ArgumentParser(description="Remove S3 objects left behind by revoked provisions")
+    parser.add_argument("--dry-run", action="store_true", help="only report orphaned objects")
+    parser.add_argument("--grace-seconds", type=int, default=None, help="skip objects younger than this")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    settings = get_settings()
+    grace = settings.s3_orphan_grace_seconds if args.grace_seconds is None else args.grace_seconds
+    # Ask the primary: a lagging replica may not list the newest provisions yet, and their objects
+    # would be deleted as orphans.
+    report = sweep_orphaned_objects(
+        session_scope,
+        build_object_store(settings),
+        grace_seconds=grace,
+        dry_run=args.dry_run,
+        max_attempts=settings.s3_delete_max_attempts,
+    )
+    logger.info(
+        "Scanned %s objects: %s orphaned, %s deleted, %s failed",
+        report.scanned,
+        report.orphaned,
+        report.deleted,
+        report.failed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,49 @@ from __future__ import annotations
 from functools import lru_cache
 from typing import Optional
 
-from pydantic import BaseSettings, Field
+from pydantic import BaseSettings, Field, field_validator
 
 
 class ProvisionerSettings(BaseSettings):
     database_url: str = Field("sqlite:///./provisioner.db", alias="DATABASE_URL")
+    auto_create_schema: bool = Field(False, alias="DB_AUTO_CREATE_SCHEMA")
     max_devices_per_user: int = Field(3, alias="MAX_DEVICES_PER_USER", ge=1)
+    object_store_backend: str = Field("s3", alias="OBJECT_STORE_BACKEND")
+    local_store_path: str = Field("./objects", alias="LOCAL_STORE_PATH")
+    local_store_base_url: str = Field("http://localhost:8000", alias="LOCAL_STORE_BASE_URL")
+    local_store_secret: Optional[str] = Field(None, alias="LOCAL_STORE_SECRET")
     s3_bucket: str = Field("local-bucket", alias="S3_BUCKET")
     s3_access_key: str = Field("local", alias="S3_ACCESS_KEY")
     s3_secret_key: str = Field("local", alias="S3_SECRET_KEY")
     s3_region: str = Field("us-east-1", alias="S3_REGION")
     s3_endpoint_url: Optional[str] = Field(None, alias="S3_ENDPOINT_URL")
     s3_presign_ttl: int = Field(900, alias="S3_PRESIGN_TTL", ge=60)
+    s3_presign_cache_size: int = Field(10000, alias="S3_PRESIGN_CACHE_SIZE", ge=0)
+    s3_presign_cache_margin: int = Field(60, alias="S3_PRESIGN_CACHE_MARGIN", ge=0)
+    s3_fast_presign: bool = Field(True, alias="S3_FAST_PRESIGN")
     s3_sse_algorithm: str = Field("AES256", alias="S3_SSE_ALGORITHM")
     s3_sse_kms_key_id: Optional[str] = Field(None, alias="S3_SSE_KMS_KEY_ID")
+    s3_delete_batch_size: int = Field(1000, alias="S3_DELETE_BATCH_SIZE", ge=1, le=1000)
+    s3_delete_flush_interval: float = Field(5.0, alias="S3_DELETE_FLUSH_INTERVAL", gt=0)
+    s3_delete_max_attempts: int = Field(3, alias="S3_DELETE_MAX_ATTEMPTS", ge=1)
+    s3_orphan_grace_seconds: int = Field(3600, alias="S3_ORPHAN_GRACE_SECONDS", ge=0)
     statsd_host: str = Field("localhost", alias="STATSD_HOST")
     statsd_port: int = Field(8125, alias="STATSD_PORT")
     statsd_prefix: str = Field("provisioner", alias="STATSD_PREFIX")
+    statsd_flush_interval: float = Field(1.0, alias="STATSD_FLUSH_INTERVAL", gt=0)
+    statsd_max_packet_size: int = Field(1432, alias="STATSD_MAX_PACKET_SIZE", ge=512)
+    placement_strategy: str = Field("traffic", alias="PLACEMENT_STRATEGY")
+    placement_refresh_interval: float = Field(15.0, alias="PLACEMENT_REFRESH_INTERVAL", gt=0)
+    placement_handshake_window_minutes: int = Field(3, alias="PLACEMENT_HANDSHAKE_WINDOW_MINUTES", ge=1)
+    node_directory_ttl: float = Field(5.0, alias="NODE_DIRECTORY_TTL", gt=0)
+    node_events_keepalive: float = Field(15.0, alias="NODE_EVENTS_KEEPALIVE", gt=0)
+    default_plan: str = Field("default", alias="DEFAULT_PLAN")
+    admin_token: Optional[str] = Field(None, alias="PROVISIONER_ADMIN_TOKEN")
+    key_import_batch_size: int = Field(5000, alias="KEY_IMPORT_BATCH_SIZE", ge=1)
+    provision_batch_max_items: int = Field(500, alias="PROVISION_BATCH_MAX_ITEMS", ge=1)
+    provision_batch_workers: int = Field(8, alias="PROVISION_BATCH_WORKERS", ge=1)
+    profiler_enabled: bool = Field(False, alias="PROFILER_ENABLED")
+    profiler_max_seconds: float = Field(60.0, alias="PROFILER_MAX_SECONDS", gt=0)
     qr_error_correction: str = Field("M", alias="QR_ERROR_CORRECTION")
     amnezia_cli_path: str = Field("amnezia", alias="AMNEZIA_CLI_PATH")
 
@@ -27,6 +53,24 @@ class ProvisionerSettings(BaseSettings):
         env_file = ".env"
         env_file_encoding = "utf-8"
 
+    @field_validator("placement_strategy")
+    @classmethod
+    def _validate_placement(cls, value: str) -> str:
+        allowed = {"traffic", "devices"}
+        normalized = value.lower()
+        if normalized not in allowed:
+            raise ValueError(f"placement_strategy must be one of {allowed}")
+        return normalized
+
+    @field_validator("object_store_backend")
+    @classmethod
+    def _validate_object_store(cls, value: str) -> str:
+        allowed = {"s3", "local"}
+        normalized = value.lower()
+        if normalized not in allowed:
+            raise ValueError(f"object_store_backend must be one of {allowed}")
+        return normalized
+
 
 @lru_cache()
 def get_settings() -> ProvisionerSettings:
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set, Tuple
+
+
+@dataclass(frozen=True)
+class NodeSnapshot:
+    version: int
+    nodes: List[dict]
+    body: bytes
+    etag: str
+    loaded_at: float
+
+
+class NodeDirectory:
+    """In-process snapshot of ``GET /nodes`` with a pre-serialised body and ETag.
+
+    The snapshot is reloaded when it is older than ``ttl`` seconds or after :meth:`invalidate`
+    is called by a write. Concurrent reloads are coalesced into a single query. The version is
+    bumped only when the serialised body changes, and async subscribers are woken up on every
+    invalidation so they can stream capacity changes.
+    """
+
+    def __init__(self, loader: Callable[[], List[dict]], *, ttl: float = 5.0) -> None:
+        self._loader = loader
+        self.ttl = ttl
+        self._snapshot: Optional[NodeSnapshot] = None
+        self._dirty = True
+        self._refresh_lock = threading.Lock()
+        self._subscribers_lock = threading.Lock()
+        self._subscribers: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def current(self) -> Optional[NodeSnapshot]:
+        """Return the snapshot if it is still fresh, without touching the database."""
+        snapshot = self._snapshot
+        if snapshot is None or self._dirty or time.monotonic() - snapshot.loaded_at >= self.ttl:
+            return None
+        return snapshot
+
+    def get(self) -> NodeSnapshot:
+        snapshot = self.current()
+        if snapshot is not None:
+            return snapshot
+        with self._refresh_lock:
+            snapshot = self.current()
+            if snapshot is not None:
+                return snapshot
+            # Cleared before loading so an invalidation during the load is not lost.
+            self._dirty = False
+            try:
+                nodes = self._loader()
+            except Exception:
+                self._dirty = True
+                raise
+            body = json.dumps(nodes, separators=(",", ":")).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            previous = self._snapshot
+            if previous is not None and previous.etag == etag:
+                version = previous.version
+            else:
+                version = previous.version + 1 if previous is not None else 1
+            self._snapshot = NodeSnapshot(
+                version=version,
+                nodes=nodes,
+                body=body,
+                etag=etag,
+                loaded_at=time.monotonic(),
+            )
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        self._dirty = True
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    def subscribe(self) -> asyncio.Event:
+        """Register an event that is set whenever the directory is invalidated."""
+        event = asyncio.Event()
+        with self._subscribers_lock:
+            self._subscribers.add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, event: asyncio.Event) -> None:
+        with self._subscribers_lock:
+            self._subscribers = {item for item in self._subscribers if item[1] is not event}
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import binascii
+import codecs
+import csv
+import json
+import logging
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from pydantic import ValidationError
+
+from db.crud import insert_keys
+from db.models import Node, NodeType
+
+from .schemas import KeyImportBatch, KeyImportResponse, KeyImportRow
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("ndjson", "csv")
+MAX_REPORTED_ERRORS = 100
+
+Record = Tuple[int, Optional[dict], Optional[str]]
+
+
+class KeyImportError(ValueError):
+    pass
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Split a stream of byte chunks into text lines, keeping line endings for the csv module."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    for chunk in chunks:
+        tail += decoder.decode(chunk)
+        lines = tail.splitlines(keepends=True)
+        # A trailing "\r" may be the first half of a "\r\n" split across chunks.
+        tail = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_records(lines: Iterable[str], fmt: str) -> Iterator[Record]:
+    """Yield ``(line_number, row, error)`` tuples from NDJSON or CSV lines."""
+    if fmt == "ndjson":
+        for line_no, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield line_no, None, f"line {line_no}: invalid JSON ({exc.msg})"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, f"line {line_no}: expected a JSON object"
+                continue
+            yield line_no, row, None
+    elif fmt == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if None in row:
+                yield reader.line_num, None, f"line {reader.line_num}: too many columns"
+                continue
+            yield reader.line_num, {key: value or None for key, value in row.items()}, None
+    else:
+        raise KeyImportError(f"format must be one of {SUPPORTED_FORMATS}")
+
+
+def _is_wireguard_key(value: str) -> bool:
+    try:
+        return len(base64.b64decode(value, validate=True)) == 32
+    except (binascii.Error, ValueError):
+        return False
+
+
+def _validate(node_type: NodeType, row: KeyImportRow) -> Optional[str]:
+    if node_type is NodeType.WIREGUARD:
+        for field in ("public_key", "private_key", "preshared_key"):
+            value = getattr(row, field)
+            if value is not None and not _is_wireguard_key(value):
+                return f"{field} is not a base64 WireGuard key"
+    elif node_type is NodeType.OPENVPN:
+        if not row.certificate or "BEGIN CERTIFICATE" not in row.certificate:
+            return "certificate must be a PEM certificate"
+        if row.ca_certificate and "BEGIN CERTIFICATE" not in row.ca_certificate:
+            return "ca_certificate must be a PEM certificate"
+    return None
+
+
+def import_keys(
+    session_factory: Callable,
+    node_id: int,
+    records: Iterable[Record],
+    *,
+    batch_size: int = 5000,
+    on_batch: Optional[Callable[[KeyImportBatch], None]] = None,
+) -> KeyImportResponse:
+    """Validate ``records`` and insert them into ``key_pools`` for ``node_id``.
+
+    Rows are buffered up to ``batch_size`` and each batch is written in its own transaction,
+    so memory stays bounded and a failure only loses the current batch. Duplicate public keys
+    are skipped, both inside a batch and against rows already stored, including rows another
+    import commits at the same time (the unique index decides).
+    """
+    with session_factory() as session:
+        node = session.get(Node, node_id)
+        if node is None:
+            raise KeyImportError("Node not found")
+        node_type = node.type
+    if node_type not in {NodeType.WIREGUARD, NodeType.OPENVPN}:
+        raise KeyImportError(f"{node_type.value} nodes do not use a key pool")
+
+    report = KeyImportResponse(node_id=node_id, inserted=0, duplicates=0, invalid=0, batches=[], errors=[])
+    pending: Dict[str, dict] = {}
+    invalid = 0
+    duplicates = 0
+
+    def error(message: str) -> None:
+        if len(report.errors) < MAX_REPORTED_ERRORS:
+            report.errors.append(message)
+
+    def flush() -> None:
+        nonlocal invalid, duplicates
+        with session_factory() as session:
+            inserted = insert_keys(session, node_id, list(pending.values()))
+        progress = KeyImportBatch(
+            batch=len(report.batches) + 1,
+            inserted=inserted,
+            duplicates=duplicates + len(pending) - inserted,
+            invalid=invalid,
+        )
+        report.batches.append(progress)
+        report.inserted += progress.inserted
+        report.duplicates += progress.duplicates
+        report.invalid += progress.invalid
+        logger.info(
+            "Key import for node %s: batch %s inserted %s, %s duplicates, %s invalid",
+            node_id,
+            progress.batch,
+            progress.inserted,
+            progress.duplicates,
+            progress.invalid,
+        )
+        if on_batch is not None:
+            on_batch(progress)
+        pending.clear()
+        invalid = duplicates = 0
+
+    for line_no, raw, problem in records:
+        if raw is None:
+            invalid += 1
+            error(problem or f"line {line_no}: unreadable row")
+        else:
+            try:
+                row = KeyImportRow.model_validate(raw)
+            except ValidationError as exc:
+                invalid += 1
+                error(f"line {line_no}: {exc.errors()[0]['loc'][0]} {exc.errors()[0]['msg']}")
+            else:
+                problem = _validate(node_type, row)
+                if problem:
+                    invalid += 1
+                    error(f"line {line_no}: {problem}")
+                elif row.public_key in pending:
+                    duplicates += 1
+                else:
+                    pending[row.public_key] = row.model_dump()
+        if len(pending) >= batch_size:
+            flush()
+    if pending or invalid or duplicates:
+        flush()
+    return report
+
+
+def _read_file(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    with open(path, "rb") as handle:
+        while chunk := handle.read(chunk_size):
+            yield chunk
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Import WireGuard keys or OpenVPN certificates into a node key pool")
+    parser.add_argument("path", help="NDJSON or CSV file with public_key, private_key, ... columns")
+    parser.add_argument("--node", type=int, required=True, help="target node id")
+    parser.add_argument("--format", choices=SUPPORTED_FORMATS, default=None, help="defaults to the file extension")
+    parser.add_argument("--url", help="provisioner base URL; imports directly into DATABASE_URL when omitted")
+    parser.add_argument("--token", help="PROVISIONER_ADMIN_TOKEN for --url imports")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    if args.url:
+        import httpx
+
+        response = httpx.post(
+            f"{args.url.rstrip('/')}/nodes/{args.node}/keys/import",
+            params={"format": fmt},
+            headers={"Authorization": f"Bearer {args.token or ''}"},
+            content=_read_file(args.path),
+            timeout=None,
+        )
+        response.raise_for_status()
+        print(json.dumps(response.json(), indent=2, ensure_ascii=False))
+        return
+
+    from db import session_scope
+
+    from .config import get_settings
+
+    batch_size = args.batch_size or get_settings().key_import_batch_size
+    report = import_keys(
+        session_scope,
+        args.node,
+        iter_records(iter_lines(_read_file(args.path)), fmt),
+        batch_size=batch_size,
+        on_batch=lambda progress: print(progress.model_dump_json()),
+    )
+    print(json.dumps({"inserted": report.inserted, "duplicates": report.duplicates, "invalid": report.invalid}))
+    for message in report.errors:
+        print(message)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,3 +7,10 @@ PROVISION_REQUESTS = Counter("provision_requests_total", "Successful provision o
 PROVISION_ERRORS = Counter("provision_errors_total", "Provision errors")
 REVOCATION_REQUESTS = Counter("provision_revocations_total", "Revocation operations")
 SWITCH_REQUESTS = Counter("provision_switch_total", "Switch node operations")
+S3_OBJECTS_DELETED = Counter("provision_s3_objects_deleted_total", "S3 objects removed after revocation")
+S3_DELETE_FAILURES = Counter("provision_s3_delete_failures_total", "S3 objects that could not be deleted")
+QUOTA_ENFORCEMENTS = Counter(
+    "provision_quota_enforcements_total",
+    "Traffic quota actions applied to users",
+    labelnames=("action",),
+)
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional
+
+from db.crud import node_load_stats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class NodeLoad:
+    node_id: int
+    max_devices: int
+    current_devices: int
+    transferred_bytes: int
+    active_peers: int
+
+
+@dataclass
+class NodeScore:
+    node_id: int
+    max_devices: int
+    devices: int
+    active_peers: int
+    throughput_bps: float
+    pending: int = 0
+
+
+class PlacementEngine:
+    """Ranks nodes by live traffic, recent handshakes and free capacity.
+
+    Aggregated peer counters are pulled with one query per refresh; throughput is the delta of
+    the node's byte counters between two refreshes. :meth:`choose` only reads the in-memory
+    scores, so placing a device costs no extra queries. Devices placed between refreshes are
+    counted as pending and charged the average per-peer throughput so that a burst of
+    provisions does not land on a single node.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        *,
+        refresh_interval: float = 15.0,
+        handshake_window: timedelta = timedelta(minutes=3),
+        throughput_weight: float = 0.5,
+        activity_weight: float = 0.3,
+        capacity_weight: float = 0.2,
+    ) -> None:
+        self._session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.handshake_window = handshake_window
+        self.throughput_weight = throughput_weight
+        self.activity_weight = activity_weight
+        self.capacity_weight = capacity_weight
+        self._lock = threading.Lock()
+        self._scores: Dict[int, NodeScore] = {}
+        self._totals: Dict[int, tuple[int, float]] = {}
+        self._peer_bps = 0.0
+        self._reference_bps = 1.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="placement-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self) -> None:
+        since = datetime.utcnow() - self.handshake_window
+        with self._session_factory() as session:
+            rows = node_load_stats(session, since)
+        self.update((NodeLoad(*row) for row in rows), now=time.monotonic())
+
+    def update(self, loads: Iterable[NodeLoad], *, now: float) -> None:
+        scores: Dict[int, NodeScore] = {}
+        totals: Dict[int, tuple[int, float]] = {}
+        for load in loads:
+            previous = self._totals.get(load.node_id)
+            throughput = 0.0
+            if previous is not None and now > previous[1]:
+                # Counters drop when peers are revoked; treat that as no traffic rather than negative.
+                throughput = max(load.transferred_bytes - previous[0], 0) / (now - previous[1])
+            totals[load.node_id] = (load.transferred_bytes, now)
+            scores[load.node_id] = NodeScore(
+                node_id=load.node_id,
+                max_devices=load.max_devices,
+                devices=load.current_devices,
+                active_peers=load.active_peers,
+                throughput_bps=throughput,
+            )
+        active = sum(score.active_peers for score in scores.values())
+        total_bps = sum(score.throughput_bps for score in scores.values())
+        with self._lock:
+            self._totals = totals
+            self._scores = scores
+            self._peer_bps = total_bps / active if active else 0.0
+            self._reference_bps = max((score.throughput_bps for score in scores.values()), default=0.0) or 1.0
+
+    def choose(self) -> Optional[int]:
+        """Return the id of the least loaded node with free capacity and reserve a slot on it."""
+        with self._lock:
+            best: Optional[NodeScore] = None
+            best_value = 0.0
+            for score in self._scores.values():
+                if score.devices + score.pending >= score.max_devices:
+                    continue
+                value = self._score(score)
+                if best is None or value < best_value:
+                    best, best_value = score, value
+            if best is None:
+                return None
+            best.pending += 1
+            return best.node_id
+
+    def release(self, node_id: int) -> None:
+        """Give back a slot reserved by :meth:`choose` for a device that was not created."""
+        with self._lock:
+            score = self._scores.get(node_id)
+            if score is not None and score.pending > 0:
+                score.pending -= 1
+
+    def snapshot(self) -> Dict[int, float]:
+        with self._lock:
+            return {node_id: self._score(score) for node_id, score in self._scores.items()}
+
+    def _score(self, score: NodeScore) -> float:
+        capacity = max(score.max_devices, 1)
+        throughput = score.throughput_bps + score.pending * self._peer_bps
+        return (
+            self.throughput_weight * throughput / self._reference_bps
+            + self.activity_weight * (score.active_peers + score.pending) / capacity
+            + self.capacity_weight * (score.devices + score.pending) / capacity
+        )
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh node placement scores")
+            self._stopped.wait(self.refresh_interval)
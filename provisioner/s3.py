@@ -1,16 +1,27 @@
 from __future__ import annotations
 
 import logging
-from typing import Optional
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Iterator, List, Optional, Sequence
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
 
+from .presign import PresignCache, SigV4Presigner
+from .storage import ObjectStore
+
+if TYPE_CHECKING:
+    from .config import ProvisionerSettings
 
 logger = logging.getLogger(__name__)
 
+# Hard limit of a single DeleteObjects call.
+MAX_DELETE_BATCH = 1000
+
+PRESIGN_PROBE_KEY = "presign-probe"
 
-class S3Uploader:
+
+class S3Uploader(ObjectStore):
     def __init__(
         self,
         *,
@@ -22,15 +33,22 @@ class S3Uploader:
         endpoint_url: Optional[str] = None,
         sse_algorithm: Optional[str] = None,
         sse_kms_key_id: Optional[str] = None,
+        presign_cache_size: int = 10000,
+        presign_cache_margin: int = 60,
+        fast_presign: bool = True,
     ) -> None:
-        session = boto3.session.Session()
-        self.client = session.client(
-            "s3",
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=region,
-            endpoint_url=endpoint_url,
-        )
+        self._client_options = {
+            "aws_access_key_id": access_key,
+            "aws_secret_access_key": secret_key,
+            "region_name": region,
+            "endpoint_url": endpoint_url,
+        }
+        self._client: Any = None
+        self._client_lock = threading.Lock()
+        self._presigner: Optional[SigV4Presigner] = None
+        self._presigner_ready = not fast_presign
+        self._presigner_lock = threading.Lock()
+        self._presign_cache = PresignCache(ttl=presign_ttl, margin=presign_cache_margin, maxsize=presign_cache_size)
         self.bucket = bucket
         self.presign_ttl = presign_ttl
         self._sse_params: dict[str, str] = {}
@@ -39,6 +57,36 @@ class S3Uploader:
         if sse_kms_key_id:
             self._sse_params["SSEKMSKeyId"] = sse_kms_key_id
 
+    @property
+    def client(self) -> Any:
+        # boto3 is slow to import and to build a client, so both wait for the first S3 call.
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    # SigV4 everywhere: SigV2 presigned URLs are rejected by newer regions and buckets.
+                    config = Config(signature_version="s3v4")
+                    self._client = boto3.session.Session().client("s3", config=config, **self._client_options)
+        return self._client
+
+    @classmethod
+    def from_settings(cls, settings: "ProvisionerSettings") -> "S3Uploader":
+        return cls(
+            access_key=settings.s3_access_key,
+            secret_key=settings.s3_secret_key,
+            bucket=settings.s3_bucket,
+            region=settings.s3_region,
+            presign_ttl=settings.s3_presign_ttl,
+            endpoint_url=settings.s3_endpoint_url,
+            sse_algorithm=settings.s3_sse_algorithm,
+            sse_kms_key_id=settings.s3_sse_kms_key_id,
+            presign_cache_size=settings.s3_presign_cache_size,
+            presign_cache_margin=settings.s3_presign_cache_margin,
+            fast_presign=settings.s3_fast_presign,
+        )
+
     def upload_bytes(self, key: str, data: bytes, *, content_type: str) -> None:
         try:
             params = {
@@ -54,8 +102,90 @@ class S3Uploader:
             raise
 
     def generate_presigned_url(self, key: str) -> str:
+        """Return a GET URL for ``key``, reusing a cached one while it has enough validity left."""
+        cache = self._presign_cache
+        if cache.enabled:
+            url = cache.get(key)
+            if url is not None:
+                return url
+        signed_at = time.time()
+        presigner = self.presigner
+        if presigner is not None:
+            url = presigner.presign(key, self.presign_ttl)
+        else:
+            url = self._botocore_presign(key)
+        if cache.enabled:
+            cache.put(key, url, signed_at)
+        return url
+
+    @property
+    def presigner(self) -> Optional[SigV4Presigner]:
+        if not self._presigner_ready:
+            client = self.client
+            with self._presigner_lock:
+                if not self._presigner_ready:
+                    self._presigner = SigV4Presigner.from_probe(
+                        self._botocore_presign(PRESIGN_PROBE_KEY),
+                        PRESIGN_PROBE_KEY,
+                        access_key=self._client_options["aws_access_key_id"],
+                        secret_key=self._client_options["aws_secret_access_key"],
+                        region=client.meta.region_name,
+                    )
+                    if self._presigner is None:
+                        logger.info("botocore does not presign with SigV4 here, using it for every URL")
+                    self._presigner_ready = True
+        return self._presigner
+
+    def _botocore_presign(self, key: str) -> str:
         return self.client.generate_presigned_url(
             "get_object",
             Params={"Bucket": self.bucket, "Key": key},
             ExpiresIn=self.presign_ttl,
         )
+
+    def delete_objects(self, keys: Sequence[str], *, max_attempts: int = 3, backoff: float = 0.2) -> List[str]:
+        """Delete ``keys`` in DeleteObjects batches and return the keys that could not be removed."""
+        failed: List[str] = []
+        for key in keys:
+            self._presign_cache.discard(key)
+        for start in range(0, len(keys), MAX_DELETE_BATCH):
+            batch = list(keys[start : start + MAX_DELETE_BATCH])
+            failed.extend(self._delete_batch(batch, max_attempts=max_attempts, backoff=backoff))
+        return failed
+
+    def _delete_batch(self, keys: List[str], *, max_attempts: int, backoff: float) -> List[str]:
+        pending = keys
+        for attempt in range(1, max_attempts + 1):
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in pending], "Quiet": True},
+                )
+            except (BotoCoreError, ClientError):
+                logger.warning("DeleteObjects for %s keys failed (attempt %s)", len(pending), attempt, exc_info=True)
+            else:
+                # Quiet mode only reports failures; a missing key is already the state we want.
+                pending = [
+                    error["Key"]
+                    for error in response.get("Errors", [])
+                    if error.get("Key") and error.get("Code") != "NoSuchKey"
+                ]
+                if not pending:
+                    return []
+                logger.warning("DeleteObjects left %s keys undeleted (attempt %s)", len(pending), attempt)
+            if attempt < max_attempts:
+                time.sleep(backoff * 2 ** (attempt - 1))
+        return pending
+
+    def iter_object_pages(self, prefix: str, *, page_size: int = MAX_DELETE_BATCH) -> Iterator[List[dict]]:
+        """Stream the bucket listing under ``prefix`` one ListObjectsV2 page at a time."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(
+            Bucket=self.bucket,
+            Prefix=prefix,
+            PaginationConfig={"PageSize": page_size},
+        )
+        for page in pages:
+            contents = page.get("Contents")
+            if contents:
+                yield contents
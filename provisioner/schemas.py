@@ -5,11 +5,14 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 
+from db.models import QuotaAction
+
 
 class ProvisionRequest(BaseModel):
     telegram_id: int = Field(..., ge=1)
     preferred_node: Optional[int] = Field(None, description="Explicit node id")
     device_label: Optional[str] = Field(None, max_length=128)
+    plan: Optional[str] = Field(None, max_length=64, description="Billing plan, used for traffic quotas")
 
 
 class ProvisionResponse(BaseModel):
@@ -23,6 +26,23 @@ class ProvisionResponse(BaseModel):
     qr_url: Optional[str]
 
 
+class BatchProvisionRequest(BaseModel):
+    items: list[ProvisionRequest] = Field(..., min_length=1)
+
+
+class BatchProvisionItem(BaseModel):
+    index: int
+    status: str
+    result: Optional[ProvisionResponse] = None
+    error: Optional[str] = None
+
+
+class BatchProvisionResponse(BaseModel):
+    succeeded: int
+    failed: int
+    items: list[BatchProvisionItem]
+
+
 class RevokeRequest(BaseModel):
     telegram_id: int = Field(..., ge=1)
     device_id: int = Field(..., ge=1)
@@ -48,3 +68,38 @@ class ActivePeerStats(BaseModel):
 
 class StatsUpdateRequest(BaseModel):
     peers: list[ActivePeerStats]
+
+
+class KeyImportRow(BaseModel):
+    public_key: str = Field(..., min_length=1, max_length=255)
+    private_key: str = Field(..., min_length=1, max_length=255)
+    preshared_key: Optional[str] = Field(None, max_length=255)
+    certificate: Optional[str] = None
+    ca_certificate: Optional[str] = None
+
+
+class KeyImportBatch(BaseModel):
+    batch: int
+    inserted: int
+    duplicates: int
+    invalid: int
+
+
+class KeyImportResponse(BaseModel):
+    node_id: int
+    inserted: int
+    duplicates: int
+    invalid: int
+    batches: list[KeyImportBatch]
+    errors: list[str]
+
+
+class TrafficQuotaRequest(BaseModel):
+    quota_bytes: int = Field(..., ge=1)
+    period_days: int = Field(30, ge=1)
+    action: QuotaAction = QuotaAction.THROTTLE
+    throttle_kbps: Optional[int] = Field(None, ge=1)
+
+
+class TrafficQuotaResponse(TrafficQuotaRequest):
+    plan: str
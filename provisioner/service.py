@@ -2,109 +2,268 @@ from __future__ import annotations
 
 import base64
 import logging
+import threading
 import uuid
-from typing import Callable
-
-from statsd import StatsClient
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 from sqlalchemy.exc import NoResultFound
 
-from db import ENGINE, Base
 from db.crud import (
     KeyPoolEmpty,
+    QuotaChange,
+    accumulate_usage,
     allocate_key,
+    allocate_keys,
+    apply_peer_stats,
+    count_active_devices,
     count_user_devices,
     count_user_devices_on_node,
     create_provision,
+    ensure_user_traffic,
+    ensure_users_traffic,
     get_active_provision,
     get_node,
+    get_provisions,
+    get_traffic_quota,
     list_active_nodes,
+    list_user_active_provisions,
     revoke_provision,
-    update_peer_stats,
+    upsert_traffic_quota,
 )
-from db.models import Node, NodeType
+from db.models import KeyPool, Node, NodeType, Provision, QuotaAction, UserTraffic
 
+from .cleanup import S3DeletionQueue
 from .config import ProvisionerSettings
-from .metrics import PROVISION_ERRORS, PROVISION_REQUESTS, REVOCATION_REQUESTS, SWITCH_REQUESTS
-from .s3 import S3Uploader
-from .schemas import ActivePeerStats, ProvisionRequest, ProvisionResponse, SwitchNodeRequest
+from .directory import NodeDirectory
+from .metrics import (
+    PROVISION_ERRORS,
+    PROVISION_REQUESTS,
+    QUOTA_ENFORCEMENTS,
+    REVOCATION_REQUESTS,
+    SWITCH_REQUESTS,
+)
+from .placement import PlacementEngine
+from .schemas import (
+    ActivePeerStats,
+    BatchProvisionItem,
+    BatchProvisionResponse,
+    ProvisionRequest,
+    ProvisionResponse,
+    SwitchNodeRequest,
+    TrafficQuotaRequest,
+    TrafficQuotaResponse,
+)
+from .stats_emitter import BufferedStatsClient
+from .storage import ObjectStore
 from .vpn import VPNManagerError, build_qr_bytes, get_vpn_manager
 
 logger = logging.getLogger(__name__)
 
 
-Base.metadata.create_all(bind=ENGINE)
-
-
 class ProvisioningError(RuntimeError):
     pass
 
 
+@dataclass
+class _BatchItem:
+    index: int
+    request: ProvisionRequest
+    node: Optional[Node] = None
+    key: Optional[KeyPool] = None
+    file_name: str = ""
+    config_bytes: bytes = b""
+    qr_bytes: bytes = b""
+    config_s3_key: str = ""
+    qr_s3_key: str = ""
+    throttle_kbps: Optional[int] = None
+    provision: Optional[Provision] = None
+    reserved_node: Optional[int] = None
+    error: Optional[str] = None
+
+
 class ProvisioningService:
     def __init__(
         self,
         *,
         session_factory: Callable,
         settings: ProvisionerSettings,
-        s3_uploader: S3Uploader,
-        statsd: StatsClient,
+        s3_uploader: ObjectStore,
+        statsd: BufferedStatsClient,
+        deletion_queue: Optional[S3DeletionQueue] = None,
+        placement: Optional[PlacementEngine] = None,
+        read_session_factory: Optional[Callable] = None,
     ) -> None:
         self._session_factory = session_factory
+        self._read_session_factory = read_session_factory or session_factory
         self.settings = settings
         self.s3 = s3_uploader
         self.statsd = statsd
+        self.deletion_queue = deletion_queue
+        self.placement = placement
+        self.directory = NodeDirectory(self.list_nodes, ttl=settings.node_directory_ttl)
+        self._quota_lock = threading.Lock()
+        self._pending_quota: Dict[int, QuotaChange] = {}
 
     def provision(self, payload: ProvisionRequest) -> ProvisionResponse:
         with self._session_factory() as session:
             devices = count_user_devices(session, payload.telegram_id)
             if devices >= self.settings.max_devices_per_user:
                 raise ProvisioningError("Device limit reached")
-            node = self._pick_node(session, payload)
-            if node.current_devices >= node.max_devices:
-                raise ProvisioningError("Node capacity reached")
-            per_node = count_user_devices_on_node(session, payload.telegram_id, node.id)
-            if per_node >= node.device_limit_per_user:
-                raise ProvisioningError("Node limit reached for user")
-            key = None
-            if node.type in {NodeType.WIREGUARD, NodeType.OPENVPN}:
-                try:
-                    key = allocate_key(session, node.id)
-                except KeyPoolEmpty as exc:
-                    raise ProvisioningError("Key pool depleted") from exc
-            manager = get_vpn_manager(node.type, amnezia_cli_path=self.settings.amnezia_cli_path)
-            try:
-                file_name, config_text = manager.generate_config(node, key, device_label=payload.device_label)
-            except VPNManagerError as exc:
-                raise ProvisioningError(str(exc)) from exc
-            qr_bytes = build_qr_bytes(config_text, error_correction=self.settings.qr_error_correction)
-            config_bytes = config_text.encode()
-            config_s3_key = f"configs/{uuid.uuid4()}.conf"
-            qr_s3_key = f"qrs/{uuid.uuid4()}.png"
-            self.s3.upload_bytes(config_s3_key, config_bytes, content_type="text/plain")
-            self.s3.upload_bytes(qr_s3_key, qr_bytes, content_type="image/png")
-            provision = create_provision(
-                session,
-                telegram_id=payload.telegram_id,
-                node=node,
-                key=key,
-                file_name=file_name,
-                config_s3_key=config_s3_key,
-                qr_s3_key=qr_s3_key,
-                device_label=payload.device_label,
+            released: List[QuotaChange] = []
+            traffic = ensure_user_traffic(
+                session, payload.telegram_id, payload.plan or self.settings.default_plan, changes=released
             )
-            session.commit()
-            PROVISION_REQUESTS.inc()
-            self.statsd.incr("provision.success")
-            return ProvisionResponse(
-                provision_id=provision.id,
-                node_id=node.id,
-                node_name=node.name,
-                file_name=file_name,
-                file_content_base64=base64.b64encode(config_bytes).decode(),
-                qr_base64=base64.b64encode(qr_bytes).decode(),
-                file_url=self.s3.generate_presigned_url(config_s3_key),
-                qr_url=self.s3.generate_presigned_url(qr_s3_key),
+            self._release_quotas(session, released)
+            if payload.plan:
+                traffic.plan = payload.plan
+            if traffic.enforced_action is QuotaAction.REVOKE:
+                raise ProvisioningError("Traffic quota exceeded")
+            node, reserved = self._pick_node(session, payload)
+            try:
+                return self._provision_on_node(session, payload, traffic, node)
+            except Exception:
+                if reserved:
+                    self.placement.release(node.id)  # type: ignore[union-attr]
+                raise
+
+    def _provision_on_node(
+        self, session, payload: ProvisionRequest, traffic: UserTraffic, node: Node
+    ) -> ProvisionResponse:
+        if node.current_devices >= node.max_devices:
+            raise ProvisioningError("Node capacity reached")
+        per_node = count_user_devices_on_node(session, payload.telegram_id, node.id)
+        if per_node >= node.device_limit_per_user:
+            raise ProvisioningError("Node limit reached for user")
+        key = None
+        if node.type in {NodeType.WIREGUARD, NodeType.OPENVPN}:
+            try:
+                key = allocate_key(session, node.id)
+            except KeyPoolEmpty as exc:
+                raise ProvisioningError("Key pool depleted") from exc
+        manager = get_vpn_manager(node.type, amnezia_cli_path=self.settings.amnezia_cli_path)
+        if traffic.enforced_action is QuotaAction.THROTTLE and not manager.supports_throttle:
+            raise ProvisioningError("Traffic quota exceeded")
+        # Created first so the node can tell the device apart by its id; rolled back on failure.
+        provision = create_provision(
+            session,
+            telegram_id=payload.telegram_id,
+            node=node,
+            key=key,
+            file_name="",
+            config_s3_key=f"configs/{uuid.uuid4()}.conf",
+            qr_s3_key=f"qrs/{uuid.uuid4()}.png",
+            device_label=payload.device_label,
+        )
+        try:
+            file_name, config_text = manager.generate_config(
+                node, key, device_label=payload.device_label, device_id=provision.id
             )
+            if traffic.enforced_action is QuotaAction.THROTTLE:
+                quota = get_traffic_quota(session, traffic.plan)
+                if quota is not None and quota.throttle_kbps is not None:
+                    manager.throttle(node, key, rate_kbps=quota.throttle_kbps, device_id=provision.id)
+        except VPNManagerError as exc:
+            raise ProvisioningError(str(exc)) from exc
+        provision.file_name = file_name
+        qr_bytes = build_qr_bytes(config_text, error_correction=self.settings.qr_error_correction)
+        config_bytes = config_text.encode()
+        self.s3.upload_bytes(provision.config_s3_key, config_bytes, content_type="text/plain")
+        self.s3.upload_bytes(provision.qr_s3_key, qr_bytes, content_type="image/png")
+        session.commit()
+        self.directory.invalidate()
+        PROVISION_REQUESTS.inc()
+        self.statsd.incr("provision.success")
+        return self._response(provision, config_bytes, qr_bytes)
+
+    def provision_batch(self, requests: Sequence[ProvisionRequest]) -> BatchProvisionResponse:
+        """Provision many devices, reporting success or failure per item.
+
+        Limits are checked against counters loaded once for all users, and items are grouped by
+        node so each node's keys come from one ``SKIP LOCKED`` query. The devices are created and
+        committed before anything is rendered, so no lock is held while configs are rendered and
+        uploaded to S3 on a thread pool. A second transaction stores the file names and revokes
+        the devices that failed, which returns their keys to the pool. A failed item does not
+        affect the others; only a failed commit fails the whole batch.
+        """
+        if len(requests) > self.settings.provision_batch_max_items:
+            raise ProvisioningError(f"At most {self.settings.provision_batch_max_items} items per batch")
+        items = [_BatchItem(index=index, request=request) for index, request in enumerate(requests)]
+        try:
+            with self._session_factory() as session:
+                self._assign_batch_nodes(session, items)
+                groups: Dict[int, List[_BatchItem]] = defaultdict(list)
+                for item in items:
+                    if item.error is None and item.node.type in {NodeType.WIREGUARD, NodeType.OPENVPN}:
+                        groups[item.node.id].append(item)
+                for node_id, group in groups.items():
+                    keys = allocate_keys(session, node_id, len(group))
+                    for item, key in zip(group, keys):
+                        item.key = key
+                    for item in group[len(keys) :]:
+                        item.error = "Key pool depleted"
+                for item in items:
+                    if item.error is None:
+                        item.config_s3_key = f"configs/{uuid.uuid4()}.conf"
+                        item.qr_s3_key = f"qrs/{uuid.uuid4()}.png"
+                        item.provision = create_provision(
+                            session,
+                            telegram_id=item.request.telegram_id,
+                            node=item.node,
+                            key=item.key,
+                            file_name="",
+                            config_s3_key=item.config_s3_key,
+                            qr_s3_key=item.qr_s3_key,
+                            device_label=item.request.device_label,
+                        )
+                session.commit()
+        except Exception:
+            self._release_batch_reservations(items, failed_only=False)
+            raise
+
+        created = [item for item in items if item.provision is not None]
+        if created:
+            with ThreadPoolExecutor(
+                max_workers=min(self.settings.provision_batch_workers, len(created)),
+                thread_name_prefix="provision-batch",
+            ) as pool:
+                list(pool.map(self._render_batch_item, created))
+                list(pool.map(self._upload_batch_item, [item for item in created if item.error is None]))
+            for item in created:
+                if item.error is not None and item.file_name:
+                    self._withdraw_batch_item(item)
+            with self._session_factory() as session:
+                provisions = get_provisions(session, [item.provision.id for item in created])
+                stored = {provision.id: provision for provision in provisions}
+                for item in created:
+                    provision = stored[item.provision.id]
+                    if item.error is None:
+                        provision.file_name = item.provision.file_name = item.file_name
+                    else:
+                        revoke_provision(session, provision)
+                session.commit()
+        self._release_batch_reservations(items, failed_only=True)
+
+        results = []
+        for item in items:
+            if item.error is None:
+                response = self._response(item.provision, item.config_bytes, item.qr_bytes)
+                results.append(BatchProvisionItem(index=item.index, status="ok", result=response))
+            else:
+                results.append(BatchProvisionItem(index=item.index, status="error", error=item.error))
+        failed = sum(1 for item in items if item.error is not None)
+        succeeded = len(items) - failed
+        if created:
+            self.directory.invalidate()
+        if succeeded:
+            PROVISION_REQUESTS.inc(succeeded)
+            self.statsd.incr("provision.success", succeeded)
+        if failed:
+            PROVISION_ERRORS.inc(failed)
+            self.statsd.incr("provision.error", failed)
+        return BatchProvisionResponse(succeeded=succeeded, failed=failed, items=results)
 
     def revoke(self, telegram_id: int, provision_id: int) -> None:
         with self._session_factory() as session:
@@ -116,11 +275,13 @@ class ProvisioningService:
                 provision.node.type,
                 amnezia_cli_path=self.settings.amnezia_cli_path,
             )
-            manager.revoke(provision.node, provision.key)
+            manager.revoke(provision.node, provision.key, device_id=provision.id)
             revoke_provision(session, provision)
             session.commit()
+            self.directory.invalidate()
             REVOCATION_REQUESTS.inc()
             self.statsd.incr("provision.revoke")
+        self._discard_objects(provision)
 
     def switch_node(self, request: SwitchNodeRequest) -> ProvisionResponse:
         with self._session_factory() as session:
@@ -131,6 +292,8 @@ class ProvisioningService:
             device_label = provision.device_label
             revoke_provision(session, provision)
             session.commit()
+        self.directory.invalidate()
+        self._discard_objects(provision)
         REVOCATION_REQUESTS.inc()
         self.statsd.incr("provision.switch_revoke")
         SWITCH_REQUESTS.inc()
@@ -142,27 +305,263 @@ class ProvisioningService:
         return self.provision(new_request)
 
     def refresh_peer_stats(self, stats: list[ActivePeerStats]) -> None:
+        """Store the peers' counters and enforce quotas for users whose quota state changed.
+
+        A change that could not be applied to every device stays pending and is retried with the
+        next report, unless a newer change for the same user replaces it.
+        """
+        reports = {peer.provision_id: (peer.rx_bytes, peer.tx_bytes, peer.latest_handshake) for peer in stats}
+        with self._session_factory() as session:
+            deltas = apply_peer_stats(session, reports)
+            changes = accumulate_usage(session, deltas, default_plan=self.settings.default_plan)
+            session.commit()
+        with self._quota_lock:
+            pending = self._pending_quota
+            self._pending_quota = {}
+        for change in changes:
+            pending[change.telegram_id] = change
+        failed: Dict[int, QuotaChange] = {}
+        for change in pending.values():
+            try:
+                applied = self._apply_quota_change(change)
+            except Exception:
+                logger.exception("Failed to apply traffic quota for %s", change.telegram_id)
+                applied = False
+            if not applied:
+                failed[change.telegram_id] = change
+        if failed:
+            with self._quota_lock:
+                for telegram_id, change in failed.items():
+                    self._pending_quota.setdefault(telegram_id, change)
+
+    def set_traffic_quota(self, plan: str, request: TrafficQuotaRequest) -> TrafficQuotaResponse:
         with self._session_factory() as session:
-            for peer in stats:
-                update_peer_stats(
-                    session,
-                    peer.provision_id,
-                    rx_bytes=peer.rx_bytes,
-                    tx_bytes=peer.tx_bytes,
-                    latest_handshake=peer.latest_handshake,
-                )
+            upsert_traffic_quota(
+                session,
+                plan=plan,
+                quota_bytes=request.quota_bytes,
+                period_days=request.period_days,
+                action=request.action,
+                throttle_kbps=request.throttle_kbps,
+            )
             session.commit()
+        return TrafficQuotaResponse(plan=plan, **request.model_dump())
+
+    def _release_quotas(self, session, released: List[QuotaChange]) -> None:
+        """Commit periods that ended before a provisioning request and queue lifting their limits.
+
+        The new period is stored even if the request then fails; the devices still throttled are
+        restored with the next peer report.
+        """
+        if not released:
+            return
+        session.commit()
+        with self._quota_lock:
+            for change in released:
+                self._pending_quota[change.telegram_id] = change
+
+    def _apply_quota_change(self, change: QuotaChange) -> bool:
+        """Throttle, revoke or restore the user's active devices; return ``False`` if any of them failed.
+
+        Devices on nodes that cannot throttle are revoked instead, and the user is then recorded
+        as revoked: new devices are refused until the quota period ends, which the next
+        provisioning request or usage report after that notices.
+        """
+        if change.action is None and change.previous_action is None:
+            return True
+        revoked: list[Provision] = []
+        failures = 0
+        with self._session_factory() as session:
+            for provision in list_user_active_provisions(session, change.telegram_id):
+                manager = get_vpn_manager(provision.node.type, amnezia_cli_path=self.settings.amnezia_cli_path)
+                try:
+                    if change.action is None:
+                        if manager.supports_throttle:
+                            manager.throttle(provision.node, provision.key, rate_kbps=None, device_id=provision.id)
+                        continue
+                    if change.action is QuotaAction.THROTTLE and manager.supports_throttle:
+                        manager.throttle(
+                            provision.node, provision.key, rate_kbps=change.throttle_kbps, device_id=provision.id
+                        )
+                        continue
+                    manager.revoke(provision.node, provision.key, device_id=provision.id)
+                except Exception:
+                    logger.warning("Failed to apply traffic quota to provision %s", provision.id, exc_info=True)
+                    failures += 1
+                    continue
+                revoke_provision(session, provision)
+                revoked.append(provision)
+            if change.action is QuotaAction.THROTTLE and revoked:
+                logger.info("Revoked %s devices of %s on nodes that cannot throttle", len(revoked), change.telegram_id)
+                traffic = session.get(UserTraffic, change.telegram_id)
+                if traffic is not None and traffic.enforced_action is QuotaAction.THROTTLE:
+                    traffic.enforced_action = QuotaAction.REVOKE
+            session.commit()
+        if revoked:
+            self.directory.invalidate()
+            REVOCATION_REQUESTS.inc(len(revoked))
+            self.statsd.incr("provision.quota_revoke", len(revoked))
+            for provision in revoked:
+                self._discard_objects(provision)
+        if failures:
+            return False
+        QUOTA_ENFORCEMENTS.labels(action=change.action.value if change.action else "restore").inc()
+        return True
+
+    def _assign_batch_nodes(self, session, items: List[_BatchItem]) -> None:
+        plans: Dict[int, str] = {}
+        for item in items:
+            plans.setdefault(item.request.telegram_id, item.request.plan or self.settings.default_plan)
+        released: List[QuotaChange] = []
+        traffic = ensure_users_traffic(session, plans, changes=released)
+        self._release_quotas(session, released)
+        per_node = count_active_devices(session, plans)
+        per_user: Dict[int, int] = defaultdict(int)
+        for (telegram_id, _), count in per_node.items():
+            per_user[telegram_id] += count
+        nodes = {node.id: node for node in list_active_nodes(session)}
+        reserved: Dict[int, int] = defaultdict(int)
+        throttles: Dict[str, Optional[int]] = {}
+        for item in items:
+            request = item.request
+            if per_user[request.telegram_id] >= self.settings.max_devices_per_user:
+                item.error = "Device limit reached"
+                continue
+            user_traffic = traffic[request.telegram_id]
+            if request.plan:
+                user_traffic.plan = request.plan
+            if user_traffic.enforced_action is QuotaAction.REVOKE:
+                item.error = "Traffic quota exceeded"
+                continue
+            node, from_placement = self._pick_batch_node(nodes, reserved, request)
+            if from_placement:
+                item.reserved_node = node.id
+            if node is None:
+                item.error = "No nodes available"
+                continue
+            if node.current_devices + reserved[node.id] >= node.max_devices:
+                item.error = "Node capacity reached"
+                continue
+            if per_node.get((request.telegram_id, node.id), 0) >= node.device_limit_per_user:
+                item.error = "Node limit reached for user"
+                continue
+            if user_traffic.enforced_action is QuotaAction.THROTTLE:
+                if not self._supports_throttle(node):
+                    item.error = "Traffic quota exceeded"
+                    continue
+                if user_traffic.plan not in throttles:
+                    quota = get_traffic_quota(session, user_traffic.plan)
+                    throttles[user_traffic.plan] = quota.throttle_kbps if quota else None
+                item.throttle_kbps = throttles[user_traffic.plan]
+            item.node = node
+            reserved[node.id] += 1
+            per_user[request.telegram_id] += 1
+            per_node[(request.telegram_id, node.id)] = per_node.get((request.telegram_id, node.id), 0) + 1
+
+    def _pick_batch_node(
+        self, nodes: Dict[int, Node], reserved: Dict[int, int], request: ProvisionRequest
+    ) -> Tuple[Optional[Node], bool]:
+        """Like :meth:`_pick_node`, against the nodes and slots already taken by this batch."""
+        if request.preferred_node:
+            return nodes.get(request.preferred_node), False
+        node_id = self.placement.choose() if self.placement else None
+        if node_id is not None:
+            node = nodes.get(node_id)
+            if node is not None and node.current_devices + reserved[node.id] < node.max_devices:
+                return node, True
+            self.placement.release(node_id)  # type: ignore[union-attr]
+        free = [node for node in nodes.values() if node.current_devices + reserved[node.id] < node.max_devices]
+        return min(free, key=lambda node: node.current_devices + reserved[node.id], default=None), False
+
+    def _release_batch_reservations(self, items: List[_BatchItem], *, failed_only: bool) -> None:
+        for item in items:
+            if item.reserved_node is not None and (item.error is not None or not failed_only):
+                self.placement.release(item.reserved_node)  # type: ignore[union-attr]
+                item.reserved_node = None
+
+    def _withdraw_batch_item(self, item: _BatchItem) -> None:
+        """Remove the peer a rendered item pushed to its node before its key goes back to the pool."""
+        manager = get_vpn_manager(item.node.type, amnezia_cli_path=self.settings.amnezia_cli_path)
+        try:
+            manager.revoke(item.node, item.key, device_id=item.provision.id)
+        except Exception:
+            logger.warning("Failed to remove the peer of batch item %s", item.index, exc_info=True)
+
+    def _render_batch_item(self, item: _BatchItem) -> None:
+        manager = get_vpn_manager(item.node.type, amnezia_cli_path=self.settings.amnezia_cli_path)
+        try:
+            item.file_name, config_text = manager.generate_config(
+                item.node, item.key, device_label=item.request.device_label, device_id=item.provision.id
+            )
+            if item.throttle_kbps is not None:
+                manager.throttle(item.node, item.key, rate_kbps=item.throttle_kbps, device_id=item.provision.id)
+            item.qr_bytes = build_qr_bytes(config_text, error_correction=self.settings.qr_error_correction)
+        except VPNManagerError as exc:
+            item.error = str(exc)
+            return
+        except Exception:
+            logger.exception("Failed to render config for batch item %s", item.index)
+            item.error = "Failed to render configuration"
+            return
+        item.config_bytes = config_text.encode()
 
-    def _pick_node(self, session, payload: ProvisionRequest) -> Node:
+    def _upload_batch_item(self, item: _BatchItem) -> None:
+        # The keys were stored with the provision in the first transaction.
+        uploaded = []
+        try:
+            self.s3.upload_bytes(item.config_s3_key, item.config_bytes, content_type="text/plain")
+            uploaded.append(item.config_s3_key)
+            self.s3.upload_bytes(item.qr_s3_key, item.qr_bytes, content_type="image/png")
+        except Exception:
+            logger.exception("Failed to upload files for batch item %s", item.index)
+            item.error = "Failed to store configuration"
+            if self.deletion_queue is not None:
+                self.deletion_queue.enqueue(uploaded)
+
+    def _response(self, provision: Provision, config_bytes: bytes, qr_bytes: bytes) -> ProvisionResponse:
+        return ProvisionResponse(
+            provision_id=provision.id,
+            node_id=provision.node.id,
+            node_name=provision.node.name,
+            file_name=provision.file_name,
+            file_content_base64=base64.b64encode(config_bytes).decode(),
+            qr_base64=base64.b64encode(qr_bytes).decode(),
+            file_url=self.s3.generate_presigned_url(provision.config_s3_key),
+            qr_url=self.s3.generate_presigned_url(provision.qr_s3_key),
+        )
+
+    def _supports_throttle(self, node: Node) -> bool:
+        return get_vpn_manager(node.type, amnezia_cli_path=self.settings.amnezia_cli_path).supports_throttle
+
+    def _discard_objects(self, provision: Provision) -> None:
+        if self.deletion_queue is not None:
+            self.deletion_queue.enqueue([provision.config_s3_key, provision.qr_s3_key])
+
+    def _pick_node(self, session, payload: ProvisionRequest) -> Tuple[Node, bool]:
+        """Return the node for a new device and whether a placement slot was reserved on it.
+
+        The placement scores are up to a refresh old, so a node it picks that turned out to be
+        gone or full is handed back and the least loaded node with free capacity is used instead.
+        """
         try:
             if payload.preferred_node:
-                return get_node(session, payload.preferred_node)
-            return get_node(session)
+                return get_node(session, payload.preferred_node), False
+            node_id = self.placement.choose() if self.placement else None
+            if node_id is not None:
+                try:
+                    node = get_node(session, node_id)
+                    if node.current_devices < node.max_devices:
+                        return node, True
+                    logger.info("Placement picked full node %s, falling back", node_id)
+                except NoResultFound:
+                    logger.info("Placement picked unavailable node %s, falling back", node_id)
+                self.placement.release(node_id)  # type: ignore[union-attr]
+            return get_node(session), False
         except NoResultFound as exc:
             raise ProvisioningError("No nodes available") from exc
 
     def list_nodes(self) -> list[dict]:
-        with self._session_factory() as session:
+        with self._read_session_factory() as session:
             nodes = list_active_nodes(session)
             return [
                 {
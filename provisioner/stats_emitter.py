@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fits a StatsD datagram into a single Ethernet frame without IP fragmentation.
+DEFAULT_MAX_PACKET_SIZE = 1432
+
+
+class BufferedStatsClient:
+    """StatsD client that aggregates in memory and sends from a background thread.
+
+    ``incr`` and ``timing`` only update dictionaries under a lock, so request threads never
+    make a syscall. Every ``flush_interval`` seconds counters are summed into one line per name
+    and timer samples are packed with them into newline-separated multi-metric datagrams of at
+    most ``max_packet_size`` bytes. Metric names are the same as with ``statsd.StatsClient``:
+    ``<prefix>.<stat>``.
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = 8125,
+        prefix: Optional[str] = None,
+        *,
+        flush_interval: float = 1.0,
+        max_packet_size: int = DEFAULT_MAX_PACKET_SIZE,
+        max_timer_samples: int = 1000,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.prefix = f"{prefix}." if prefix else ""
+        self.flush_interval = flush_interval
+        self.max_packet_size = max_packet_size
+        self.max_timer_samples = max_timer_samples
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._timers: Dict[str, List[float]] = {}
+        self._socket: Optional[socket.socket] = None
+        self._address: Optional[tuple] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def incr(self, stat: str, count: int = 1, rate: float = 1) -> None:
+        # Everything is aggregated, so sampling is unnecessary and ``rate`` is accepted only for compatibility.
+        with self._lock:
+            self._counters[stat] = self._counters.get(stat, 0) + count
+            if self._thread is None:
+                self._start()
+
+    def decr(self, stat: str, count: int = 1, rate: float = 1) -> None:
+        self.incr(stat, -count, rate)
+
+    def timing(self, stat: str, delta: float, rate: float = 1) -> None:
+        """Record ``delta`` milliseconds for ``stat``."""
+        with self._lock:
+            samples = self._timers.setdefault(stat, [])
+            if len(samples) < self.max_timer_samples:
+                samples.append(delta)
+            if self._thread is None:
+                self._start()
+
+    @contextmanager
+    def timer(self, stat: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(stat, (time.perf_counter() - start) * 1000)
+
+    def flush(self) -> int:
+        """Send everything buffered so far and return the number of datagrams."""
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            timers, self._timers = self._timers, {}
+        lines = [f"{self.prefix}{stat}:{value}|c" for stat, value in counters.items() if value]
+        for stat, samples in timers.items():
+            lines.extend(f"{self.prefix}{stat}:{sample:.3f}|ms" for sample in samples)
+        packets = 0
+        for packet in self._pack(lines):
+            self._send(packet)
+            packets += 1
+        return packets
+
+    def stop(self) -> None:
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _pack(self, lines: List[str]) -> Iterator[bytes]:
+        packet = bytearray()
+        for line in lines:
+            data = line.encode()
+            if packet and len(packet) + 1 + len(data) > self.max_packet_size:
+                yield bytes(packet)
+                packet = bytearray()
+            if packet:
+                packet += b"\n"
+            packet += data
+        if packet:
+            yield bytes(packet)
+
+    def _send(self, packet: bytes) -> None:
+        try:
+            if self._socket is None:
+                family, _, _, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_DGRAM)[0]
+                self._socket = socket.socket(family, socket.SOCK_DGRAM)
+                self._address = address
+            self._socket.sendto(packet, self._address)
+        except OSError:
+            # StatsD is best effort, like the stock client.
+            logger.debug("Failed to send StatsD packet", exc_info=True)
+
+    def _start(self) -> None:
+        if self._stopped.is_set():
+            return
+        self._thread = threading.Thread(target=self._run, name="statsd-flush", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("StatsD flush failed")
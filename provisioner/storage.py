@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import hashlib
+import hmac
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional, Sequence
+from urllib.parse import quote, urlencode
+
+if TYPE_CHECKING:
+    from .config import ProvisionerSettings
+
+logger = logging.getLogger(__name__)
+
+# Extensions of the objects the provisioner writes; everything else goes through ``mimetypes``.
+CONTENT_TYPES = {
+    ".conf": "text/plain",
+    ".ovpn": "text/plain",
+    ".amnezia": "text/plain",
+    ".png": "image/png",
+}
+
+
+class ObjectStoreError(RuntimeError):
+    pass
+
+
+class ObjectStore:
+    """Storage for generated configs and QR codes.
+
+    ``iter_object_pages`` yields ListObjectsV2-style dicts with ``Key``, ``Size`` and an aware
+    ``LastModified`` so the orphan sweeper works with any backend.
+    """
+
+    presign_ttl: int
+
+    def upload_bytes(self, key: str, data: bytes, *, content_type: str) -> None:
+        raise NotImplementedError
+
+    def generate_presigned_url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def delete_objects(self, keys: Sequence[str], *, max_attempts: int = 3, backoff: float = 0.2) -> List[str]:
+        """Delete ``keys`` and return the ones that could not be removed."""
+        raise NotImplementedError
+
+    def iter_object_pages(self, prefix: str, *, page_size: int = 1000) -> Iterator[List[dict]]:
+        raise NotImplementedError
+
+
+class LocalObjectStore(ObjectStore):
+    """Content-addressed object store on the local filesystem.
+
+    Data lives once per SHA-256 under ``blobs/ab/cd/<digest>``; every key is a hard link to its
+    blob under ``refs/<key dir>/<shard>/<key name>``, so identical uploads share storage and the
+    link count tells when a blob is no longer referenced. Blobs and refs are written to a
+    temporary file and renamed into place, so readers never see a partial object. URLs point
+    at ``GET /objects/{key}`` and carry an HMAC-SHA256 signature over the key and expiry.
+    """
+
+    def __init__(self, root: str, *, base_url: str, secret: str, presign_ttl: int) -> None:
+        if not secret:
+            raise ObjectStoreError("A signing secret is required for the local object store")
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+        self.presign_ttl = presign_ttl
+        self._secret = secret.encode()
+        self._blobs = self.root / "blobs"
+        self._refs = self.root / "refs"
+        self._tmp = self.root / "tmp"
+        for directory in (self._blobs, self._refs, self._tmp):
+            directory.mkdir(parents=True, exist_ok=True)
+        # Serialises linking a ref to a blob against removing the blob's last ref.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: "ProvisionerSettings") -> "LocalObjectStore":
+        return cls(
+            settings.local_store_path,
+            base_url=settings.local_store_base_url,
+            secret=settings.local_store_secret or "",
+            presign_ttl=settings.s3_presign_ttl,
+        )
+
+    def upload_bytes(self, key: str, data: bytes, *, content_type: str) -> None:
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blobs / digest[:2] / digest[2:4] / digest
+        ref = self.ref_path(key)
+        ref.parent.mkdir(parents=True, exist_ok=True)
+        # Write and fsync outside the lock; it is only held to publish the blob and link the ref.
+        staged_blob = None if blob.exists() else self._stage(data)
+        staged_ref = self._tmp / f"ref-{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+        with self._lock:
+            if not blob.exists():
+                if staged_blob is None:
+                    staged_blob = self._stage(data)
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(staged_blob, blob)
+                staged_blob = None
+            os.link(blob, staged_ref)
+        if staged_blob is not None:
+            os.unlink(staged_blob)
+        # Links share the inode, so bump its mtime: the sweeper must not take a fresh key for an old one.
+        os.utime(staged_ref)
+        os.replace(staged_ref, ref)
+
+    def generate_presigned_url(self, key: str) -> str:
+        expires = int(time.time()) + self.presign_ttl
+        query = urlencode({"expires": expires, "signature": self.sign(key, expires)})
+        return f"{self.base_url}/objects/{quote(key)}?{query}"
+
+    def sign(self, key: str, expires: int) -> str:
+        return hmac.new(self._secret, f"{key}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+    def verify(self, key: str, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self.sign(key, expires), signature)
+
+    def ref_path(self, key: str) -> Path:
+        parts = [part for part in key.split("/") if part]
+        if not parts or any(part in (".", "..") for part in parts):
+            raise ObjectStoreError(f"Invalid object key: {key!r}")
+        shard = hashlib.sha1(key.encode()).hexdigest()[:2]
+        return self._refs.joinpath(*parts[:-1], shard, parts[-1])
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """Return an unbuffered binary file for ``key`` or ``None`` if it does not exist."""
+        try:
+            return open(self.ref_path(key), "rb", buffering=0)
+        except (ObjectStoreError, FileNotFoundError, IsADirectoryError):
+            return None
+
+    def content_type(self, key: str) -> str:
+        suffix = os.path.splitext(key)[1].lower()
+        return CONTENT_TYPES.get(suffix) or mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    def delete_objects(self, keys: Sequence[str], *, max_attempts: int = 3, backoff: float = 0.2) -> List[str]:
+        failed: List[str] = []
+        for key in keys:
+            try:
+                self._delete(key)
+            except OSError:
+                logger.warning("Failed to delete local object %s", key, exc_info=True)
+                failed.append(key)
+        return failed
+
+    def iter_object_pages(self, prefix: str, *, page_size: int = 1000) -> Iterator[List[dict]]:
+        page: List[dict] = []
+        # Only walk the directory the prefix points into; shards sit right above the file names.
+        top = self._refs.joinpath(*[part for part in prefix.split("/")[:-1] if part])
+        for dirpath, _, filenames in os.walk(top):
+            relative = Path(dirpath).relative_to(self._refs).parts
+            if not relative:
+                continue
+            for name in filenames:
+                key = "/".join((*relative[:-1], name))
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                page.append(
+                    {
+                        "Key": key,
+                        "Size": stat.st_size,
+                        "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                    }
+                )
+                if len(page) >= page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def _delete(self, key: str) -> None:
+        ref = self.ref_path(key)
+        try:
+            with open(ref, "rb") as handle:
+                digest = hashlib.file_digest(handle, "sha256").hexdigest()
+        except FileNotFoundError:
+            return
+        blob = self._blobs / digest[:2] / digest[2:4] / digest
+        with self._lock:
+            try:
+                os.unlink(ref)
+            except FileNotFoundError:
+                return
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    os.unlink(blob)
+            except FileNotFoundError:
+                pass
+
+    def _stage(self, data: bytes) -> Path:
+        fd, staged = tempfile.mkstemp(dir=self._tmp, prefix="blob-")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())
+        except BaseException:
+            os.unlink(staged)
+            raise
+        return Path(staged)
+
+
+def build_object_store(settings: "ProvisionerSettings") -> ObjectStore:
+    if settings.object_store_backend == "local":
+        return LocalObjectStore.from_settings(settings)
+    from .s3 import S3Uploader
+
+    return S3Uploader.from_settings(settings)
@@ -3,8 +3,10 @@ from __future__ import annotations
 import logging
 import os
 import subprocess
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 
 import segno
 
@@ -22,19 +24,63 @@ class VPNManagerError(RuntimeError):
     pass
 
 
+class CACertificateCache:
+    """Normalised CA PEMs keyed by ``ca_certificates.id``.
+
+    CA rows are content-addressed by fingerprint and never change, so entries need no
+    invalidation. On a hit the ``KeyPool.ca`` relationship is never touched and the CA text
+    is not fetched from the database again.
+    """
+
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[int, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: KeyPool) -> str:
+        if key.ca_id is None:
+            return (key.ca_certificate or "").strip()
+        with self._lock:
+            pem = self._entries.get(key.ca_id)
+            if pem is not None:
+                self._entries.move_to_end(key.ca_id)
+                return pem
+        pem = key.ca.pem.strip() if key.ca is not None else ""
+        with self._lock:
+            self._entries[key.ca_id] = pem
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return pem
+
+
+CA_CACHE = CACertificateCache()
+
+
 class BaseVPNManager:
-    def generate_config(self, node: Node, key: KeyPool | None, *, device_label: str | None) -> Tuple[str, str]:
+    """``device_id`` is the id of the device's provision, for nodes that address peers by it."""
+
+    supports_throttle = False
+
+    def generate_config(
+        self, node: Node, key: KeyPool | None, *, device_label: str | None, device_id: int | None = None
+    ) -> Tuple[str, str]:
         raise NotImplementedError
 
-    def revoke(self, node: Node, key: KeyPool | None) -> None:
+    def revoke(self, node: Node, key: KeyPool | None, *, device_id: int | None = None) -> None:
         raise NotImplementedError
 
+    def throttle(self, node: Node, key: KeyPool | None, *, rate_kbps: int | None, device_id: int | None = None) -> None:
+        """Limit the peer to ``rate_kbps``, or lift the limit when it is ``None``."""
+        raise VPNManagerError(f"{node.type.value} nodes do not support throttling")
+
 
 class WireGuardManager(BaseVPNManager):
     def __init__(self) -> None:
         self.client = wgctrl.WGCtrl() if wgctrl else None
 
-    def generate_config(self, node: Node, key: KeyPool | None, *, device_label: str | None) -> Tuple[str, str]:
+    def generate_config(
+        self, node: Node, key: KeyPool | None, *, device_label: str | None, device_id: int | None = None
+    ) -> Tuple[str, str]:
         if key is None:
             raise VPNManagerError("WireGuard key required")
         template = (
@@ -69,7 +115,7 @@ class WireGuardManager(BaseVPNManager):
                     logger.warning("Failed to push configuration via wgctrl", exc_info=True)
         return file_name, template
 
-    def revoke(self, node: Node, key: KeyPool | None) -> None:
+    def revoke(self, node: Node, key: KeyPool | None, *, device_id: int | None = None) -> None:
         if not key or not self.client or not node.settings:
             return
         interface_name = node.settings.get("interface")
@@ -85,7 +131,9 @@ class OpenVPNManager(BaseVPNManager):
     def __init__(self) -> None:
         self.easyrsa_path = os.getenv("EASYRSA", "/etc/openvpn/easy-rsa")
 
-    def generate_config(self, node: Node, key: KeyPool | None, *, device_label: str | None) -> Tuple[str, str]:
+    def generate_config(
+        self, node: Node, key: KeyPool | None, *, device_label: str | None, device_id: int | None = None
+    ) -> Tuple[str, str]:
         if key is None or not key.certificate:
             raise VPNManagerError("OpenVPN certificate is missing")
         template = (
@@ -96,11 +144,11 @@ class OpenVPNManager(BaseVPNManager):
             "<ca>\n{ca}\n</ca>\n"
             "<cert>\n{cert}\n</cert>\n"
             "<key>\n{key}\n</key>\n"
-        ).format(endpoint=node.endpoint, ca=key.ca_certificate or "", cert=key.certificate, key=key.private_key)
+        ).format(endpoint=node.endpoint, ca=CA_CACHE.get(key), cert=key.certificate, key=key.private_key)
         file_name = f"{node.name}-{device_label or 'device'}.ovpn"
         return file_name, template
 
-    def revoke(self, node: Node, key: KeyPool | None) -> None:
+    def revoke(self, node: Node, key: KeyPool | None, *, device_id: int | None = None) -> None:
         if not key:
             return
         cert_name = key.public_key or key.private_key
@@ -117,13 +165,22 @@ class OpenVPNManager(BaseVPNManager):
 
 
 class AmneziaManager(BaseVPNManager):
+    """Profiles are exported with the provision id as ``--id``; Amnezia devices take no key from
+    the pool, so that id is what revokes and limits one profile rather than the whole node."""
+
+    supports_throttle = True
+
     def __init__(self, cli_path: str) -> None:
         self.cli_path = cli_path
 
-    def generate_config(self, node: Node, key: KeyPool | None, *, device_label: str | None) -> Tuple[str, str]:
+    def generate_config(
+        self, node: Node, key: KeyPool | None, *, device_label: str | None, device_id: int | None = None
+    ) -> Tuple[str, str]:
         args = [self.cli_path, "profile", "export", "--node", node.name]
         if device_label:
             args.extend(["--label", device_label])
+        if device_id is not None:
+            args.extend(["--id", str(device_id)])
         try:
             result = subprocess.run(args, capture_output=True, check=True, text=True)
             payload = result.stdout
@@ -134,15 +191,34 @@ class AmneziaManager(BaseVPNManager):
         file_name = f"{node.name}-{device_label or 'device'}.amnezia"
         return file_name, payload
 
-    def revoke(self, node: Node, key: KeyPool | None) -> None:
-        args = [self.cli_path, "profile", "revoke", "--node", node.name]
-        if key and key.public_key:
-            args.extend(["--key", key.public_key])
+    def revoke(self, node: Node, key: KeyPool | None, *, device_id: int | None = None) -> None:
+        args = [self.cli_path, "profile", "revoke", "--node", node.name, *self._profile_args(key, device_id)]
         try:
             subprocess.run(args, check=False, capture_output=True)
         except FileNotFoundError:  # pragma: no cover
             logger.warning("Amnezia CLI not found for revoke")
 
+    def throttle(self, node: Node, key: KeyPool | None, *, rate_kbps: int | None, device_id: int | None = None) -> None:
+        profile = self._profile_args(key, device_id)
+        if not profile:
+            raise VPNManagerError("Amnezia profile to limit is unknown")
+        args = [self.cli_path, "profile", "limit", "--node", node.name, *profile]
+        args.extend(["--rate", f"{rate_kbps}kbit" if rate_kbps else "unlimited"])
+        try:
+            subprocess.run(args, capture_output=True, check=True)
+        except FileNotFoundError as exc:  # pragma: no cover
+            raise VPNManagerError("Amnezia CLI not found") from exc
+        except subprocess.CalledProcessError as exc:  # pragma: no cover
+            raise VPNManagerError("Amnezia CLI failed") from exc
+
+    @staticmethod
+    def _profile_args(key: KeyPool | None, device_id: int | None) -> List[str]:
+        if key and key.public_key:
+            return ["--key", key.public_key]
+        if device_id is not None:
+            return ["--id", str(device_id)]
+        return []
+
 
 def build_qr_bytes(payload: str, *, error_correction: str) -> bytes:
     qr = segno.make(payload, error=error_correction)
@@ -1,10 +1,15 @@
 """SmartDNS service package."""
 
 __all__ = [
+    "cache",
     "config",
     "dns_server",
+    "frontend",
     "metrics",
     "monitor",
     "rules",
     "service",
+    "transport",
+    "upstreams",
+    "wire",
 ]
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from .metrics import CACHE_ENTRIES, CACHE_LOOKUPS
+from .wire import HEADER, OPT, SOA, Question, WireError, parse_question, parse_records, query_options, soa_minimum
+
+CacheKey = Tuple[str, int, int, int]
+
+NOERROR = 0
+NXDOMAIN = 3
+TRUNCATED = 0x0200
+
+
+@dataclass
+class CacheEntry:
+    packet: bytes
+    ttl_offsets: Tuple[Tuple[int, int], ...]
+    stored_at: float
+    expires_at: float
+    prefetch_at: float
+    hits: int = 0
+    prefetching: bool = False
+
+
+class ResponseCache:
+    """LRU of upstream replies keyed by ``(qname, qtype, qclass)`` and the query's EDNS, DO and CD bits.
+
+    A positive reply lives for its smallest record TTL, NXDOMAIN and NODATA replies for the
+    smaller of the SOA's TTL and MINIMUM (RFC 2308); replies without an SOA, failures and
+    truncated replies are not stored. On a hit the stored bytes are copied with the asker's
+    transaction ID and question (to keep its 0x20 case) and every TTL reduced by the time the
+    entry has spent in the cache.
+
+    An entry hit at least ``prefetch_min_hits`` times once ``prefetch_after`` of its TTL has
+    elapsed is handed, once, to the ``prefetch`` callback of :meth:`get` to be refreshed in the
+    background, so popular names do not expire in front of their clients.
+    """
+
+    def __init__(
+        self,
+        *,
+        maxsize: int = 10000,
+        max_ttl: int = 86400,
+        max_negative_ttl: int = 3600,
+        prefetch_after: float = 0.9,
+        prefetch_min_hits: int = 3,
+    ) -> None:
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.max_negative_ttl = max_negative_ttl
+        self.prefetch_after = prefetch_after
+        self.prefetch_min_hits = prefetch_min_hits
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question: Question, query: bytes) -> CacheKey:
+        return (question.name, question.qtype, question.qclass, query_options(query, question))
+
+    def get(
+        self,
+        question: Question,
+        query: bytes,
+        prefetch: Optional[Callable[[Question, bytes], bool]] = None,
+    ) -> Optional[bytes]:
+        """The cached reply to ``query``, if any.
+
+        ``prefetch(question, query)`` is called when the entry is due for a refresh and returns
+        whether a refresh was started; if not, a later hit offers the entry again.
+        """
+        key = self.key(question, query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                CACHE_LOOKUPS.labels(result="miss").inc()
+                return None
+            if now >= entry.expires_at:
+                del self._entries[key]
+                CACHE_ENTRIES.set(len(self._entries))
+                CACHE_LOOKUPS.labels(result="expired").inc()
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            due = (
+                prefetch is not None
+                and not entry.prefetching
+                and entry.hits >= self.prefetch_min_hits
+                and now >= entry.prefetch_at
+            )
+            if due:
+                entry.prefetching = True
+        CACHE_LOOKUPS.labels(result="hit").inc()
+        if due and not prefetch(question, query):  # type: ignore[misc]
+            entry.prefetching = False
+        return self._render(entry, question, query, int(now - entry.stored_at))
+
+    def put(self, question: Question, query: bytes, reply: bytes) -> Optional[CacheEntry]:
+        try:
+            ttl, ttl_offsets = self._ttl(question, reply)
+        except WireError:
+            return None
+        if ttl <= 0:
+            return None
+        now = time.monotonic()
+        entry = CacheEntry(
+            packet=reply,
+            ttl_offsets=ttl_offsets,
+            stored_at=now,
+            expires_at=now + ttl,
+            prefetch_at=now + ttl * self.prefetch_after,
+        )
+        key = self.key(question, query)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            CACHE_ENTRIES.set(len(self._entries))
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            CACHE_ENTRIES.set(0)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _ttl(self, question: Question, reply: bytes) -> Tuple[int, Tuple[Tuple[int, int], ...]]:
+        # The question is copied from the asker's query on a hit, so it must line up byte for byte.
+        if parse_question(reply) != question:
+            return 0, ()
+        flags = HEADER.unpack_from(reply)[1]
+        rcode = flags & 0x000F
+        if flags & TRUNCATED or rcode not in (NOERROR, NXDOMAIN):
+            return 0, ()
+        records = parse_records(reply, question)
+        # OPT's TTL field carries EDNS flags, not a lifetime.
+        ttl_offsets = tuple((record.ttl_offset, record.ttl) for record in records if record.rtype != OPT)
+        if rcode == NOERROR and any(record.section == 0 for record in records):
+            return min(min(ttl for _, ttl in ttl_offsets), self.max_ttl), ttl_offsets
+        soa = next((record for record in records if record.section == 1 and record.rtype == SOA), None)
+        if soa is None:
+            return 0, ()
+        return min(soa.ttl, soa_minimum(reply, soa), self.max_negative_ttl), ttl_offsets
+
+    @staticmethod
+    def _render(entry: CacheEntry, question: Question, query: bytes, elapsed: int) -> bytes:
+        packet = bytearray(entry.packet)
+        packet[0:2] = query[0:2]
+        packet[HEADER.size : question.end] = query[HEADER.size : question.end]
+        for offset, ttl in entry.ttl_offsets:
+            struct.pack_into("!I", packet, offset, max(ttl - elapsed, 0))
+        return bytes(packet)
@@ -11,6 +11,9 @@ class SmartDNSSettings(BaseSettings):
     host: str = Field("0.0.0.0", alias="SMARTDNS_HOST")
     port: int = Field(1053, alias="SMARTDNS_PORT")
     enable_tcp: bool = Field(True, alias="SMARTDNS_ENABLE_TCP")
+    frontend: str = Field("asyncio", alias="SMARTDNS_FRONTEND")
+    max_concurrency: int = Field(1024, alias="SMARTDNS_MAX_CONCURRENCY", ge=1)
+    workers: int = Field(1, alias="SMARTDNS_WORKERS", ge=1)
     reload_interval: int = Field(30, alias="SMARTDNS_RELOAD_INTERVAL")
     rules_backend: str = Field("auto", alias="SMARTDNS_RULES_BACKEND")
     rules_file: str | None = Field(None, alias="SMARTDNS_RULES_FILE")
@@ -20,8 +23,22 @@ class SmartDNSSettings(BaseSettings):
         alias="SMARTDNS_UPSTREAMS",
     )
     upstream_timeout: float = Field(2.0, alias="SMARTDNS_UPSTREAM_TIMEOUT")
+    upstream_udp_sockets: int = Field(4, alias="SMARTDNS_UPSTREAM_UDP_SOCKETS", ge=1)
+    upstream_socket_max_queries: int = Field(10000, alias="SMARTDNS_UPSTREAM_SOCKET_MAX_QUERIES", ge=1)
+    hedge_min_delay: float = Field(0.01, alias="SMARTDNS_HEDGE_MIN_DELAY", ge=0)
+    hedge_max_delay: float = Field(0.5, alias="SMARTDNS_HEDGE_MAX_DELAY", ge=0)
+    hedge_max_parallel: int = Field(2, alias="SMARTDNS_HEDGE_MAX_PARALLEL", ge=1)
+    cache_size: int = Field(10000, alias="SMARTDNS_CACHE_SIZE", ge=0)
+    cache_max_ttl: int = Field(86400, alias="SMARTDNS_CACHE_MAX_TTL", ge=0)
+    cache_max_negative_ttl: int = Field(3600, alias="SMARTDNS_CACHE_MAX_NEGATIVE_TTL", ge=0)
+    prefetch_after: float = Field(0.9, alias="SMARTDNS_PREFETCH_AFTER", gt=0, le=1)
+    prefetch_min_hits: int = Field(3, alias="SMARTDNS_PREFETCH_MIN_HITS", ge=1)
+    prefetch_concurrency: int = Field(16, alias="SMARTDNS_PREFETCH_CONCURRENCY", ge=0)
     metrics_host: str = Field("0.0.0.0", alias="SMARTDNS_METRICS_HOST")
     metrics_port: int = Field(9105, alias="SMARTDNS_METRICS_PORT")
+    profiler_token: str | None = Field(None, alias="SMARTDNS_PROFILER_TOKEN")
+    profiler_host: str = Field("127.0.0.1", alias="SMARTDNS_PROFILER_HOST")
+    profiler_port: int = Field(9106, alias="SMARTDNS_PROFILER_PORT")
     monitor_domain: str = Field("example.com", alias="SMARTDNS_MONITOR_DOMAIN")
     monitor_interval: int = Field(30, alias="SMARTDNS_MONITOR_INTERVAL")
     monitor_timeout: float = Field(2.0, alias="SMARTDNS_MONITOR_TIMEOUT")
@@ -53,7 +70,16 @@ class SmartDNSSettings(BaseSettings):
             raise ValueError(f"rules_backend must be one of {allowed}")
         return normalized
 
-    @field_validator("host", "metrics_host", "monitor_host", mode="before")
+    @field_validator("frontend")
+    @classmethod
+    def _validate_frontend(cls, value: str) -> str:
+        allowed = {"asyncio", "threaded"}
+        normalized = value.lower()
+        if normalized not in allowed:
+            raise ValueError(f"frontend must be one of {allowed}")
+        return normalized
+
+    @field_validator("host", "metrics_host", "monitor_host", "profiler_host", mode="before")
     @classmethod
     def _validate_host(cls, value: str) -> str:
         if value:
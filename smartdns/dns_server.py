@@ -1,96 +1,208 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import socket
 import time
-from dataclasses import dataclass
-from typing import Iterable, List
+from typing import Dict, List, Set
 
 from dnslib import A, DNSRecord, QTYPE, RR
-from dnslib.server import BaseResolver, DNSServer
+from dnslib.server import BaseResolver, DNSLogger, DNSServer, TCPServer, UDPServer
 
-from .metrics import REQUEST_TOTAL, RULE_MATCHES, RULES_ACTIVE, UPSTREAM_LATENCY
-from .rules import RuleStore
+from .cache import CacheKey, ResponseCache
+from .metrics import CACHE_PREFETCHES, REQUEST_TOTAL, RULE_MATCHES, RULES_ACTIVE, RULES_VERSION, UPSTREAM_COALESCED
+from .rules import Rule, RuleStore
+from .upstreams import UpstreamManager
+from .wire import Question, parse_question, reply_for
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class Upstream:
-    host: str
-    port: int
-
-
-def parse_upstreams(values: Iterable[str]) -> List[Upstream]:
-    upstreams: List[Upstream] = []
-    for value in values:
-        if ":" in value:
-            host, port_str = value.split(":", 1)
-            try:
-                port = int(port_str)
-            except ValueError:
-                logger.warning("Invalid port in upstream %s, skipping", value)
-                continue
-        else:
-            host, port = value, 53
-        upstreams.append(Upstream(host=host, port=port))
-    if not upstreams:
-        raise ValueError("At least one upstream DNS server is required")
-    return upstreams
+class SmartDNSResolver(BaseResolver):
+    """Answers from the rules and forwards everything else upstream.
 
+    :meth:`resolve` is the blocking entry point used by dnslib's threaded server,
+    :meth:`resolve_async` the one used by :class:`smartdns.frontend.DNSFrontend`. The latter
+    works on wire format: only the question is decoded, forwarded queries are relayed as received
+    and the upstream's reply is returned without being parsed and packed again. Both consult the
+    response cache, when there is one, after the rules. On the asynchronous path a query that
+    misses while one with the same cache key (question plus EDNS, DO and CD) is already being
+    forwarded waits for that exchange and gets a copy of its reply instead of asking the
+    upstreams again. It also refreshes popular cache entries in the background, at most
+    ``prefetch_concurrency`` at once.
+    """
 
-class SmartDNSResolver(BaseResolver):
-    def __init__(self, store: RuleStore, upstreams: List[Upstream], timeout: float) -> None:
+    def __init__(
+        self,
+        store: RuleStore,
+        upstreams: UpstreamManager,
+        cache: ResponseCache | None = None,
+        prefetch_concurrency: int = 16,
+    ) -> None:
         self.store = store
         self.upstreams = upstreams
-        self.timeout = timeout
+        self.cache = cache
+        self.prefetch_concurrency = prefetch_concurrency
+        self._inflight: Dict[CacheKey, asyncio.Future] = {}
+        self._prefetches: Set[asyncio.Task] = set()
 
     def resolve(self, request: DNSRecord, handler) -> DNSRecord:  # type: ignore[override]
-        qname = str(request.q.qname).rstrip(".").lower()
-        qtype = QTYPE[request.q.qtype]
-        logger.debug("Received query %s %s", qname, qtype)
-        if qtype in {"A", "ANY"}:
-            rule = self.store.lookup(qname)
-            if rule:
-                reply = request.reply()
-                reply.add_answer(RR(rname=request.q.qname, rtype=QTYPE.A, rclass=1, ttl=rule.ttl, rdata=A(rule.ip_address)))
-                REQUEST_TOTAL.labels(result="rule").inc()
-                RULE_MATCHES.labels(pattern=rule.pattern).inc()
-                return reply
+        reply = self._answer_from_rules(request)
+        if reply is not None:
+            return reply
+        packet = request.pack()
+        question = parse_question(packet)
+        if self.cache is not None:
+            cached = self.cache.get(question, packet)
+            if cached is not None:
+                REQUEST_TOTAL.labels(result="cache").inc()
+                return DNSRecord.parse(cached)
         try:
             response = self._forward(request)
             REQUEST_TOTAL.labels(result="upstream").inc()
-            return response
         except Exception:
             REQUEST_TOTAL.labels(result="failed").inc()
             raise
+        if self.cache is not None:
+            self.cache.put(question, packet, response)
+        return DNSRecord.parse(response)
+
+    async def resolve_async(self, packet: bytes) -> bytes:
+        question = parse_question(packet)
+        if question.qtype in (QTYPE.A, QTYPE.ANY):
+            rule = self.store.lookup(question.name)
+            if rule:
+                return self._rule_reply(DNSRecord.parse(packet), rule).pack()
+        if self.cache is not None:
+            cached = self.cache.get(question, packet, self._prefetch if self.prefetch_concurrency else None)
+            if cached is not None:
+                REQUEST_TOTAL.labels(result="cache").inc()
+                return cached
+        try:
+            response = await self._forward_async(question, packet)
+            REQUEST_TOTAL.labels(result="upstream").inc()
+        except Exception:
+            REQUEST_TOTAL.labels(result="failed").inc()
+            raise
+        if self.cache is not None:
+            self.cache.put(question, packet, response)
+        return response
 
-    def _forward(self, request: DNSRecord) -> DNSRecord:
+    def _answer_from_rules(self, request: DNSRecord) -> DNSRecord | None:
+        qname = str(request.q.qname).rstrip(".").lower()
+        qtype = QTYPE[request.q.qtype]
+        logger.debug("Received query %s %s", qname, qtype)
+        if qtype not in {"A", "ANY"}:
+            return None
+        rule = self.store.lookup(qname)
+        if not rule:
+            return None
+        return self._rule_reply(request, rule)
+
+    def _rule_reply(self, request: DNSRecord, rule: Rule) -> DNSRecord:
+        reply = request.reply()
+        reply.add_answer(RR(rname=request.q.qname, rtype=QTYPE.A, rclass=1, ttl=rule.ttl, rdata=A(rule.ip_address)))
+        REQUEST_TOTAL.labels(result="rule").inc()
+        RULE_MATCHES.labels(pattern=rule.pattern).inc()
+        return reply
+
+    def _forward(self, request: DNSRecord) -> bytes:
         last_error: Exception | None = None
-        for upstream in self.upstreams:
+        for health in self.upstreams.ranked():
+            upstream = health.upstream
+            start = time.perf_counter()
             try:
-                start = time.perf_counter()
-                raw = request.send(upstream.host, upstream.port, timeout=self.timeout)
-                duration = time.perf_counter() - start
-                UPSTREAM_LATENCY.observe(duration)
-                return DNSRecord.parse(raw)
+                raw = request.send(upstream.host, upstream.port, timeout=self.upstreams.timeout)
             except Exception as exc:
                 last_error = exc
-                logger.warning("Upstream %s:%s failed: %s", upstream.host, upstream.port, exc)
+                self.upstreams.record(health, None, exc)
                 continue
+            self.upstreams.record(health, time.perf_counter() - start)
+            return raw
         if last_error:
             raise last_error
         raise RuntimeError("No upstream servers configured")
 
+    def _prefetch(self, question: Question, packet: bytes) -> bool:
+        if len(self._prefetches) >= self.prefetch_concurrency:
+            CACHE_PREFETCHES.labels(result="skipped").inc()
+            return False
+        task = asyncio.ensure_future(self._refresh(question, packet))
+        self._prefetches.add(task)
+        task.add_done_callback(self._prefetches.discard)
+        return True
+
+    async def _refresh(self, question: Question, packet: bytes) -> None:
+        try:
+            response = await self._forward_async(question, packet)
+        except Exception as exc:
+            CACHE_PREFETCHES.labels(result="failed").inc()
+            logger.debug("Prefetch of %s failed: %r", question.name, exc)
+            return
+        self.cache.put(question, packet, response)  # type: ignore[union-attr]
+        CACHE_PREFETCHES.labels(result="refreshed").inc()
+
+    async def _forward_async(self, question: Question, packet: bytes) -> bytes:
+        key = ResponseCache.key(question, packet)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            UPSTREAM_COALESCED.inc()
+            # Shielded so that one waiter giving up does not cancel the exchange for the rest.
+            return reply_for(await asyncio.shield(inflight), packet, question)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self.upstreams.query(packet)
+        except asyncio.CancelledError:
+            future.set_exception(ConnectionError("Coalesced upstream query was cancelled"))
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(response)
+        finally:
+            del self._inflight[key]
+            # Mark the outcome as seen even when nobody else was waiting for it.
+            future.exception()
+        return response
+
+
+class _ReusePortUDPServer(UDPServer):
+    def server_bind(self) -> None:
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class _ReusePortTCPServer(TCPServer):
+    def server_bind(self) -> None:
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
 
 def create_dns_server(
     store: RuleStore,
-    upstreams: List[Upstream],
-    timeout: float,
+    upstreams: UpstreamManager,
     host: str,
     port: int,
     enable_tcp: bool,
-) -> DNSServer:
-    resolver = SmartDNSResolver(store=store, upstreams=upstreams, timeout=timeout)
-    server = DNSServer(resolver, address=host, port=port, tcp=enable_tcp, udp=True)
-    RULES_ACTIVE.set(len(store))
-    return server
+    cache: ResponseCache | None = None,
+    reuse_port: bool = False,
+) -> List[DNSServer]:
+    """dnslib serves one protocol per server, so TCP gets a second one next to UDP.
+
+    The threaded path asks upstreams one at a time, best ranked first, without hedging.
+    ``reuse_port`` binds with SO_REUSEPORT, as for :class:`smartdns.frontend.DNSFrontend`.
+    """
+    resolver = SmartDNSResolver(store=store, upstreams=upstreams, cache=cache)
+    # dnslib's default logger prints every request and reply to stdout.
+    quiet = DNSLogger("error", prefix=False)
+    udp_server = _ReusePortUDPServer if reuse_port else None
+    tcp_server = _ReusePortTCPServer if reuse_port else None
+    servers = [DNSServer(resolver, address=host, port=port, logger=quiet, server=udp_server)]
+    if enable_tcp:
+        servers.append(DNSServer(resolver, address=host, port=port, tcp=True, logger=quiet, server=tcp_server))
+    snapshot = store.snapshot
+    RULES_ACTIVE.set(len(snapshot.rules))
+    RULES_VERSION.set(snapshot.version)
+    return servers
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import struct
+from contextlib import suppress
+from typing import Set, Tuple
+
+from dnslib import RCODE
+
+from .cache import ResponseCache
+from .dns_server import SmartDNSResolver
+from .metrics import REQUEST_TOTAL, RULES_ACTIVE, RULES_VERSION
+from .rules import RuleStore
+from .upstreams import UpstreamManager
+from .wire import WireError, error_reply, parse_question
+
+logger = logging.getLogger(__name__)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, frontend: "DNSFrontend") -> None:
+        self.frontend = frontend
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        self.frontend._on_datagram(self.transport, data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        logger.debug("UDP error on SmartDNS listener: %s", exc)
+
+
+class DNSFrontend:
+    """asyncio UDP/TCP listener in front of :meth:`SmartDNSResolver.resolve_async`.
+
+    Every query is a task on the event loop instead of a thread, and upstream I/O never blocks.
+    At most ``max_concurrency`` queries are resolved at once: UDP queries beyond that are dropped
+    (the client retries), TCP connections stop being read until a slot frees up. Queries on one
+    TCP connection are answered as they complete, so pipelined clients are not serialised.
+    With ``reuse_port`` the sockets are bound with SO_REUSEPORT, so several worker processes can
+    listen on the same port and the kernel spreads queries between them.
+    """
+
+    def __init__(
+        self,
+        resolver: SmartDNSResolver,
+        *,
+        host: str,
+        port: int,
+        enable_tcp: bool = True,
+        max_concurrency: int = 1024,
+        tcp_idle_timeout: float = 10.0,
+        reuse_port: bool = False,
+    ) -> None:
+        self.resolver = resolver
+        self.host = host
+        self.port = port
+        self.enable_tcp = enable_tcp
+        self.max_concurrency = max_concurrency
+        self.reuse_port = reuse_port
+        self.tcp_idle_timeout = tcp_idle_timeout
+        self._inflight = 0
+        self._released = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+        self._udp: asyncio.DatagramTransport | None = None
+        self._tcp: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._udp, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self),
+            local_addr=(self.host, self.port),
+            reuse_port=self.reuse_port or None,
+        )
+        if self.enable_tcp:
+            self._tcp = await asyncio.start_server(
+                self._serve_stream,
+                self.host,
+                self.port,
+                reuse_port=self.reuse_port or None,
+            )
+
+    async def stop(self) -> None:
+        if self._udp is not None:
+            self._udp.close()
+        if self._tcp is not None:
+            self._tcp.close()
+            await self._tcp.wait_closed()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _try_acquire(self) -> bool:
+        if self._inflight >= self.max_concurrency:
+            return False
+        self._inflight += 1
+        return True
+
+    async def _acquire(self) -> None:
+        while not self._try_acquire():
+            self._released.clear()
+            await self._released.wait()
+
+    def _release(self) -> None:
+        self._inflight -= 1
+        self._released.set()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _on_datagram(self, transport: asyncio.DatagramTransport, data: bytes, addr: Tuple[str, int]) -> None:
+        if not self._try_acquire():
+            REQUEST_TOTAL.labels(result="dropped").inc()
+            return
+        self._spawn(self._answer_datagram(transport, data, addr))
+
+    async def _answer_datagram(self, transport: asyncio.DatagramTransport, data: bytes, addr: Tuple[str, int]) -> None:
+        try:
+            reply = await self._answer(data)
+        finally:
+            self._release()
+        if reply is not None and not transport.is_closing():
+            transport.sendto(reply, addr)
+
+    async def _serve_stream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        pending: Set[asyncio.Task] = set()
+        try:
+            while True:
+                header = await asyncio.wait_for(reader.readexactly(2), self.tcp_idle_timeout)
+                data = await reader.readexactly(struct.unpack("!H", header)[0])
+                await self._acquire()
+                task = self._spawn(self._answer_stream(data, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            try:
+                # A client may half-close right after its last query and still read the answers.
+                await asyncio.gather(*pending, return_exceptions=True)
+            finally:
+                writer.close()
+                with suppress(ConnectionError):
+                    await writer.wait_closed()
+
+    async def _answer_stream(self, data: bytes, writer: asyncio.StreamWriter) -> None:
+        try:
+            reply = await self._answer(data)
+        finally:
+            self._release()
+        if reply is not None and not writer.is_closing():
+            writer.write(struct.pack("!H", len(reply)) + reply)
+
+    async def _answer(self, data: bytes) -> bytes | None:
+        try:
+            question = parse_question(data)
+        except WireError as exc:
+            REQUEST_TOTAL.labels(result="malformed").inc()
+            logger.debug("Malformed DNS query: %s", exc)
+            return None
+        try:
+            return await self.resolver.resolve_async(data)
+        except Exception as exc:
+            logger.warning("Failed to resolve %s: %r", question.name, exc)
+            return error_reply(data, question, RCODE.SERVFAIL)
+
+
+def create_dns_frontend(
+    store: RuleStore,
+    upstreams: UpstreamManager,
+    host: str,
+    port: int,
+    enable_tcp: bool,
+    max_concurrency: int,
+    cache: ResponseCache | None = None,
+    prefetch_concurrency: int = 16,
+    reuse_port: bool = False,
+) -> DNSFrontend:
+    resolver = SmartDNSResolver(
+        store=store,
+        upstreams=upstreams,
+        cache=cache,
+        prefetch_concurrency=prefetch_concurrency,
+    )
+    frontend = DNSFrontend(
+        resolver,
+        host=host,
+        port=port,
+        enable_tcp=enable_tcp,
+        max_concurrency=max_concurrency,
+        reuse_port=reuse_port,
+    )
+    snapshot = store.snapshot
+    RULES_ACTIVE.set(len(snapshot.rules))
+    RULES_VERSION.set(snapshot.version)
+    return frontend
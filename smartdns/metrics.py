@@ -8,6 +8,24 @@ REQUEST_TOTAL = Counter(
     labelnames=("result",),
 )
 
+CACHE_LOOKUPS = Counter(
+    "smartdns_cache_lookups_total",
+    "Response cache lookups for forwarded queries; hit ratio is hit / (hit + miss + expired)",
+    labelnames=("result",),
+)
+
+CACHE_ENTRIES = Gauge(
+    "smartdns_cache_entries",
+    "Replies currently held in the response cache",
+    multiprocess_mode="livesum",
+)
+
+CACHE_PREFETCHES = Counter(
+    "smartdns_cache_prefetches_total",
+    "Background refreshes of popular cache entries before they expire; skipped when at the concurrency limit",
+    labelnames=("result",),
+)
+
 RULE_MATCHES = Counter(
     "smartdns_rule_matches_total",
     "Number of queries served from SmartDNS rules",
@@ -23,14 +41,45 @@ RULE_RELOADS = Counter(
 RULES_ACTIVE = Gauge(
     "smartdns_rules_active",
     "Currently active rules in memory",
+    multiprocess_mode="livemax",
+)
+
+RULES_VERSION = Gauge(
+    "smartdns_rules_version",
+    "Version of the rule snapshot serving queries, incremented on every change; per worker (pid) under the supervisor",
+    multiprocess_mode="liveall",
 )
 
 UPSTREAM_LATENCY = Histogram(
     "smartdns_upstream_request_seconds",
-    "Latency of upstream DNS queries",
+    "Latency of successful upstream DNS queries",
+    labelnames=("upstream",),
+)
+
+UPSTREAM_ERRORS = Counter(
+    "smartdns_upstream_errors_total",
+    "Upstream queries that failed, timed out or were answered with SERVFAIL/REFUSED",
+    labelnames=("upstream",),
+)
+
+UPSTREAM_TCP_QUERIES = Counter(
+    "smartdns_upstream_tcp_queries_total",
+    "Queries retried over TCP because the upstream's UDP reply was truncated",
+    labelnames=("upstream",),
+)
+
+UPSTREAM_HEDGES = Counter(
+    "smartdns_upstream_hedged_total",
+    "Queries sent to another upstream because the first one had not answered within the hedge delay",
+)
+
+UPSTREAM_COALESCED = Counter(
+    "smartdns_upstream_coalesced_total",
+    "Queries answered by an identical query already in flight instead of their own upstream query",
 )
 
 MONITOR_STATUS = Gauge(
     "smartdns_health_status",
     "1 if last health probe succeeded",
+    multiprocess_mode="livemax",
 )
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import logging
+import sys
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from pathlib import Path
-from threading import RLock
-from typing import Dict, Iterable, List, Protocol
+from threading import Lock
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Protocol, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -16,30 +19,149 @@ class Rule:
     ttl: int = 60
 
 
+@dataclass(frozen=True)
+class RuleChanges:
+    """Rules added or changed and patterns removed since a source was last asked.
+
+    ``complete`` means ``rules`` is the whole rule set and every other pattern is gone; a source
+    reports that on the first call and whenever it cannot tell what changed. An empty, incomplete
+    value means nothing changed.
+    """
+
+    rules: Tuple[Rule, ...] = ()
+    removed: FrozenSet[str] = frozenset()
+    complete: bool = False
+
+    def __bool__(self) -> bool:
+        return self.complete or bool(self.rules) or bool(self.removed)
+
+
 class RuleSource(Protocol):
     def load(self) -> List[Rule]:
         ...
 
 
+class IncrementalRuleSource(RuleSource, Protocol):
+    def changes(self) -> RuleChanges:
+        ...
+
+
+def poll_changes(source: RuleSource) -> RuleChanges:
+    """:meth:`IncrementalRuleSource.changes` when the source has it, otherwise a complete load."""
+    changes = getattr(source, "changes", None)
+    if changes is not None:
+        return changes()
+    return RuleChanges(rules=tuple(source.load()), complete=True)
+
+
+def _diff(old: Mapping[str, Rule], new: Mapping[str, Rule]) -> RuleChanges:
+    return RuleChanges(
+        rules=tuple(rule for pattern, rule in new.items() if old.get(pattern) != rule),
+        removed=frozenset(old.keys() - new.keys()),
+    )
+
+
 class DatabaseRuleSource:
+    """Rules from the ``smartdns_rules`` table.
+
+    :meth:`changes` reads only rows whose ``updated_at`` is newer than the newest one seen so far,
+    less ``overlap`` seconds for transactions that committed late and for a lagging replica. A row
+    with ``is_active`` false is a tombstone and removes its pattern, so rules should be deactivated
+    rather than deleted. A deleted row leaves nothing to read; the number of active rows is checked
+    after every delta and a mismatch triggers a complete reload.
+    """
+
+    def __init__(self, overlap: float = 60.0) -> None:
+        self.overlap = timedelta(seconds=overlap)
+        self._watermark: Optional[datetime] = None
+        self._rules: Optional[Dict[int, Rule]] = None
+
     def load(self) -> List[Rule]:
-        from db import session_scope
+        from db import read_session_scope
+
+        with read_session_scope() as session:
+            return list(self._read_active(session).values())
+
+    def changes(self) -> RuleChanges:
+        from db import read_session_scope
         from db.models import SmartDNSRule
+        from sqlalchemy import func, select
 
-        with session_scope() as session:
-            rows = (
-                session.query(SmartDNSRule)
-                .filter(SmartDNSRule.is_active.is_(True))
-                .order_by(SmartDNSRule.id.asc())
-                .all()
+        with read_session_scope() as session:
+            if self._rules is None:
+                return self._reload(session)
+            query = select(
+                SmartDNSRule.id,
+                SmartDNSRule.pattern,
+                SmartDNSRule.ip_address,
+                SmartDNSRule.ttl,
+                SmartDNSRule.is_active,
+                SmartDNSRule.updated_at,
             )
-            logger.debug("Loaded %s rules from database", len(rows))
-            return [Rule(pattern=row.pattern.lower(), ip_address=row.ip_address, ttl=row.ttl) for row in rows]
+            if self._watermark is not None:
+                query = query.where(SmartDNSRule.updated_at >= self._watermark - self.overlap)
+            upserts: Dict[str, Rule] = {}
+            removed: Set[str] = set()
+            for row in session.execute(query):
+                if self._watermark is None or row.updated_at > self._watermark:
+                    self._watermark = row.updated_at
+                old = self._rules.get(row.id)
+                new = self._rule(row) if row.is_active else None
+                if old == new:
+                    continue
+                if old is not None and (new is None or old.pattern != new.pattern):
+                    removed.add(old.pattern)
+                if new is None:
+                    del self._rules[row.id]
+                else:
+                    self._rules[row.id] = new
+                    upserts[new.pattern] = new
+            active = session.execute(
+                select(func.count()).select_from(SmartDNSRule).where(SmartDNSRule.is_active.is_(True))
+            ).scalar_one()
+            if active != len(self._rules):
+                logger.info("SmartDNS rules were deleted from the database, reloading all of them")
+                return self._reload(session)
+        logger.debug("Loaded %s changed and %s removed rules from database", len(upserts), len(removed))
+        return RuleChanges(rules=tuple(upserts.values()), removed=frozenset(removed - upserts.keys()))
+
+    def _reload(self, session) -> RuleChanges:
+        from db.models import SmartDNSRule
+        from sqlalchemy import func, select
+
+        # Taken before the rows, so a change committed in between is read again next time.
+        self._watermark = session.execute(select(func.max(SmartDNSRule.updated_at))).scalar()
+        self._rules = self._read_active(session)
+        return RuleChanges(rules=tuple(self._rules.values()), complete=True)
+
+    def _read_active(self, session) -> Dict[int, Rule]:
+        from db.models import SmartDNSRule
+        from sqlalchemy import select
+
+        rows = session.execute(
+            select(SmartDNSRule.id, SmartDNSRule.pattern, SmartDNSRule.ip_address, SmartDNSRule.ttl)
+            .where(SmartDNSRule.is_active.is_(True))
+            .order_by(SmartDNSRule.id.asc())
+        ).all()
+        logger.debug("Loaded %s rules from database", len(rows))
+        return {row.id: self._rule(row) for row in rows}
+
+    @staticmethod
+    def _rule(row) -> Rule:
+        return Rule(pattern=row.pattern.lower(), ip_address=row.ip_address, ttl=row.ttl)
 
 
 class FileRuleSource:
+    """Rules from a text file, one ``pattern ip [ttl]`` per line.
+
+    :meth:`changes` parses the file again only when its inode, size or mtime differ from the last
+    read, and reports the difference from the rules read then.
+    """
+
     def __init__(self, path: str) -> None:
         self.path = Path(path)
+        self._signature: Optional[Tuple[int, int, int, int]] = None
+        self._rules: Optional[Dict[str, Rule]] = None
 
     def load(self) -> List[Rule]:
         if not self.path.exists():
@@ -64,10 +186,28 @@ class FileRuleSource:
         logger.debug("Loaded %s rules from file %s", len(rules), self.path)
         return rules
 
+    def changes(self) -> RuleChanges:
+        try:
+            stat = self.path.stat()
+            signature: Optional[Tuple[int, int, int, int]] = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            signature = None
+        if self._rules is not None and signature == self._signature:
+            return RuleChanges()
+        # Stat before reading: a write that lands during the read changes the next signature.
+        rules = {rule.pattern: rule for rule in self.load()}
+        previous, self._rules, self._signature = self._rules, rules, signature
+        if previous is None:
+            return RuleChanges(rules=tuple(rules.values()), complete=True)
+        return _diff(previous, rules)
+
 
 class CompositeRuleSource:
+    """Rules of several sources; for a pattern defined more than once the last source wins."""
+
     def __init__(self, sources: Iterable[RuleSource]) -> None:
         self.sources = list(sources)
+        self._rules: Optional[List[Dict[str, Rule]]] = None
 
     def load(self) -> List[Rule]:
         merged: Dict[str, Rule] = {}
@@ -76,38 +216,174 @@ class CompositeRuleSource:
                 merged[rule.pattern] = rule
         return list(merged.values())
 
+    def changes(self) -> RuleChanges:
+        complete = self._rules is None
+        if self._rules is None:
+            self._rules = [{} for _ in self.sources]
+        touched: Set[str] = set()
+        for rules, source in zip(self._rules, self.sources):
+            changes = poll_changes(source)
+            if changes.complete:
+                touched.update(rules)
+                rules.clear()
+            for pattern in changes.removed:
+                rules.pop(pattern, None)
+            rules.update((rule.pattern, rule) for rule in changes.rules)
+            touched.update(changes.removed)
+            touched.update(rule.pattern for rule in changes.rules)
+        if complete:
+            merged: Dict[str, Rule] = {}
+            for rules in self._rules:
+                merged.update(rules)
+            return RuleChanges(rules=tuple(merged.values()), complete=True)
+        upserts: List[Rule] = []
+        removed: Set[str] = set()
+        for pattern in touched:
+            rule = next((rules[pattern] for rules in reversed(self._rules) if pattern in rules), None)
+            if rule is None:
+                removed.add(pattern)
+            else:
+                upserts.append(rule)
+        return RuleChanges(rules=tuple(upserts), removed=frozenset(removed))
+
+
+class RuleIndex:
+    """Exact rules and wildcard suffixes in two dicts, probed without building candidate names.
+
+    ``*.example.com`` is stored under ``example.com`` in the wildcard dict. A lookup is one probe
+    for the exact name and then one probe per label boundary, slicing the name at each dot from
+    the left so the first hit is the most specific wildcard. Boundaries that would leave a suffix
+    longer than the longest wildcard are skipped, so names under no wildcard cost a single probe.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = ()) -> None:
+        self._exact: Dict[str, Rule] = {}
+        self._wildcards: Dict[str, Rule] = {}
+        self._longest = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: Rule) -> None:
+        pattern = rule.pattern.rstrip(".").lower()
+        if pattern.startswith("*."):
+            suffix = sys.intern(pattern[2:])
+            self._wildcards[suffix] = rule
+            self._longest = max(self._longest, len(suffix))
+        else:
+            self._exact[sys.intern(pattern)] = rule
+
+    def remove(self, pattern: str) -> None:
+        pattern = pattern.rstrip(".").lower()
+        if pattern.startswith("*."):
+            suffix = pattern[2:]
+            self._wildcards.pop(suffix, None)
+            if len(suffix) == self._longest:
+                self._longest = max(map(len, self._wildcards), default=0)
+        else:
+            self._exact.pop(pattern, None)
+
+    def copy(self) -> RuleIndex:
+        index = RuleIndex()
+        index._exact = self._exact.copy()
+        index._wildcards = self._wildcards.copy()
+        index._longest = self._longest
+        return index
+
+    def lookup(self, domain: str) -> Rule | None:
+        domain = domain.rstrip(".").lower()
+        rule = self._exact.get(domain)
+        if rule is not None or not self._wildcards:
+            return rule
+        wildcards = self._wildcards
+        dot = domain.find(".", max(0, len(domain) - self._longest - 1))
+        while dot != -1:
+            rule = wildcards.get(domain[dot + 1 :])
+            if rule is not None:
+                return rule
+            dot = domain.find(".", dot + 1)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._exact) + len(self._wildcards)
+
+
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """One published rule set. Never mutated once :class:`RuleStore` hands it out."""
+
+    version: int
+    rules: Mapping[str, Rule]
+    index: RuleIndex
+
 
 class RuleStore:
+    """Publishes rule sets as immutable snapshots swapped by reference.
+
+    Readers take :attr:`snapshot` (a single attribute load) and never lock, so dnslib's
+    resolver threads do not serialise on each other or wait for a reload. Reloads build the
+    next snapshot aside and only take a lock among themselves. A source that reports deltas
+    (:class:`IncrementalRuleSource`) gets them applied to a copy of the current index instead of
+    a rebuilt one.
+    """
+
     def __init__(self, source: RuleSource) -> None:
         self._source = source
-        self._lock = RLock()
-        self._rules: Dict[str, Rule] = {}
+        self._reload_lock = Lock()
+        self._snapshot = RuleSnapshot(version=0, rules=MappingProxyType({}), index=RuleIndex())
+
+    @property
+    def snapshot(self) -> RuleSnapshot:
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
 
     def reload(self) -> bool:
-        rules = self._source.load()
-        normalized = {rule.pattern.rstrip("."): rule for rule in rules}
-        with self._lock:
-            if normalized == self._rules:
+        # Deltas only make sense applied in the order the source handed them out.
+        with self._reload_lock:
+            changes = poll_changes(self._source)
+            if not changes:
                 return False
-            self._rules = normalized
-        logger.info("Loaded %s SmartDNS rules", len(normalized))
+            current = self._snapshot
+            if changes.complete:
+                rules = {rule.pattern.rstrip("."): rule for rule in changes.rules}
+                if rules == current.rules:
+                    return False
+                index = RuleIndex(rules.values())
+            else:
+                upserts = {}
+                for rule in changes.rules:
+                    pattern = rule.pattern.rstrip(".")
+                    if current.rules.get(pattern) != rule:
+                        upserts[pattern] = rule
+                removed = {pattern.rstrip(".") for pattern in changes.removed}
+                removed = {pattern for pattern in removed if pattern in current.rules and pattern not in upserts}
+                if not upserts and not removed:
+                    return False
+                # MappingProxyType.copy() is dict.copy(); dict(proxy) would go key by key.
+                rules = current.rules.copy()  # type: ignore[attr-defined]
+                index = current.index.copy()
+                for pattern in removed:
+                    del rules[pattern]
+                    index.remove(pattern)
+                for pattern, rule in upserts.items():
+                    rules[pattern] = rule
+                    index.add(rule)
+                logger.info("Applied %s changed and %s removed SmartDNS rules", len(upserts), len(removed))
+            self._snapshot = RuleSnapshot(
+                version=current.version + 1,
+                rules=MappingProxyType(rules),
+                index=index,
+            )
+        logger.info("Loaded %s SmartDNS rules (version %s)", len(rules), current.version + 1)
         return True
 
     def lookup(self, domain: str) -> Rule | None:
-        domain = domain.rstrip(".").lower()
-        with self._lock:
-            if domain in self._rules:
-                return self._rules[domain]
-            parts = domain.split(".")
-            for idx in range(1, len(parts)):
-                candidate = "*." + ".".join(parts[idx:])
-                if candidate in self._rules:
-                    return self._rules[candidate]
-        return None
+        return self._snapshot.index.lookup(domain)
 
     def __len__(self) -> int:
-        with self._lock:
-            return len(self._rules)
+        return len(self._snapshot.rules)
 
 
 def build_rule_source(backend: str, rules_file: str | None) -> RuleSource:
@@ -2,62 +2,159 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import multiprocessing
 import os
+import shutil
+import signal
+import tempfile
+import time
 from contextlib import suppress
+from multiprocessing.process import BaseProcess
+from typing import Callable, Dict, Optional
 
-from prometheus_client import start_http_server
+from prometheus_client import CollectorRegistry, multiprocess, start_http_server
 
+from diagnostics import SamplingProfiler, start_profile_server
+
+from .cache import ResponseCache
 from .config import SmartDNSSettings, get_settings
-from .dns_server import create_dns_server, parse_upstreams
-from .metrics import RULE_RELOADS, RULES_ACTIVE
+from .dns_server import create_dns_server
+from .frontend import create_dns_frontend
+from .metrics import RULE_RELOADS, RULES_ACTIVE, RULES_VERSION
 from .monitor import DNSMonitor
 from .rules import RuleStore, build_rule_source
+from .transport import UpstreamTransportPool
+from .upstreams import UpstreamManager, parse_upstreams
 
 logger = logging.getLogger(__name__)
 
 
 class RuleReloader:
-    def __init__(self, store: RuleStore, interval: int) -> None:
+    """Reloads the rules every ``interval`` seconds and whenever :meth:`request` is called.
+
+    With ``interval`` 0 the rules are only reloaded on request. ``on_change`` is called after a
+    reload that changed them.
+    """
+
+    def __init__(self, store: RuleStore, interval: int, on_change: Optional[Callable[[], None]] = None) -> None:
         self.store = store
         self.interval = interval
+        self.on_change = on_change
+        self._requested = asyncio.Event()
+
+    def request(self) -> None:
+        self._requested.set()
 
     async def run(self) -> None:
         while True:
-            try:
-                changed = await asyncio.to_thread(self.store.reload)
-                status = "updated" if changed else "skipped"
-                RULE_RELOADS.labels(status=status).inc()
-                if changed:
-                    RULES_ACTIVE.set(len(self.store))
-            except Exception as exc:
-                RULE_RELOADS.labels(status="error").inc()
-                logger.exception("Failed to reload SmartDNS rules: %s", exc)
-            await asyncio.sleep(self.interval)
-
-
-async def run_service(settings: SmartDNSSettings) -> None:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._requested.wait(), self.interval if self.interval > 0 else None)
+            self._requested.clear()
+            await self.reload()
+
+    async def reload(self) -> None:
+        try:
+            changed = await asyncio.to_thread(self.store.reload)
+            status = "updated" if changed else "skipped"
+            RULE_RELOADS.labels(status=status).inc()
+            if changed:
+                snapshot = self.store.snapshot
+                RULES_ACTIVE.set(len(snapshot.rules))
+                RULES_VERSION.set(snapshot.version)
+                if self.on_change is not None:
+                    self.on_change()
+        except Exception as exc:
+            RULE_RELOADS.labels(status="error").inc()
+            logger.exception("Failed to reload SmartDNS rules: %s", exc)
+
+
+async def run_service(settings: SmartDNSSettings, worker: Optional[int] = None) -> None:
+    """Serve DNS until cancelled or sent SIGTERM; SIGHUP reloads the rules.
+
+    ``worker`` is the index of a process started by :class:`Supervisor`. Such a process binds
+    with SO_REUSEPORT and reloads rules only when the supervisor sends SIGHUP. The supervisor
+    serves its metrics. Only worker 0 runs the health monitor and the profiler.
+    """
     os.environ.setdefault("DATABASE_URL", settings.database_url)
     rule_source = build_rule_source(settings.rules_backend, settings.rules_file)
     store = RuleStore(rule_source)
+    reloader = RuleReloader(store, settings.reload_interval if worker is None else 0)
+    loop = asyncio.get_running_loop()
+    # Installed before the first load so a SIGHUP sent during start-up is not lost.
+    loop.add_signal_handler(signal.SIGHUP, reloader.request)
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)  # type: ignore[union-attr]
     await asyncio.to_thread(store.reload)
-    upstreams = parse_upstreams(settings.upstream_servers)
-    dns_server = create_dns_server(
-        store=store,
-        upstreams=upstreams,
+    upstreams = UpstreamManager(
+        parse_upstreams(settings.upstream_servers),
         timeout=settings.upstream_timeout,
-        host=settings.host,
-        port=settings.port,
-        enable_tcp=settings.enable_tcp,
+        min_hedge_delay=settings.hedge_min_delay,
+        max_hedge_delay=settings.hedge_max_delay,
+        max_parallel=settings.hedge_max_parallel,
+        transports=UpstreamTransportPool(
+            udp_sockets=settings.upstream_udp_sockets,
+            max_queries_per_socket=settings.upstream_socket_max_queries,
+        ),
     )
-    dns_server.start_thread()
-    logger.info("SmartDNS listening on %s:%s (TCP=%s)", settings.host, settings.port, settings.enable_tcp)
-    start_http_server(settings.metrics_port, addr=settings.metrics_host)
-    logger.info("Prometheus metrics exposed on %s:%s", settings.metrics_host, settings.metrics_port)
-
-    tasks = []
-    if settings.reload_interval > 0:
-        tasks.append(asyncio.create_task(RuleReloader(store, settings.reload_interval).run()))
-    if settings.monitor_domain:
+    cache = None
+    if settings.cache_size > 0:
+        cache = ResponseCache(
+            maxsize=settings.cache_size,
+            max_ttl=settings.cache_max_ttl,
+            max_negative_ttl=settings.cache_max_negative_ttl,
+            prefetch_after=settings.prefetch_after,
+            prefetch_min_hits=settings.prefetch_min_hits,
+        )
+    dns_servers = []
+    frontend = None
+    if settings.frontend == "asyncio":
+        frontend = create_dns_frontend(
+            store=store,
+            upstreams=upstreams,
+            host=settings.host,
+            port=settings.port,
+            enable_tcp=settings.enable_tcp,
+            max_concurrency=settings.max_concurrency,
+            cache=cache,
+            prefetch_concurrency=settings.prefetch_concurrency,
+            reuse_port=worker is not None,
+        )
+        await frontend.start()
+    else:
+        dns_servers = create_dns_server(
+            store=store,
+            upstreams=upstreams,
+            host=settings.host,
+            port=settings.port,
+            enable_tcp=settings.enable_tcp,
+            cache=cache,
+            reuse_port=worker is not None,
+        )
+        for dns_server in dns_servers:
+            dns_server.start_thread()
+    logger.info(
+        "SmartDNS listening on %s:%s (TCP=%s, frontend=%s, worker=%s)",
+        settings.host,
+        settings.port,
+        settings.enable_tcp,
+        settings.frontend,
+        worker,
+    )
+    if worker is None:
+        start_http_server(settings.metrics_port, addr=settings.metrics_host)
+        logger.info("Prometheus metrics exposed on %s:%s", settings.metrics_host, settings.metrics_port)
+    primary = worker is None or worker == 0
+    profile_server = None
+    if settings.profiler_token and primary:
+        profile_server = start_profile_server(
+            SamplingProfiler(),
+            host=settings.profiler_host,
+            port=settings.profiler_port,
+            token=settings.profiler_token,
+        )
+        logger.info("Profiler endpoint on %s:%s/debug/profile", settings.profiler_host, settings.profiler_port)
+
+    tasks = [asyncio.create_task(reloader.run())]
+    if settings.monitor_domain and primary:
         monitor = DNSMonitor(
             host=settings.monitor_host,
             port=settings.monitor_port,
@@ -77,17 +174,170 @@ async def run_service(settings: SmartDNSSettings) -> None:
             task.cancel()
             with suppress(asyncio.CancelledError):
                 await task
-        dns_server.stop()
+        if frontend is not None:
+            await frontend.stop()
+        upstreams.close()
+        for dns_server in dns_servers:
+            dns_server.stop()
+        if profile_server is not None:
+            profile_server.shutdown()
         logger.info("SmartDNS server stopped")
 
 
+def _run_worker(index: int) -> None:
+    logging.basicConfig(level=logging.INFO)
+    with suppress(KeyboardInterrupt):
+        asyncio.run(run_service(get_settings(), worker=index))
+
+
+class WorkerCrashLoop(RuntimeError):
+    pass
+
+
+class Supervisor:
+    """Runs ``settings.workers`` SmartDNS processes on one port so they are not bound to one core.
+
+    Workers bind the DNS port with SO_REUSEPORT, and each keeps its own rule snapshot and cache.
+    Only the supervisor polls the rule source; when the rules change it sends SIGHUP and all
+    workers reload. Workers are started as fresh interpreters (multiprocessing's ``spawn``):
+    prometheus_client picks its value storage at import time, and this way it writes to the
+    shared multiprocess directory, whose aggregate the supervisor serves on the metrics port.
+
+    A worker that exits is started again. One that exits within ``stable_after`` seconds of
+    starting is restarted after ``restart_delay`` seconds, doubling with each such exit in a row
+    up to ``max_restart_delay``; after ``max_fast_exits`` of them :meth:`run` raises
+    :class:`WorkerCrashLoop`, since the worker will not come up (a taken port, bad settings).
+    """
+
+    def __init__(
+        self,
+        settings: SmartDNSSettings,
+        *,
+        stable_after: float = 30.0,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 60.0,
+        max_fast_exits: int = 5,
+    ) -> None:
+        self.settings = settings
+        self.stable_after = stable_after
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_fast_exits = max_fast_exits
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: Dict[int, BaseProcess] = {}
+        self._started_at: Dict[int, float] = {}
+        self._fast_exits: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._metrics_dir = ""
+
+    async def run(self) -> None:
+        settings = self.settings
+        os.environ.setdefault("DATABASE_URL", settings.database_url)
+        # A fresh directory per run: stale files from dead workers would be added to the totals.
+        self._metrics_dir = tempfile.mkdtemp(prefix="smartdns-metrics-", dir=os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = self._metrics_dir
+        store = RuleStore(build_rule_source(settings.rules_backend, settings.rules_file))
+        reloader = RuleReloader(store, settings.reload_interval, on_change=self._signal_workers)
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, reloader.request)
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)  # type: ignore[union-attr]
+        await asyncio.to_thread(store.reload)
+        for index in range(settings.workers):
+            self._start(index)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=self._metrics_dir)
+        start_http_server(settings.metrics_port, addr=settings.metrics_host, registry=registry)
+        logger.info("Prometheus metrics of %s workers exposed on %s:%s", settings.workers, settings.metrics_host, settings.metrics_port)
+        reload_task = asyncio.create_task(reloader.run())
+        try:
+            while True:
+                await asyncio.sleep(1)
+                self._restart_exited()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            reload_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await reload_task
+            await asyncio.to_thread(self._stop_workers)
+            shutil.rmtree(self._metrics_dir, ignore_errors=True)
+            logger.info("SmartDNS supervisor stopped")
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(target=_run_worker, args=(index,), name=f"smartdns-worker-{index}")
+        # An ignored signal stays ignored across exec, so a reload requested while the worker
+        # is still starting cannot kill it; it loads the current rules once up anyway.
+        previous = signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            process.start()
+        finally:
+            signal.signal(signal.SIGHUP, previous)
+        self._workers[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info("Started SmartDNS worker %s (pid %s)", index, process.pid)
+
+    def _restart_exited(self) -> None:
+        now = time.monotonic()
+        for index, process in list(self._workers.items()):
+            if process.exitcode is None:
+                continue
+            restart_at = self._restart_at.get(index)
+            if restart_at is None:
+                multiprocess.mark_process_dead(process.pid, self._metrics_dir)
+                if now - self._started_at.get(index, now) < self.stable_after:
+                    self._fast_exits[index] = self._fast_exits.get(index, 0) + 1
+                else:
+                    self._fast_exits[index] = 0
+                fast_exits = self._fast_exits[index]
+                if fast_exits >= self.max_fast_exits:
+                    raise WorkerCrashLoop(
+                        f"SmartDNS worker {index} exited {fast_exits} times in a row right after starting "
+                        f"(last exit code {process.exitcode})"
+                    )
+                delay = min(self.restart_delay * 2 ** (fast_exits - 1), self.max_restart_delay) if fast_exits else 0.0
+                logger.warning(
+                    "SmartDNS worker %s (pid %s) exited with %s, restarting in %.0fs",
+                    index,
+                    process.pid,
+                    process.exitcode,
+                    delay,
+                )
+                restart_at = self._restart_at[index] = now + delay
+            if now >= restart_at:
+                del self._restart_at[index]
+                self._start(index)
+
+    def _signal_workers(self) -> None:
+        for process in self._workers.values():
+            if process.pid is not None and process.exitcode is None:
+                with suppress(ProcessLookupError):
+                    os.kill(process.pid, signal.SIGHUP)
+
+    def _stop_workers(self, timeout: float = 10.0) -> None:
+        for process in self._workers.values():
+            process.terminate()
+        for process in self._workers.values():
+            process.join(timeout)
+            if process.exitcode is None:
+                process.kill()
+                process.join()
+            multiprocess.mark_process_dead(process.pid, self._metrics_dir)
+        self._workers.clear()
+
+
 def main() -> None:
     logging.basicConfig(level=logging.INFO)
     settings = get_settings()
     try:
-        asyncio.run(run_service(settings))
+        if settings.workers > 1:
+            asyncio.run(Supervisor(settings).run())
+        else:
+            asyncio.run(run_service(settings))
     except KeyboardInterrupt:
         logger.info("SmartDNS interrupted, shutting down")
+    except WorkerCrashLoop as exc:
+        logger.error("%s, giving up", exc)
+        raise SystemExit(1) from exc
 
 
 if __name__ == "__main__":
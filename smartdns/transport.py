@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import secrets
+import struct
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from .metrics import UPSTREAM_TCP_QUERIES
+from .wire import HEADER, parse_question
+
+if TYPE_CHECKING:
+    from .upstreams import Upstream
+
+logger = logging.getLogger(__name__)
+
+TRUNCATED = 0x02
+
+
+@dataclass
+class _Pending:
+    future: asyncio.Future
+    question: bytes
+    channel: object
+
+
+class _DatagramChannel(asyncio.DatagramProtocol):
+    def __init__(self, owner: "UpstreamTransport") -> None:
+        self.owner = owner
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.sent = 0
+        self.inflight = 0
+        self.retiring = False
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.owner._deliver(data)
+
+    def error_received(self, exc: Exception) -> None:
+        # ICMP errors on a connected socket cannot be tied to one query.
+        self.owner._fail_channel(self, exc)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.owner._fail_channel(self, exc or ConnectionError("UDP socket closed"))
+
+
+class _StreamChannel:
+    def __init__(self, owner: "UpstreamTransport", reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.owner = owner
+        self.writer = writer
+        self.closed = False
+        self.reader_task = asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                self.owner._deliver(await reader.readexactly(struct.unpack("!H", header)[0]))
+        except (asyncio.IncompleteReadError, OSError) as exc:
+            self.owner._fail_channel(self, ConnectionError(f"TCP connection lost: {exc!r}"))
+        finally:
+            self.closed = True
+            self.writer.close()
+
+    def send(self, packet: bytes) -> None:
+        self.writer.write(struct.pack("!H", len(packet)) + packet)
+
+    def close(self) -> None:
+        self.reader_task.cancel()
+
+
+class UpstreamTransport:
+    """Long-lived sockets to one upstream, shared by every query in flight.
+
+    Queries go out over a small pool of connected UDP sockets with a fresh random transaction ID
+    each; a reply is matched back by ID and must repeat the question byte for byte, then gets the
+    asker's ID back. A UDP socket is replaced after ``max_queries_per_socket`` queries so the
+    source port keeps changing. Truncated replies are retried over one persistent TCP connection
+    that pipelines every query and is reopened when the upstream closes it.
+    """
+
+    def __init__(self, upstream: Upstream, *, udp_sockets: int = 4, max_queries_per_socket: int = 10000) -> None:
+        self.upstream = upstream
+        self.udp_sockets = max(1, udp_sockets)
+        self.max_queries_per_socket = max_queries_per_socket
+        self._pending: Dict[int, _Pending] = {}
+        self._datagram: List[_DatagramChannel] = []
+        self._stream: Optional[_StreamChannel] = None
+        self._datagram_lock = asyncio.Lock()
+        self._stream_lock = asyncio.Lock()
+
+    async def query(self, packet: bytes, timeout: float) -> bytes:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        channel = await self._datagram_channel()
+        reply = await self._exchange(packet, channel, channel.transport.sendto, timeout)
+        if reply[2] & TRUNCATED:
+            UPSTREAM_TCP_QUERIES.labels(upstream=self.upstream.address).inc()
+            stream = await self._stream_channel(deadline - loop.time())
+            reply = await self._exchange(packet, stream, stream.send, deadline - loop.time())
+        return reply
+
+    def close(self) -> None:
+        for channel in self._datagram:
+            if channel.transport is not None:
+                channel.transport.close()
+        self._datagram.clear()
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    async def _exchange(self, packet: bytes, channel, send: Callable[[bytes], None], timeout: float) -> bytes:
+        question = packet[HEADER.size : parse_question(packet).end]
+        transaction_id = self._new_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction_id] = _Pending(future, question, channel)
+        if isinstance(channel, _DatagramChannel):
+            channel.inflight += 1
+        try:
+            send(transaction_id.to_bytes(2, "big") + packet[2:])
+            reply = await asyncio.wait_for(future, timeout)
+        finally:
+            if self._pending.get(transaction_id) is not None and self._pending[transaction_id].future is future:
+                del self._pending[transaction_id]
+            if isinstance(channel, _DatagramChannel):
+                channel.inflight -= 1
+                if channel.retiring and not channel.inflight and channel.transport is not None:
+                    channel.transport.close()
+        return packet[:2] + reply[2:]
+
+    def _new_id(self) -> int:
+        if len(self._pending) >= 0xFFFF:
+            raise RuntimeError(f"Too many queries in flight to {self.upstream.address}")
+        while True:
+            transaction_id = secrets.randbits(16)
+            if transaction_id not in self._pending:
+                return transaction_id
+
+    def _deliver(self, data: bytes) -> None:
+        if len(data) < HEADER.size:
+            return
+        entry = self._pending.get(int.from_bytes(data[:2], "big"))
+        if entry is None or entry.future.done():
+            logger.debug("Unexpected reply from %s", self.upstream.address)
+            return
+        if data[HEADER.size : HEADER.size + len(entry.question)] != entry.question:
+            logger.debug("Reply from %s does not match the question, ignoring", self.upstream.address)
+            return
+        entry.future.set_result(data)
+
+    def _fail_channel(self, channel, exc: BaseException) -> None:
+        for entry in self._pending.values():
+            if entry.channel is channel and not entry.future.done():
+                entry.future.set_exception(exc)
+        if channel in self._datagram:
+            self._datagram.remove(channel)
+            channel.transport.close()
+        if channel is self._stream:
+            self._stream = None
+
+    async def _datagram_channel(self) -> _DatagramChannel:
+        if len(self._datagram) < self.udp_sockets:
+            async with self._datagram_lock:
+                if len(self._datagram) < self.udp_sockets:
+                    _, channel = await asyncio.get_running_loop().create_datagram_endpoint(
+                        lambda: _DatagramChannel(self),
+                        remote_addr=(self.upstream.host, self.upstream.port),
+                    )
+                    self._datagram.append(channel)
+        channel = random.choice(self._datagram)
+        channel.sent += 1
+        if channel.sent >= self.max_queries_per_socket and not channel.retiring:
+            # The next query opens a replacement; this one closes once its last reply is in.
+            channel.retiring = True
+            self._datagram.remove(channel)
+        return channel
+
+    async def _stream_channel(self, timeout: float) -> _StreamChannel:
+        async with self._stream_lock:
+            if self._stream is None or self._stream.closed:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.upstream.host, self.upstream.port),
+                    timeout,
+                )
+                self._stream = _StreamChannel(self, reader, writer)
+            return self._stream
+
+
+class UpstreamTransportPool:
+    """One :class:`UpstreamTransport` per upstream, created on first use."""
+
+    def __init__(self, *, udp_sockets: int = 4, max_queries_per_socket: int = 10000) -> None:
+        self.udp_sockets = udp_sockets
+        self.max_queries_per_socket = max_queries_per_socket
+        self._transports: Dict[str, UpstreamTransport] = {}
+
+    async def send(self, upstream: Upstream, packet: bytes, timeout: float) -> bytes:
+        transport = self._transports.get(upstream.address)
+        if transport is None:
+            transport = self._transports[upstream.address] = UpstreamTransport(
+                upstream,
+                udp_sockets=self.udp_sockets,
+                max_queries_per_socket=self.max_queries_per_socket,
+            )
+        return await transport.query(packet, timeout)
+
+    def close(self) -> None:
+        for transport in self._transports.values():
+            transport.close()
+        self._transports.clear()
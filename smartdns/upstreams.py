@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, List, Optional, Set
+
+from .metrics import UPSTREAM_ERRORS, UPSTREAM_HEDGES, UPSTREAM_LATENCY
+from .transport import UpstreamTransportPool
+
+logger = logging.getLogger(__name__)
+
+SERVFAIL = 2
+REFUSED = 5
+
+
+@dataclass
+class Upstream:
+    host: str
+    port: int
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+def parse_upstreams(values: Iterable[str]) -> List[Upstream]:
+    upstreams: List[Upstream] = []
+    for value in values:
+        if ":" in value:
+            host, port_str = value.split(":", 1)
+            try:
+                port = int(port_str)
+            except ValueError:
+                logger.warning("Invalid port in upstream %s, skipping", value)
+                continue
+        else:
+            host, port = value, 53
+        upstreams.append(Upstream(host=host, port=port))
+    if not upstreams:
+        raise ValueError("At least one upstream DNS server is required")
+    return upstreams
+
+
+class UpstreamRejected(RuntimeError):
+    """The upstream answered, but with SERVFAIL or REFUSED."""
+
+    def __init__(self, upstream: Upstream, reply: bytes) -> None:
+        super().__init__(f"{upstream.address} answered with rcode {reply[3] & 0x0F}")
+        self.reply = reply
+
+
+class UpstreamHealth:
+    """Exponentially weighted latency, latency deviation and failure rate of one upstream.
+
+    :meth:`expected_cost` is the time a query is expected to take: the smoothed latency when it
+    succeeds, the full timeout when it fails. The failure rate fades with ``recovery`` seconds
+    since the last failure, so an upstream that was down gets tried again once it has had time
+    to come back. An upstream without measurements costs nothing, so each one is tried early on.
+    """
+
+    def __init__(self, upstream: Upstream, *, alpha: float, recovery: float) -> None:
+        self.upstream = upstream
+        self.alpha = alpha
+        self.recovery = recovery
+        self.latency: Optional[float] = None
+        self.deviation = 0.0
+        self.failure_rate = 0.0
+        self.last_failure = 0.0
+
+    def record_success(self, latency: float) -> None:
+        self._observe(latency)
+        self.failure_rate *= 1 - self.alpha
+
+    def record_lower_bound(self, latency: float) -> None:
+        """A query that lost a hedge race was still unanswered after ``latency`` seconds."""
+        if self.latency is None or latency > self.latency:
+            self._observe(latency)
+
+    def record_failure(self) -> None:
+        self.failure_rate += self.alpha * (1 - self.failure_rate)
+        self.last_failure = time.monotonic()
+
+    def _observe(self, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+            self.deviation = latency / 2
+        else:
+            self.deviation += self.alpha * (abs(latency - self.latency) - self.deviation)
+            self.latency += self.alpha * (latency - self.latency)
+
+    def current_failure_rate(self, now: float) -> float:
+        if not self.failure_rate:
+            return 0.0
+        return self.failure_rate * math.exp(-(now - self.last_failure) / self.recovery)
+
+    def expected_cost(self, timeout: float, now: float) -> float:
+        failure_rate = self.current_failure_rate(now)
+        return (1 - failure_rate) * (self.latency or 0.0) + failure_rate * timeout
+
+
+class UpstreamManager:
+    """Queries the healthiest upstream first and hedges when it is slow.
+
+    Upstreams are ranked by :meth:`UpstreamHealth.expected_cost`. A query goes to the best one;
+    if no reply arrives within the hedge delay (the best upstream's smoothed latency plus four
+    deviations, clamped to ``[min_hedge_delay, max_hedge_delay]``) the next upstream is asked as
+    well, up to ``max_parallel`` at once, and a failure moves on to the next upstream right away.
+    The first usable reply wins and the other attempts are cancelled. SERVFAIL and REFUSED count
+    as failures and are only returned when no upstream does better.
+    """
+
+    def __init__(
+        self,
+        upstreams: List[Upstream],
+        *,
+        timeout: float,
+        min_hedge_delay: float = 0.01,
+        max_hedge_delay: float = 0.5,
+        max_parallel: int = 2,
+        alpha: float = 0.2,
+        recovery: float = 30.0,
+        transports: Optional[UpstreamTransportPool] = None,
+        send: Optional[Callable[[Upstream, bytes, float], Awaitable[bytes]]] = None,
+    ) -> None:
+        if not upstreams:
+            raise ValueError("At least one upstream DNS server is required")
+        self.timeout = timeout
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.max_parallel = max(1, max_parallel)
+        self.transports = transports or UpstreamTransportPool()
+        self.send = send or self.transports.send
+        self.health = [UpstreamHealth(upstream, alpha=alpha, recovery=recovery) for upstream in upstreams]
+
+    @property
+    def upstreams(self) -> List[Upstream]:
+        return [health.upstream for health in self.health]
+
+    def close(self) -> None:
+        self.transports.close()
+
+    def ranked(self) -> List[UpstreamHealth]:
+        now = time.monotonic()
+        return sorted(self.health, key=lambda health: health.expected_cost(self.timeout, now))
+
+    def hedge_delay(self, best: UpstreamHealth) -> float:
+        if best.latency is None:
+            return self.max_hedge_delay
+        return min(max(best.latency + 4 * best.deviation, self.min_hedge_delay), self.max_hedge_delay)
+
+    def record(self, health: UpstreamHealth, latency: Optional[float], error: Optional[BaseException] = None) -> None:
+        if error is None and latency is not None:
+            health.record_success(latency)
+            UPSTREAM_LATENCY.labels(upstream=health.upstream.address).observe(latency)
+        else:
+            health.record_failure()
+            UPSTREAM_ERRORS.labels(upstream=health.upstream.address).inc()
+            logger.warning("Upstream %s failed: %r", health.upstream.address, error)
+
+    async def query(self, packet: bytes) -> bytes:
+        ranked = self.ranked()
+        candidates = iter(ranked)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        hedge_delay = self.hedge_delay(ranked[0])
+        pending: Set[asyncio.Task] = set()
+        last_error: Optional[BaseException] = None
+        rejected: Optional[bytes] = None
+
+        def launch() -> bool:
+            health = next(candidates, None)
+            if health is None:
+                return False
+            pending.add(asyncio.ensure_future(self._attempt(health, packet)))
+            return True
+
+        launch()
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                can_hedge = len(pending) < self.max_parallel
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=min(hedge_delay, remaining) if can_hedge else remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    last_error = error
+                    if isinstance(error, UpstreamRejected):
+                        rejected = error.reply
+                if done:
+                    # Every failure hands its slot to the next upstream straight away.
+                    for _ in done:
+                        if len(pending) < self.max_parallel:
+                            launch()
+                elif can_hedge and launch():
+                    UPSTREAM_HEDGES.inc()
+        finally:
+            for task in pending:
+                task.cancel()
+        if rejected is not None:
+            return rejected
+        if last_error is not None and not pending:
+            raise last_error
+        raise asyncio.TimeoutError(f"No upstream answered within {self.timeout}s")
+
+    async def _attempt(self, health: UpstreamHealth, packet: bytes) -> bytes:
+        start = time.perf_counter()
+        try:
+            reply = await self.send(health.upstream, packet, self.timeout)
+        except asyncio.CancelledError:
+            health.record_lower_bound(time.perf_counter() - start)
+            raise
+        except Exception as exc:
+            self.record(health, None, exc)
+            raise
+        latency = time.perf_counter() - start
+        if len(reply) > 3 and reply[3] & 0x0F in (SERVFAIL, REFUSED):
+            error = UpstreamRejected(health.upstream, reply)
+            self.record(health, None, error)
+            raise error
+        self.record(health, latency)
+        return reply
@@ -0,0 +1,129 @@
+"""Just enough of the DNS wire format to route a query without dnslib's full parser."""
+
+from __future__ import annotations
+
+import struct
+from typing import List, NamedTuple
+
+HEADER = struct.Struct("!HHHHHH")
+RR_FIXED = struct.Struct("!HHIH")
+
+OPT = 41
+SOA = 6
+
+# Bits of :func:`query_options`: the CD header flag, and two beyond the header's 16 bits for an
+# OPT record and its DNSSEC OK flag.
+CD = 0x0010
+EDNS = 1 << 16
+DO = 1 << 17
+
+
+class WireError(ValueError):
+    pass
+
+
+class Question(NamedTuple):
+    name: str
+    qtype: int
+    qclass: int
+    end: int
+
+
+def parse_question(packet: bytes) -> Question:
+    """Read the single question of a query; ``name`` is lowercased without the trailing dot."""
+    if len(packet) < HEADER.size or packet[4:6] != b"\x00\x01":
+        raise WireError("expected a query with exactly one question")
+    labels = []
+    offset = HEADER.size
+    try:
+        while True:
+            length = packet[offset]
+            if length == 0:
+                offset += 1
+                break
+            if length & 0xC0:
+                raise WireError("compressed name in question")
+            labels.append(packet[offset + 1 : offset + 1 + length])
+            offset += 1 + length
+        qtype, qclass = struct.unpack_from("!HH", packet, offset)
+    except (IndexError, struct.error) as exc:
+        raise WireError("truncated question") from exc
+    return Question(b".".join(labels).decode("latin-1").lower(), qtype, qclass, offset + 4)
+
+
+def error_reply(packet: bytes, question: Question, rcode: int) -> bytes:
+    """An empty reply to ``packet`` carrying ``rcode``, with the query's ID, opcode and RD bit."""
+    flags = 0x8080 | (packet[2] << 8 & 0x7900) | rcode
+    return packet[:2] + HEADER.pack(0, flags, 1, 0, 0, 0)[2:] + packet[HEADER.size : question.end]
+
+
+def reply_for(reply: bytes, query: bytes, question: Question) -> bytes:
+    """``reply`` with the ID of ``query`` and, when it repeats the same question, the query's
+    question bytes, so the asker gets back its own 0x20 case."""
+    if reply[HEADER.size : question.end].lower() != query[HEADER.size : question.end].lower():
+        return query[:2] + reply[2:]
+    return query[:2] + reply[2 : HEADER.size] + query[HEADER.size : question.end] + reply[question.end :]
+
+
+class Record(NamedTuple):
+    section: int
+    rtype: int
+    ttl_offset: int
+    ttl: int
+    rdata_offset: int
+    rdlength: int
+
+
+def skip_name(packet: bytes, offset: int) -> int:
+    """Offset just past the (possibly compressed) name starting at ``offset``."""
+    while True:
+        length = packet[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+
+
+def parse_records(packet: bytes, question: Question) -> List[Record]:
+    """Every resource record of a reply, tagged with its section (0 answer, 1 authority, 2 additional)."""
+    _, _, _, ancount, nscount, arcount = HEADER.unpack_from(packet)
+    records = []
+    offset = question.end
+    try:
+        for section, count in enumerate((ancount, nscount, arcount)):
+            for _ in range(count):
+                offset = skip_name(packet, offset)
+                rtype, _, ttl, rdlength = RR_FIXED.unpack_from(packet, offset)
+                offset += RR_FIXED.size
+                records.append(Record(section, rtype, offset - 6, ttl, offset, rdlength))
+                offset += rdlength
+    except (IndexError, struct.error) as exc:
+        raise WireError("truncated resource record") from exc
+    if offset > len(packet):
+        raise WireError("truncated resource record")
+    return records
+
+
+def query_options(packet: bytes, question: Question) -> int:
+    """What besides the question shapes the answer to ``packet``: CD, EDNS and DO as a bit set.
+
+    Resolvers echo the OPT record and DNSSEC records only to askers that sent them, so replies to
+    queries that differ here cannot stand in for each other.
+    """
+    options = packet[3] & CD
+    if packet[10:12] == b"\x00\x00":
+        return options
+    for record in parse_records(packet, question):
+        if record.rtype == OPT:
+            return options | EDNS | (DO if record.ttl & 0x8000 else 0)
+    return options
+
+
+def soa_minimum(packet: bytes, record: Record) -> int:
+    """The MINIMUM field of an SOA record, the negative-caching TTL of RFC 2308."""
+    try:
+        offset = skip_name(packet, skip_name(packet, record.rdata_offset))
+        return struct.unpack_from("!I", packet, offset + 16)[0]
+    except (IndexError, struct.error) as exc:
+        raise WireError("truncated SOA record") from exc
@@ -0,0 +1,108 @@
+"""Shared fixtures.
+
+``db`` builds its engine from DATABASE_URL when first imported, so the tests point it at a
+throwaway SQLite file before any test module imports it.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from datetime import datetime, timezone
+from typing import Dict, List, Sequence
+
+import pytest
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='provisioner-tests-')}/test.db"
+
+
+class MemoryObjectStore:
+    """Object store kept in a dict; keys listed in ``fail`` cannot be uploaded or deleted."""
+
+    presign_ttl = 900
+
+    def __init__(self) -> None:
+        self.objects: Dict[str, bytes] = {}
+        self.modified: Dict[str, datetime] = {}
+        self.fail: set = set()
+        self.delete_calls: List[List[str]] = []
+
+    def upload_bytes(self, key: str, data: bytes, *, content_type: str) -> None:
+        if key in self.fail or any(key.startswith(prefix) for prefix in self.fail):
+            raise RuntimeError(f"upload of {key} failed")
+        self.objects[key] = data
+        self.modified[key] = datetime.now(timezone.utc)
+
+    def generate_presigned_url(self, key: str) -> str:
+        return f"https://objects.test/{key}"
+
+    def delete_objects(self, keys: Sequence[str], *, max_attempts: int = 3, backoff: float = 0.2) -> List[str]:
+        self.delete_calls.append(list(keys))
+        failed = [key for key in keys if key in self.fail]
+        for key in keys:
+            if key not in self.fail:
+                self.objects.pop(key, None)
+                self.modified.pop(key, None)
+        return failed
+
+    def iter_object_pages(self, prefix: str, *, page_size: int = 1000):
+        keys = sorted(key for key in self.objects if key.startswith(prefix))
+        for start in range(0, len(keys), page_size):
+            yield [
+                {"Key": key, "Size": len(self.objects[key]), "LastModified": self.modified[key]}
+                for key in keys[start : start + page_size]
+            ]
+
+
+class RecordingStatsClient:
+    def __init__(self) -> None:
+        self.counters: Dict[str, int] = {}
+
+    def incr(self, name: str, count: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + count
+
+    def stop(self) -> None:
+        pass
+
+
+@pytest.fixture
+def database():
+    """Empty tables for one test; yields ``session_scope``."""
+    from db import ENGINE, Base, session_scope
+
+    Base.metadata.create_all(ENGINE)
+    try:
+        yield session_scope
+    finally:
+        Base.metadata.drop_all(ENGINE)
+
+
+@pytest.fixture
+def object_store() -> MemoryObjectStore:
+    return MemoryObjectStore()
+
+
+@pytest.fixture
+def statsd() -> RecordingStatsClient:
+    return RecordingStatsClient()
+
+
+@pytest.fixture
+def settings():
+    from provisioner.config import ProvisionerSettings
+
+    settings = ProvisionerSettings()
+    settings.placement_strategy = "devices"
+    return settings
+
+
+@pytest.fixture
+def service(database, settings, object_store, statsd):
+    from provisioner.service import ProvisioningService
+
+    return ProvisioningService(
+        session_factory=database,
+        settings=settings,
+        s3_uploader=object_store,
+        statsd=statsd,
+    )
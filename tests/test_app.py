@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+from db.models import Node, NodeType
+from provisioner.app import create_app
+
+
+def test_importing_the_app_builds_nothing():
+    code = "import sys, provisioner.app as module; print('app' in vars(module), 'boto3' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_lifespan_builds_the_service_and_nodes_honour_etags(database, settings, tmp_path):
+    settings.object_store_backend = "local"
+    settings.local_store_path = str(tmp_path / "objects")
+    settings.local_store_secret = "secret"
+    with database() as session:
+        session.add(Node(name="amnezia", type=NodeType.AMNEZIA, endpoint="e", max_devices=5))
+    app = create_app(settings)
+
+    assert not hasattr(app.state, "service")
+    with TestClient(app) as client:
+        assert app.state.service.placement is None
+        first = client.get("/nodes")
+        cached = client.get("/nodes", headers={"If-None-Match": first.headers["ETag"]})
+        statsd = app.state.service.statsd
+
+    assert first.status_code == 200
+    assert [node["name"] for node in first.json()] == ["amnezia"]
+    assert cached.status_code == 304
+    assert statsd._thread is None or not statsd._thread.is_alive()
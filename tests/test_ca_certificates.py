@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import base64
+
+from sqlalchemy import func, select
+
+from db.crud import ca_fingerprint, insert_keys
+from db.migrations import deduplicate_ca_certificates
+from db.models import CACertificate, KeyPool, Node, NodeType
+from provisioner.vpn import CACertificateCache
+
+
+def _pem(seed: int) -> str:
+    body = base64.b64encode(bytes([seed]) * 96).decode()
+    return "-----BEGIN CERTIFICATE-----\n%s\n%s\n-----END CERTIFICATE-----\n" % (body[:64], body[64:])
+
+
+def _add_openvpn_node(database) -> None:
+    with database() as session:
+        session.add(Node(id=1, name="ovpn", type=NodeType.OPENVPN, endpoint="e"))
+
+
+def test_fingerprint_ignores_line_endings_and_indentation():
+    pem = _pem(1)
+    reformatted = "  " + pem.replace("\n", "\r\n  ")
+
+    assert ca_fingerprint(reformatted) == ca_fingerprint(pem)
+    assert ca_fingerprint(_pem(2)) != ca_fingerprint(pem)
+
+
+def test_insert_keys_stores_each_ca_once(database):
+    _add_openvpn_node(database)
+    rows = [
+        {"public_key": f"k{index}", "private_key": "p", "certificate": "c", "ca_certificate": _pem(index % 2)}
+        for index in range(4)
+    ]
+    with database() as session:
+        insert_keys(session, 1, rows[:2])
+    with database() as session:
+        insert_keys(session, 1, rows[2:])
+
+    with database() as session:
+        assert session.scalar(select(func.count()).select_from(CACertificate)) == 2
+        links = session.execute(select(KeyPool.ca_id, KeyPool.ca_certificate).order_by(KeyPool.id)).all()
+    assert links[0].ca_id == links[2].ca_id != links[1].ca_id == links[3].ca_id
+    assert {link.ca_certificate for link in links} == {None}
+
+
+def test_migration_links_inline_certificates(database):
+    _add_openvpn_node(database)
+    with database() as session:
+        session.add_all(
+            [KeyPool(node_id=1, public_key=f"k{index}", ca_certificate=_pem(7)) for index in range(3)]
+            + [KeyPool(node_id=1, public_key="plain")]
+        )
+
+    assert deduplicate_ca_certificates(batch_size=2) == 3
+    assert deduplicate_ca_certificates() == 0
+    with database() as session:
+        ca = session.scalars(select(CACertificate)).one()
+        assert ca.fingerprint == ca_fingerprint(_pem(7))
+        assert session.execute(select(KeyPool.ca_id).order_by(KeyPool.id)).scalars().all() == [ca.id] * 3 + [None]
+
+
+class _Key:
+    """Stands in for a ``KeyPool`` row and counts how often the CA text is read from it."""
+
+    def __init__(self, ca_id, pem: str, inline: str | None = None) -> None:
+        self.ca_id = ca_id
+        self.ca_certificate = inline
+        self.ca = self
+        self._pem = pem
+        self.loads = 0
+
+    @property
+    def pem(self) -> str:
+        self.loads += 1
+        return self._pem
+
+
+def test_ca_cache_loads_each_certificate_once_and_evicts_the_oldest():
+    cache = CACertificateCache(maxsize=1)
+    first, second = _Key(1, " one\n"), _Key(2, "two")
+
+    assert [cache.get(first), cache.get(first), cache.get(second), cache.get(first)] == ["one", "one", "two", "one"]
+    assert (first.loads, second.loads) == (2, 1)
+    assert cache.get(_Key(None, "unused", inline="legacy\n")) == "legacy"
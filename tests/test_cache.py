@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import pytest
+from dnslib import EDNS0, QTYPE, RCODE, RR, SOA, A, DNSRecord
+
+from smartdns import cache as cache_module
+from smartdns.cache import ResponseCache
+from smartdns.wire import parse_question
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+def _query(name: str = "example.com", *, edns: bool = False) -> bytes:
+    query = DNSRecord.question(name)
+    if edns:
+        query.add_ar(EDNS0(udp_len=1232))
+    return query.pack()
+
+
+def _answer(query: bytes, *ttls: int) -> bytes:
+    reply = DNSRecord.parse(query).reply()
+    for number, ttl in enumerate(ttls, 1):
+        reply.add_answer(RR(str(reply.q.qname), rdata=A(f"192.0.2.{number}"), ttl=ttl))
+    return reply.pack()
+
+
+def _negative(query: bytes, *, soa_ttl: int = 900, minimum: int = 300, rcode: int = RCODE.NXDOMAIN) -> bytes:
+    reply = DNSRecord.parse(query).reply()
+    reply.header.rcode = rcode
+    soa = SOA("ns.example.com", "admin.example.com", (1, 2, 3, 4, minimum))
+    reply.add_auth(RR("example.com", QTYPE.SOA, rdata=soa, ttl=soa_ttl))
+    return reply.pack()
+
+
+def _store(cache: ResponseCache, query: bytes, reply: bytes):
+    return cache.put(parse_question(query), query, reply)
+
+
+def _get(cache: ResponseCache, query: bytes):
+    packet = cache.get(parse_question(query), query)
+    return DNSRecord.parse(packet) if packet is not None else None
+
+
+def test_hits_count_ttls_down_and_expire_with_the_smallest_ttl(clock):
+    cache = ResponseCache()
+    query = _query()
+    _store(cache, query, _answer(query, 300, 60))
+
+    clock.now += 45
+    asked = _query("EXAMPLE.com")
+    hit = _get(cache, asked)
+
+    assert [record.ttl for record in hit.rr] == [255, 15]
+    assert (hit.header.id, str(hit.q.qname)) == (DNSRecord.parse(asked).header.id, "EXAMPLE.com.")
+    clock.now += 15
+    assert _get(cache, query) is None
+    assert len(cache) == 0
+
+
+def test_negative_replies_live_for_the_soa_minimum(clock):
+    cache = ResponseCache(max_negative_ttl=3600)
+    missing, nodata = _query("missing.example.com"), _query("nodata.example.com")
+    _store(cache, missing, _negative(missing, minimum=120))
+    _store(cache, nodata, _negative(nodata, soa_ttl=30, rcode=RCODE.NOERROR))
+
+    clock.now += 29
+    assert _get(cache, missing).header.rcode == RCODE.NXDOMAIN
+    assert _get(cache, nodata).auth[0].ttl == 1
+    clock.now += 1
+    assert _get(cache, nodata) is None
+    clock.now += 90
+    assert _get(cache, missing) is None
+
+
+def test_failures_truncations_and_negatives_without_soa_are_not_stored(clock):
+    cache = ResponseCache()
+    query = _query()
+    servfail = DNSRecord.parse(query).reply()
+    servfail.header.rcode = RCODE.SERVFAIL
+    truncated = DNSRecord.parse(_answer(query, 60))
+    truncated.header.tc = 1
+    bare_nxdomain = DNSRecord.parse(query).reply()
+    bare_nxdomain.header.rcode = RCODE.NXDOMAIN
+
+    for reply in (servfail, truncated, bare_nxdomain):
+        assert _store(cache, query, reply.pack()) is None
+    assert _store(cache, query, _answer(_query("other.example.com"), 60)) is None
+    assert _store(cache, query, b"\x00\x01") is None
+    assert len(cache) == 0
+
+
+def test_ttls_are_capped(clock):
+    cache = ResponseCache(max_ttl=100, max_negative_ttl=10)
+    query, missing = _query(), _query("missing.example.com")
+
+    assert _store(cache, query, _answer(query, 86400)).expires_at == clock.now + 100
+    assert _store(cache, missing, _negative(missing)).expires_at == clock.now + 10
+
+
+def test_edns_queries_get_their_own_entries(clock):
+    cache = ResponseCache()
+    plain, edns = _query(), _query(edns=True)
+    _store(cache, edns, _answer(edns, 60))
+
+    assert _get(cache, plain) is None
+    assert _get(cache, edns) is not None
+    assert ResponseCache.key(parse_question(plain), plain) != ResponseCache.key(parse_question(edns), edns)
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = ResponseCache(maxsize=2)
+    names = ["a.example.com", "b.example.com", "c.example.com"]
+    for name in names[:2]:
+        _store(cache, _query(name), _answer(_query(name), 60))
+    _get(cache, _query("a.example.com"))
+    _store(cache, _query(names[2]), _answer(_query(names[2]), 60))
+
+    assert [_get(cache, _query(name)) is not None for name in names] == [True, False, True]
+
+
+def test_prefetch_is_offered_once_for_a_popular_entry_near_expiry(clock):
+    cache = ResponseCache(prefetch_after=0.5, prefetch_min_hits=2)
+    query = _query()
+    _store(cache, query, _answer(query, 100))
+    offered = []
+
+    def prefetch(question, packet) -> bool:
+        offered.append(question.name)
+        return True
+
+    cache.get(parse_question(query), query, prefetch)
+    clock.now += 49
+    cache.get(parse_question(query), query, prefetch)
+    assert offered == []
+
+    clock.now += 1
+    for _ in range(3):
+        assert cache.get(parse_question(query), query, prefetch) is not None
+    assert offered == ["example.com"]
+
+
+def test_a_declined_prefetch_is_offered_again_on_the_next_hit(clock):
+    cache = ResponseCache(prefetch_after=0.5, prefetch_min_hits=1)
+    query = _query()
+    _store(cache, query, _answer(query, 100))
+    clock.now += 60
+    answers = iter([False, True])
+    offered = []
+
+    def prefetch(question, packet) -> bool:
+        offered.append(packet)
+        return next(answers)
+
+    for _ in range(3):
+        cache.get(parse_question(query), query, prefetch)
+
+    assert offered == [query, query]
+
+
+def test_a_rare_entry_is_not_prefetched(clock):
+    cache = ResponseCache(prefetch_after=0.5, prefetch_min_hits=3)
+    query = _query()
+    _store(cache, query, _answer(query, 100))
+    clock.now += 90
+    offered = []
+
+    cache.get(parse_question(query), query, lambda question, packet: offered.append(packet) or True)
+    cache.get(parse_question(query), query, lambda question, packet: offered.append(packet) or True)
+
+    assert offered == []
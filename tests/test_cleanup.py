@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+from db.models import Node, NodeType, Provision, ProvisionStatus
+from provisioner.cleanup import S3DeletionQueue, sweep_orphaned_objects
+
+
+def test_queue_deletes_in_batches_and_skips_empty_keys(object_store):
+    for index in range(2500):
+        object_store.upload_bytes(f"configs/{index}.conf", b"x", content_type="text/plain")
+    queue = S3DeletionQueue(object_store, batch_size=1000, flush_interval=60)
+    queue.enqueue([None, ""])
+    queue.enqueue(f"configs/{index}.conf" for index in range(2500))
+
+    queue.stop()
+
+    assert [len(batch) for batch in object_store.delete_calls] == [1000, 1000, 500]
+    assert object_store.objects == {}
+    assert len(queue) == 0
+
+
+def test_queue_batch_size_is_capped_at_the_delete_objects_limit(object_store):
+    assert S3DeletionQueue(object_store, batch_size=5000).batch_size == 1000
+
+
+def test_flush_reports_only_removed_objects(object_store):
+    for key in ("configs/a.conf", "qrs/a.png"):
+        object_store.upload_bytes(key, b"x", content_type="text/plain")
+    object_store.fail = {"qrs/a.png"}
+    queue = S3DeletionQueue(object_store, flush_interval=60)
+    queue.enqueue(["configs/a.conf", "qrs/a.png"])
+
+    assert queue.flush() == 1
+    assert "qrs/a.png" in object_store.objects
+    queue.stop()
+
+
+def test_sweeper_deletes_only_old_unreferenced_objects(database, object_store):
+    old = datetime.now(timezone.utc) - timedelta(hours=2)
+    for key in ("configs/live.conf", "configs/revoked.conf", "configs/fresh.conf", "qrs/orphan.png"):
+        object_store.upload_bytes(key, b"x", content_type="text/plain")
+        object_store.modified[key] = old
+    object_store.modified["configs/fresh.conf"] = datetime.now(timezone.utc)
+    with database() as session:
+        node = Node(name="wg-1", type=NodeType.WIREGUARD, endpoint="203.0.113.1:51820")
+        session.add(node)
+        session.flush()
+        session.add(Provision(telegram_id=1, node_id=node.id, config_s3_key="configs/live.conf"))
+        session.add(
+            Provision(
+                telegram_id=1,
+                node_id=node.id,
+                config_s3_key="configs/revoked.conf",
+                status=ProvisionStatus.REVOKED,
+            )
+        )
+
+    report = sweep_orphaned_objects(database, object_store, grace_seconds=3600)
+
+    assert (report.scanned, report.orphaned, report.deleted, report.failed) == (4, 2, 2, 0)
+    assert sorted(object_store.objects) == ["configs/fresh.conf", "configs/live.conf"]
+
+
+def test_sweeper_dry_run_deletes_nothing(database, object_store):
+    object_store.upload_bytes("configs/orphan.conf", b"x", content_type="text/plain")
+    object_store.modified["configs/orphan.conf"] -= timedelta(hours=2)
+
+    report = sweep_orphaned_objects(database, object_store, grace_seconds=3600, dry_run=True)
+
+    assert report.orphaned == 1
+    assert report.deleted == 0
+    assert "configs/orphan.conf" in object_store.objects
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from db.config import create_db_engine
+
+
+def _begins(engine) -> list:
+    statements: list = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany) -> None:
+        if statement.startswith("BEGIN"):
+            statements.append(statement)
+
+    return statements
+
+
+@pytest.fixture
+def url(tmp_path) -> str:
+    return f"sqlite:///{tmp_path}/profile.db"
+
+
+def test_file_database_uses_wal_and_a_connection_pool(url):
+    engine = create_db_engine(url)
+
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    assert isinstance(engine.pool, QueuePool)
+    assert isinstance(create_db_engine("sqlite://").pool, StaticPool)
+
+
+def test_writers_begin_immediate_unless_the_connection_opts_out(url, monkeypatch):
+    monkeypatch.delenv("SQLITE_BEGIN_MODE", raising=False)
+    engine = create_db_engine(url)
+    begins = _begins(engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT 1"))
+    with engine.execution_options(sqlite_begin="deferred").begin() as conn:
+        conn.execute(text("SELECT 1"))
+
+    assert begins == ["BEGIN IMMEDIATE", "BEGIN DEFERRED"]
+
+
+def test_read_only_engines_and_the_environment_pick_the_mode(url, monkeypatch):
+    monkeypatch.setenv("SQLITE_BEGIN_MODE", "Exclusive")
+    writer = create_db_engine(url)
+    reader = create_db_engine(url, read_only=True)
+    begins = []
+    for engine in (writer, reader):
+        recorded = _begins(engine)
+        with engine.begin() as conn:
+            conn.execute(text("SELECT 1"))
+        begins += recorded
+
+    assert begins == ["BEGIN EXCLUSIVE", "BEGIN DEFERRED"]
+
+
+def test_unknown_begin_modes_are_rejected(url, monkeypatch):
+    monkeypatch.setenv("SQLITE_BEGIN_MODE", "eventually")
+    with pytest.raises(ValueError, match="eventually"):
+        create_db_engine(url)
+
+    monkeypatch.delenv("SQLITE_BEGIN_MODE")
+    engine = create_db_engine(url).execution_options(sqlite_begin="later")
+    with pytest.raises(ValueError, match="later"):
+        with engine.begin():
+            pass
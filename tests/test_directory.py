@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from provisioner import directory as directory_module
+from provisioner.directory import NodeDirectory
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(directory_module, "time", clock)
+    return clock
+
+
+class _Loader:
+    def __init__(self) -> None:
+        self.nodes = [{"id": 1, "free": 3}]
+        self.calls = 0
+        self.error: Exception | None = None
+
+    def __call__(self) -> list:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return list(self.nodes)
+
+
+def test_snapshot_is_served_from_memory_until_the_ttl_expires(clock):
+    loader = _Loader()
+    directory = NodeDirectory(loader, ttl=5.0)
+
+    first = directory.get()
+    clock.now += 4.9
+    assert directory.get() is first
+    clock.now += 0.1
+    assert directory.current() is None
+    directory.get()
+
+    assert loader.calls == 2
+    assert first.body == b'[{"id":1,"free":3}]'
+
+
+def test_version_and_etag_change_only_with_the_body(clock):
+    loader = _Loader()
+    directory = NodeDirectory(loader, ttl=5.0)
+    first = directory.get()
+
+    directory.invalidate()
+    same = directory.get()
+    loader.nodes = [{"id": 1, "free": 2}]
+    directory.invalidate()
+    changed = directory.get()
+
+    assert loader.calls == 3
+    assert (same.version, same.etag) == (first.version, first.etag)
+    assert changed.version == first.version + 1
+    assert changed.etag != first.etag
+
+
+def test_failed_reload_after_invalidate_does_not_serve_the_old_snapshot(clock):
+    loader = _Loader()
+    directory = NodeDirectory(loader, ttl=5.0)
+    directory.get()
+    directory.invalidate()
+    loader.error = RuntimeError("database is gone")
+
+    with pytest.raises(RuntimeError):
+        directory.get()
+
+    assert directory.current() is None
+    loader.error = None
+    loader.nodes = [{"id": 1, "free": 2}]
+    assert directory.get().nodes == loader.nodes
+
+
+def test_invalidate_wakes_subscribers_until_they_unsubscribe():
+    directory = NodeDirectory(_Loader())
+
+    async def scenario() -> tuple:
+        event = directory.subscribe()
+        directory.invalidate()
+        await asyncio.wait_for(event.wait(), timeout=1)
+        event.clear()
+        directory.unsubscribe(event)
+        directory.invalidate()
+        await asyncio.sleep(0)
+        return event.is_set(), directory._subscribers
+
+    assert asyncio.run(scenario()) == (False, set())
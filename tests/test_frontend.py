@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+import struct
+
+from dnslib import RCODE, DNSRecord
+
+from smartdns.frontend import DNSFrontend
+
+
+class _Resolver:
+    """Answers every query after ``delay`` seconds; names starting with "fail" raise."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+
+    async def resolve_async(self, data: bytes) -> bytes:
+        query = DNSRecord.parse(data)
+        await asyncio.sleep(self.delay(query) if callable(self.delay) else self.delay)
+        if str(query.q.qname).startswith("fail"):
+            raise RuntimeError("upstream exploded")
+        return query.reply().pack()
+
+
+def _query(name: str) -> bytes:
+    return DNSRecord.question(name).pack()
+
+
+async def _started(resolver, **options) -> DNSFrontend:
+    frontend = DNSFrontend(resolver, host="127.0.0.1", port=0, **options)
+    await frontend.start()
+    return frontend
+
+
+def _port(frontend: DNSFrontend) -> int:
+    return frontend._udp.get_extra_info("sockname")[1]
+
+
+def _tcp_port(frontend: DNSFrontend) -> int:
+    # With port 0 the UDP and TCP listeners get different ephemeral ports.
+    return frontend._tcp.sockets[0].getsockname()[1]
+
+
+async def _udp_exchange(port: int, packets: list, timeout: float = 0.5) -> list:
+    loop = asyncio.get_running_loop()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for packet in packets:
+            await loop.sock_sendto(sock, packet, ("127.0.0.1", port))
+        replies = []
+        try:
+            while True:
+                replies.append(DNSRecord.parse(await asyncio.wait_for(loop.sock_recv(sock, 4096), timeout)))
+        except asyncio.TimeoutError:
+            return replies
+
+
+def test_udp_queries_are_answered_and_failures_become_servfail():
+    async def scenario() -> list:
+        frontend = await _started(_Resolver(), enable_tcp=False)
+        try:
+            return await _udp_exchange(_port(frontend), [_query("ok.example.com"), _query("fail.example.com"), b"junk"])
+        finally:
+            await frontend.stop()
+
+    replies = asyncio.run(scenario())
+
+    assert sorted((str(reply.q.qname), reply.header.rcode) for reply in replies) == [
+        ("fail.example.com.", RCODE.SERVFAIL),
+        ("ok.example.com.", RCODE.NOERROR),
+    ]
+
+
+def test_udp_queries_over_the_concurrency_limit_are_dropped():
+    async def scenario() -> tuple:
+        frontend = await _started(_Resolver(delay=0.2), enable_tcp=False, max_concurrency=2)
+        try:
+            replies = await _udp_exchange(_port(frontend), [_query(f"h{number}.example.com") for number in range(5)])
+            return len(replies), frontend.inflight
+        finally:
+            await frontend.stop()
+
+    assert asyncio.run(scenario()) == (2, 0)
+
+
+async def _read_stream_replies(reader: asyncio.StreamReader, count: int) -> list:
+    replies = []
+    for _ in range(count):
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+        replies.append(str(DNSRecord.parse(await reader.readexactly(length)).q.qname))
+    return replies
+
+
+def test_pipelined_tcp_queries_are_answered_as_they_complete():
+    async def scenario() -> list:
+        delays = {"slow.example.com.": 0.2, "fast.example.com.": 0.0}
+        frontend = await _started(_Resolver(delay=lambda query: delays[str(query.q.qname)]))
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", _tcp_port(frontend))
+            for name in ("slow.example.com", "fast.example.com"):
+                packet = _query(name)
+                writer.write(struct.pack("!H", len(packet)) + packet)
+            replies = await asyncio.wait_for(_read_stream_replies(reader, 2), 2)
+            writer.close()
+            return replies
+        finally:
+            await frontend.stop()
+
+    assert asyncio.run(scenario()) == ["fast.example.com.", "slow.example.com."]
+
+
+def test_half_closed_tcp_clients_still_get_their_answers():
+    async def scenario() -> tuple:
+        frontend = await _started(_Resolver(delay=0.1))
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", _tcp_port(frontend))
+            for number in range(3):
+                packet = _query(f"h{number}.example.com")
+                writer.write(struct.pack("!H", len(packet)) + packet)
+            writer.write_eof()
+            replies = await asyncio.wait_for(_read_stream_replies(reader, 3), 2)
+            rest = await asyncio.wait_for(reader.read(), 2)
+            writer.close()
+            return sorted(replies), rest
+        finally:
+            await frontend.stop()
+
+    assert asyncio.run(scenario()) == (["h0.example.com.", "h1.example.com.", "h2.example.com."], b"")
+
+
+def test_reuse_port_lets_two_frontends_share_a_port():
+    async def scenario() -> list:
+        first = await _started(_Resolver(), enable_tcp=False, reuse_port=True)
+        second = DNSFrontend(_Resolver(), host="127.0.0.1", port=_port(first), enable_tcp=False, reuse_port=True)
+        await second.start()
+        ports = [_port(first), _port(second)]
+        await first.stop()
+        await second.stop()
+        return ports
+
+    first, second = asyncio.run(scenario())
+
+    assert first == second
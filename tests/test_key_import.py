@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import base64
+
+import pytest
+from sqlalchemy import inspect, select, text
+
+from db.config import ENGINE
+from db.migrations import make_key_pool_public_keys_unique
+from db.models import KeyPool, Node, NodeType
+from provisioner.keys_import import KeyImportError, import_keys, iter_lines, iter_records
+
+
+def _key(seed: int) -> str:
+    return base64.b64encode(bytes([seed]) * 32).decode()
+
+
+def _row(seed: int) -> str:
+    return '{"public_key": "%s", "private_key": "%s"}\n' % (_key(seed), _key(seed + 100))
+
+
+@pytest.fixture
+def wireguard_node(database) -> int:
+    with database() as session:
+        session.add(Node(id=1, name="wg", type=NodeType.WIREGUARD, endpoint="e"))
+    return 1
+
+
+def test_iter_lines_joins_lines_split_across_chunks():
+    chunks = [b"\xef\xbb\xbfa,b\r", b"\n1,", b"2\n3,\xd0", b"\xb0"]
+
+    assert list(iter_lines(chunks)) == ["a,b\r\n", "1,2\n", "3,а"]
+
+
+def test_iter_records_reports_bad_rows_with_line_numbers():
+    ndjson = list(iter_records(['{"a": 1}\n', "\n", "[1]\n", "{oops\n"], "ndjson"))
+    rows = list(iter_records(["public_key,private_key\n", "k1,\n", "k2,p2,extra\n"], "csv"))
+
+    assert [(line, row) for line, row, _ in ndjson] == [(1, {"a": 1}), (3, None), (4, None)]
+    assert ndjson[1][2] == "line 3: expected a JSON object"
+    assert rows[0] == (2, {"public_key": "k1", "private_key": None}, None)
+    assert rows[1] == (3, None, "line 3: too many columns")
+    with pytest.raises(KeyImportError):
+        list(iter_records([], "xml"))
+
+
+def test_import_skips_duplicates_within_and_across_batches(database, wireguard_node):
+    lines = [_row(1), _row(1), _row(2), '{"public_key": "short", "private_key": "x"}\n', _row(3), _row(2)]
+    batches = []
+
+    report = import_keys(database, wireguard_node, iter_records(lines, "ndjson"), batch_size=2, on_batch=batches.append)
+
+    assert (report.inserted, report.duplicates, report.invalid) == (3, 2, 1)
+    assert [(batch.inserted, batch.duplicates, batch.invalid) for batch in batches] == [(2, 1, 0), (1, 1, 1)]
+    assert report.errors == ["line 4: public_key is not a base64 WireGuard key"]
+    with database() as session:
+        assert session.scalars(select(KeyPool.public_key).order_by(KeyPool.id)).all() == [_key(1), _key(2), _key(3)]
+
+
+def test_import_counts_keys_already_stored_as_duplicates(database, wireguard_node):
+    import_keys(database, wireguard_node, iter_records([_row(1)], "ndjson"))
+
+    report = import_keys(database, wireguard_node, iter_records([_row(1), _row(2)], "ndjson"))
+
+    assert (report.inserted, report.duplicates) == (1, 1)
+
+
+def test_import_rejects_nodes_without_a_key_pool(database):
+    with database() as session:
+        session.add(Node(id=2, name="amnezia", type=NodeType.AMNEZIA, endpoint="e"))
+
+    with pytest.raises(KeyImportError, match="do not use a key pool"):
+        import_keys(database, 2, [])
+    with pytest.raises(KeyImportError, match="Node not found"):
+        import_keys(database, 3, [])
+
+
+def _public_key_index() -> dict:
+    return next(index for index in inspect(ENGINE).get_indexes("key_pools") if index["column_names"] == ["public_key"])
+
+
+def test_migration_drops_free_duplicates_and_makes_the_index_unique(database, wireguard_node):
+    name = _public_key_index()["name"]
+    with ENGINE.begin() as conn:
+        conn.execute(text(f"DROP INDEX {name}"))
+        conn.execute(text(f"CREATE INDEX {name} ON key_pools (public_key)"))
+    with database() as session:
+        session.add_all(
+            [
+                KeyPool(id=1, node_id=1, public_key="a", allocated=False),
+                KeyPool(id=2, node_id=1, public_key="a", allocated=True),
+                KeyPool(id=3, node_id=1, public_key="a", allocated=False),
+                KeyPool(id=4, node_id=1, public_key="b", allocated=False),
+                KeyPool(id=5, node_id=1, public_key="b", allocated=False),
+            ]
+        )
+
+    make_key_pool_public_keys_unique(ENGINE)
+
+    with database() as session:
+        kept = session.execute(select(KeyPool.id, KeyPool.public_key).order_by(KeyPool.id)).all()
+    assert kept == [(2, "a"), (4, "b")]
+    assert _public_key_index()["unique"]
+
+
+def test_migration_refuses_duplicates_that_are_in_use(database, wireguard_node):
+    name = _public_key_index()["name"]
+    with ENGINE.begin() as conn:
+        conn.execute(text(f"DROP INDEX {name}"))
+    with database() as session:
+        session.add_all(
+            [
+                KeyPool(id=1, node_id=1, public_key="a", allocated=True),
+                KeyPool(id=2, node_id=1, public_key="a", allocated=True),
+            ]
+        )
+
+    with pytest.raises(RuntimeError, match="2 key_pools rows"):
+        make_key_pool_public_keys_unique(ENGINE)
@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+
+from benchmarks.load_test import ENDPOINTS
+
+
+def test_load_test_runs_every_scenario_step_without_errors(tmp_path):
+    report_path = tmp_path / "report.json"
+    command = [sys.executable, "-m", "benchmarks.load_test", "--users", "4", "--concurrency", "2"]
+    subprocess.run([*command, "--nodes", "2", "--output", str(report_path)], check=True, timeout=120)
+
+    report = json.loads(report_path.read_text())
+    assert (report["users"], report["database"]) == (4, "sqlite")
+    assert list(report["endpoints"]) == list(ENDPOINTS)
+    for stats in report["endpoints"].values():
+        assert (stats["requests"], stats["errors"]) == (4, 0)
+        assert stats["db_statements_per_request"] > 0
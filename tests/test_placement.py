@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import pytest
+
+from db.models import Node, NodeType
+from provisioner.placement import NodeLoad, PlacementEngine
+from provisioner.schemas import ProvisionRequest
+from provisioner.service import ProvisioningError
+
+
+def _engine(*loads: NodeLoad) -> PlacementEngine:
+    engine = PlacementEngine(lambda: None)
+    engine.update(loads, now=0.0)
+    return engine
+
+
+def _pending(engine: PlacementEngine) -> dict:
+    return {node_id: score.pending for node_id, score in engine._scores.items()}
+
+
+def test_choose_prefers_the_least_loaded_node_and_reserves_a_slot():
+    engine = _engine(NodeLoad(1, 10, 8, 0, 8), NodeLoad(2, 10, 1, 0, 1))
+
+    assert engine.choose() == 2
+    assert _pending(engine) == {1: 0, 2: 1}
+
+
+def test_choose_skips_full_nodes_including_pending_slots():
+    engine = _engine(NodeLoad(1, 2, 1, 0, 0), NodeLoad(2, 1, 1, 0, 0))
+
+    assert engine.choose() == 1
+    assert engine.choose() is None
+
+
+def test_throughput_is_the_counter_delta_between_refreshes():
+    engine = PlacementEngine(lambda: None)
+    engine.update([NodeLoad(1, 10, 1, 1_000, 1), NodeLoad(2, 10, 1, 1_000, 1)], now=0.0)
+    engine.update([NodeLoad(1, 10, 1, 101_000, 1), NodeLoad(2, 10, 1, 1_000, 1)], now=10.0)
+
+    assert engine._scores[1].throughput_bps == 10_000
+    assert engine._scores[2].throughput_bps == 0
+    assert engine.choose() == 2
+
+
+def test_release_returns_a_reserved_slot_once():
+    engine = _engine(NodeLoad(1, 10, 0, 0, 0))
+    engine.choose()
+
+    engine.release(1)
+    engine.release(1)
+    engine.release(99)
+
+    assert _pending(engine) == {1: 0}
+
+
+def _add_nodes(database, *nodes: Node) -> None:
+    with database() as session:
+        session.add_all(nodes)
+
+
+def test_pick_node_falls_back_when_the_picked_node_is_full(service, database):
+    _add_nodes(
+        database,
+        Node(id=1, name="full", type=NodeType.AMNEZIA, endpoint="e", max_devices=5, current_devices=5),
+        Node(id=2, name="free", type=NodeType.AMNEZIA, endpoint="e", max_devices=5, current_devices=3),
+    )
+    # Scores from before node 1 filled up.
+    service.placement = _engine(NodeLoad(1, 5, 0, 0, 0), NodeLoad(2, 5, 3, 0, 0))
+
+    with database() as session:
+        node, reserved = service._pick_node(session, ProvisionRequest(telegram_id=1))
+
+    assert (node.name, reserved) == ("free", False)
+    assert _pending(service.placement) == {1: 0, 2: 0}
+
+
+def test_failed_provision_releases_its_reservation(service, database, object_store):
+    _add_nodes(database, Node(id=1, name="amnezia", type=NodeType.AMNEZIA, endpoint="e", max_devices=5))
+    service.placement = _engine(NodeLoad(1, 5, 0, 0, 0))
+    object_store.fail = {"configs/"}
+
+    with pytest.raises(RuntimeError):
+        service.provision(ProvisionRequest(telegram_id=1))
+
+    assert _pending(service.placement) == {1: 0}
+
+
+def test_pick_node_reports_no_nodes(service, database):
+    with database() as session, pytest.raises(ProvisioningError, match="No nodes available"):
+        service._pick_node(session, ProvisionRequest(telegram_id=1))
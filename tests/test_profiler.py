@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from diagnostics import ProfilerBusy, SamplingProfiler, start_profile_server
+
+
+def _spin_until(stop: threading.Event) -> None:
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def worker():
+    stop = threading.Event()
+    thread = threading.Thread(target=_spin_until, args=(stop,), name="worker 1;a")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_profile_samples_other_threads_in_collapsed_form(worker):
+    result = SamplingProfiler(interval=0.001).profile(0.05, thread_prefix="worker")
+
+    assert result.samples > 1
+    assert all(stack.startswith("worker_1:a;") for stack in result.stacks)
+    assert any("_spin_until(test_profiler:" in stack for stack in result.stacks)
+    for line in result.collapsed().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert " " not in stack and int(count) > 0
+
+
+def test_only_one_profile_runs_at_a_time():
+    profiler = SamplingProfiler()
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (started.set(), profiler.profile(0.2)))
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+
+    with pytest.raises(ProfilerBusy):
+        profiler.profile(0.01)
+    thread.join()
+    assert profiler.profile(0.01).samples >= 1
+
+
+def _get(port: int, path: str, token: str = "token"):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", headers={"Authorization": f"Bearer {token}"})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read()
+
+
+def test_profile_server_checks_the_token_and_duration(worker):
+    server = start_profile_server(SamplingProfiler(), host="127.0.0.1", port=0, token="token", max_seconds=1)
+    port = server.server_address[1]
+    try:
+        status, body = _get(port, "/debug/profile?seconds=0.02&format=json&thread=worker")
+        assert status == 200
+        assert json.loads(body)["samples"] >= 1
+        assert _get(port, "/debug/profile", token="wrong")[0] == 401
+        assert _get(port, "/debug/profile?seconds=2")[0] == 400
+        assert _get(port, "/debug/profile?seconds=soon")[0] == 400
+        assert _get(port, "/other")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import select
+
+from db.models import KeyPool, Node, NodeType, Provision, ProvisionStatus
+from provisioner import vpn
+from provisioner.placement import NodeLoad, PlacementEngine
+from provisioner.schemas import ProvisionRequest
+from provisioner.service import ProvisioningError
+
+
+@pytest.fixture
+def peers(monkeypatch) -> list:
+    """Renders configs without touching the nodes and records the peers removed again."""
+    removed: list = []
+
+    def generate(manager, node, key, *, device_label, device_id=None):
+        return f"{node.name}-{device_label}.conf", f"config for {device_label}"
+
+    for manager in (vpn.AmneziaManager, vpn.WireGuardManager):
+        monkeypatch.setattr(manager, "generate_config", generate)
+        monkeypatch.setattr(manager, "revoke", lambda manager, node, key, device_id=None: removed.append(node.name))
+    return removed
+
+
+@pytest.fixture
+def nodes(database) -> None:
+    with database() as session:
+        session.add_all(
+            [
+                Node(id=1, name="amnezia", type=NodeType.AMNEZIA, endpoint="e", max_devices=10),
+                Node(id=2, name="wireguard", type=NodeType.WIREGUARD, endpoint="e", max_devices=10),
+                KeyPool(id=1, node_id=2, public_key="wg-1", private_key="p"),
+            ]
+        )
+
+
+def _request(telegram_id: int, label: str, node: int | None = None) -> ProvisionRequest:
+    return ProvisionRequest(telegram_id=telegram_id, device_label=label, preferred_node=node)
+
+
+def _provisions(database) -> list:
+    with database() as session:
+        rows = session.scalars(select(Provision).order_by(Provision.id)).all()
+        return [(row.device_label, row.status, row.file_name, row.config_s3_key) for row in rows]
+
+
+def test_batch_reports_each_item_and_stores_what_it_returns(database, service, object_store, peers, nodes):
+    service.settings.max_devices_per_user = 2
+    response = service.provision_batch(
+        [
+            _request(1, "phone", node=1),
+            _request(1, "laptop", node=2),
+            _request(1, "tablet", node=1),
+            _request(2, "router", node=2),
+        ]
+    )
+
+    assert (response.succeeded, response.failed) == (2, 2)
+    assert [(item.index, item.error) for item in response.items if item.status == "error"] == [
+        (2, "Device limit reached"),
+        (3, "Key pool depleted"),
+    ]
+    stored = _provisions(database)
+    assert [(label, status, name) for label, status, name, _ in stored] == [
+        ("phone", ProvisionStatus.ACTIVE, "amnezia-phone.conf"),
+        ("laptop", ProvisionStatus.ACTIVE, "wireguard-laptop.conf"),
+    ]
+    for (label, _, _, config_key), item in zip(stored, response.items):
+        assert item.result.file_url == f"https://objects.test/{config_key}"
+        assert object_store.objects[config_key] == f"config for {label}".encode()
+    with database() as session:
+        assert session.get(Node, 1).current_devices == 1
+        assert session.get(KeyPool, 1).allocated
+
+
+def test_items_that_fail_to_upload_are_withdrawn(database, service, object_store, peers, nodes, monkeypatch):
+    upload = object_store.upload_bytes
+
+    def flaky_upload(key, data, *, content_type):
+        if b"broken" in data:
+            raise RuntimeError("storage unavailable")
+        upload(key, data, content_type=content_type)
+
+    monkeypatch.setattr(object_store, "upload_bytes", flaky_upload)
+    response = service.provision_batch([_request(1, "phone", node=1), _request(2, "broken", node=2)])
+
+    assert (response.succeeded, response.failed) == (1, 1)
+    assert response.items[1].error == "Failed to store configuration"
+    assert peers == ["wireguard"]
+    assert [status for _, status, _, _ in _provisions(database)] == [ProvisionStatus.ACTIVE, ProvisionStatus.REVOKED]
+    with database() as session:
+        assert session.get(Node, 2).current_devices == 0
+        assert not session.get(KeyPool, 1).allocated
+
+
+def test_placement_slots_are_released_for_failed_items(database, service, peers, nodes):
+    service.placement = PlacementEngine(lambda: None)
+    service.placement.update([NodeLoad(2, 10, 0, 0, 0)], now=0.0)
+
+    response = service.provision_batch([_request(1, "first"), _request(2, "second")])
+
+    assert [item.error for item in response.items] == [None, "Key pool depleted"]
+    assert service.placement._scores[2].pending == 1
+
+
+def test_oversized_batches_are_rejected(service):
+    service.settings.provision_batch_max_items = 1
+
+    with pytest.raises(ProvisioningError, match="At most 1 items"):
+        service.provision_batch([_request(1, "a"), _request(1, "b")])
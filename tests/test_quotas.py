@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import subprocess
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from db.crud import QuotaChange, accumulate_usage
+from db.models import KeyPool, Node, NodeType, Provision, ProvisionStatus, QuotaAction, TrafficQuota, UserTraffic
+from provisioner import vpn
+from provisioner.schemas import ActivePeerStats, ProvisionRequest, TrafficQuotaRequest
+from provisioner.service import ProvisioningError
+
+
+class _Managers:
+    """Records what the service asks the VPN managers to do; WireGuard revokes can be made to fail."""
+
+    def __init__(self, monkeypatch) -> None:
+        self.calls: list = []
+        self.fail_revoke = False
+        monkeypatch.setattr(vpn.AmneziaManager, "throttle", self._throttle)
+        monkeypatch.setattr(vpn.AmneziaManager, "generate_config", self._generate)
+        monkeypatch.setattr(vpn.AmneziaManager, "revoke", self._revoke)
+        monkeypatch.setattr(vpn.WireGuardManager, "revoke", self._revoke)
+
+    def _throttle(self, node, key, *, rate_kbps, device_id=None):
+        self.calls.append(("throttle", node.name, rate_kbps))
+
+    def _generate(self, node, key, *, device_label, device_id=None):
+        return f"{node.name}.amnezia", "amnezia://profile"
+
+    def _revoke(self, node, key, *, device_id=None):
+        self.calls.append(("revoke", node.name))
+        if self.fail_revoke:
+            raise vpn.VPNManagerError("node unreachable")
+
+
+@pytest.fixture
+def managers(monkeypatch) -> _Managers:
+    return _Managers(monkeypatch)
+
+
+@pytest.fixture
+def devices(database, service) -> None:
+    """User 1 has one device on a node that can throttle and one on a node that cannot."""
+    with database() as session:
+        session.add_all(
+            [
+                Node(id=1, name="amnezia", type=NodeType.AMNEZIA, endpoint="e", current_devices=1),
+                Node(id=2, name="wireguard", type=NodeType.WIREGUARD, endpoint="e", current_devices=1),
+                Provision(id=1, telegram_id=1, node_id=1),
+                Provision(id=2, telegram_id=1, node_id=2),
+            ]
+        )
+    service.set_traffic_quota("default", TrafficQuotaRequest(quota_bytes=1000, throttle_kbps=256))
+
+
+def _report(*totals: int) -> list:
+    now = datetime.utcnow()
+    return [
+        ActivePeerStats(provision_id=provision_id, rx_bytes=total, tx_bytes=0, latest_handshake=now)
+        for provision_id, total in enumerate(totals, start=1)
+    ]
+
+
+def _state(database) -> tuple:
+    with database() as session:
+        statuses = session.scalars(select(Provision.status).order_by(Provision.id)).all()
+        return statuses, session.get(UserTraffic, 1).enforced_action
+
+
+def test_usage_crosses_the_quota_once_and_resets_with_the_period(database):
+    start = datetime(2026, 1, 1)
+    with database() as session:
+        session.add(TrafficQuota(plan="default", quota_bytes=100, period_days=30, action=QuotaAction.REVOKE))
+
+    def report(delta: int, day: int) -> list:
+        with database() as session:
+            return accumulate_usage(session, {1: delta}, default_plan="default", now=start + timedelta(days=day))
+
+    assert report(60, 0) == []
+    assert report(60, 1) == [QuotaChange(1, QuotaAction.REVOKE)]
+    assert report(60, 2) == []
+    assert report(10, 30) == [QuotaChange(1, None, previous_action=QuotaAction.REVOKE)]
+    with database() as session:
+        traffic = session.get(UserTraffic, 1)
+        assert (traffic.used_bytes, traffic.enforced_action) == (10, None)
+
+
+def test_throttle_falls_back_to_revoke_on_nodes_that_cannot_throttle(database, service, managers, devices):
+    service.refresh_peer_stats(_report(600, 600))
+
+    assert managers.calls == [("throttle", "amnezia", 256), ("revoke", "wireguard")]
+    assert _state(database) == ([ProvisionStatus.ACTIVE, ProvisionStatus.REVOKED], QuotaAction.REVOKE)
+    assert service._pending_quota == {}
+
+
+def test_failed_enforcement_is_retried_with_the_next_report(database, service, managers, devices):
+    managers.fail_revoke = True
+    service.refresh_peer_stats(_report(600, 600))
+
+    assert _state(database) == ([ProvisionStatus.ACTIVE, ProvisionStatus.ACTIVE], QuotaAction.THROTTLE)
+    assert list(service._pending_quota) == [1]
+
+    managers.fail_revoke = False
+    managers.calls.clear()
+    service.refresh_peer_stats([])
+
+    assert managers.calls == [("throttle", "amnezia", 256), ("revoke", "wireguard")]
+    assert _state(database) == ([ProvisionStatus.ACTIVE, ProvisionStatus.REVOKED], QuotaAction.REVOKE)
+    assert service._pending_quota == {}
+
+
+def test_new_period_lifts_the_throttle(database, service, managers, devices):
+    with database() as session:
+        session.add(
+            UserTraffic(
+                telegram_id=1,
+                plan="default",
+                used_bytes=5000,
+                period_start=datetime.utcnow() - timedelta(days=31),
+                enforced_action=QuotaAction.THROTTLE,
+            )
+        )
+
+    service.refresh_peer_stats(_report(10))
+
+    assert managers.calls == [("throttle", "amnezia", None)]
+    assert _state(database) == ([ProvisionStatus.ACTIVE, ProvisionStatus.ACTIVE], None)
+
+
+def test_throttled_user_gets_throttled_devices_only_where_supported(database, service, managers, devices, object_store):
+    service.settings.max_devices_per_user = 5
+    with database() as session:
+        session.add(UserTraffic(telegram_id=1, plan="default", used_bytes=5000, enforced_action=QuotaAction.THROTTLE))
+        session.add(KeyPool(node_id=2, public_key="wg", private_key="wg"))
+
+    response = service.provision(ProvisionRequest(telegram_id=1, preferred_node=1))
+
+    assert response.node_id == 1
+    assert managers.calls == [("throttle", "amnezia", 256)]
+    with pytest.raises(ProvisioningError, match="Traffic quota exceeded"):
+        service.provision(ProvisionRequest(telegram_id=1, preferred_node=2))
+
+
+def test_revoked_user_can_provision_again_once_the_period_is_over(database, service, managers, devices):
+    service.settings.max_devices_per_user = 5
+    service.set_traffic_quota("default", TrafficQuotaRequest(quota_bytes=1000, action=QuotaAction.REVOKE))
+    with database() as session:
+        session.add(UserTraffic(telegram_id=1, plan="default", used_bytes=5000, enforced_action=QuotaAction.REVOKE))
+        session.add(UserTraffic(telegram_id=2, plan="default", used_bytes=5000, enforced_action=QuotaAction.REVOKE))
+    with pytest.raises(ProvisioningError, match="Traffic quota exceeded"):
+        service.provision(ProvisionRequest(telegram_id=1, preferred_node=1))
+
+    with database() as session:
+        for traffic in session.scalars(select(UserTraffic)):
+            traffic.period_start = datetime.utcnow() - timedelta(days=60)
+
+    assert service.provision(ProvisionRequest(telegram_id=1, preferred_node=1)).node_id == 1
+    batch = service.provision_batch([ProvisionRequest(telegram_id=2, preferred_node=1)])
+    assert [item.error for item in batch.items] == [None]
+    with database() as session:
+        counters = [(traffic.used_bytes, traffic.enforced_action) for traffic in session.scalars(select(UserTraffic))]
+    assert counters == [(0, None), (0, None)]
+    assert service._pending_quota == {
+        1: QuotaChange(1, None, previous_action=QuotaAction.REVOKE),
+        2: QuotaChange(2, None, previous_action=QuotaAction.REVOKE),
+    }
+
+
+def test_throttle_is_lifted_when_a_new_period_starts_without_usage_reports(database, service, managers, devices):
+    service.settings.max_devices_per_user = 5
+    with database() as session:
+        session.add(
+            UserTraffic(
+                telegram_id=1,
+                plan="default",
+                used_bytes=5000,
+                period_start=datetime.utcnow() - timedelta(days=31),
+                enforced_action=QuotaAction.THROTTLE,
+            )
+        )
+
+    service.provision(ProvisionRequest(telegram_id=1, preferred_node=1))
+    assert managers.calls == []
+
+    service.refresh_peer_stats([])
+    assert managers.calls == [("throttle", "amnezia", None), ("throttle", "amnezia", None)]
+    assert service._pending_quota == {}
+
+
+def test_amnezia_profiles_are_addressed_by_provision_id(database, service, devices, monkeypatch):
+    commands: list = []
+
+    def run(args, **options):
+        commands.append(args)
+        return SimpleNamespace(stdout="amnezia://profile")
+
+    monkeypatch.setattr(vpn, "subprocess", SimpleNamespace(run=run, CalledProcessError=subprocess.CalledProcessError))
+    service.settings.max_devices_per_user = 5
+    with database() as session:
+        session.add(UserTraffic(telegram_id=1, plan="default", used_bytes=5000, enforced_action=QuotaAction.THROTTLE))
+
+    new = service.provision(ProvisionRequest(telegram_id=1, preferred_node=1, device_label="phone")).provision_id
+    service._apply_quota_change(QuotaChange(1, None, previous_action=QuotaAction.THROTTLE))
+
+    cli = service.settings.amnezia_cli_path
+    assert commands == [
+        [cli, "profile", "export", "--node", "amnezia", "--label", "phone", "--id", str(new)],
+        [cli, "profile", "limit", "--node", "amnezia", "--id", str(new), "--rate", "256kbit"],
+        [cli, "profile", "limit", "--node", "amnezia", "--id", "1", "--rate", "unlimited"],
+        [cli, "profile", "limit", "--node", "amnezia", "--id", str(new), "--rate", "unlimited"],
+    ]
+
+
+def test_amnezia_refuses_to_limit_a_whole_node(monkeypatch):
+    commands: list = []
+    monkeypatch.setattr(vpn, "subprocess", SimpleNamespace(run=lambda args, **options: commands.append(args)))
+    node = Node(name="amnezia", type=NodeType.AMNEZIA, endpoint="e")
+
+    with pytest.raises(vpn.VPNManagerError):
+        vpn.AmneziaManager("amnezia-cli").throttle(node, None, rate_kbps=256)
+
+    assert commands == []
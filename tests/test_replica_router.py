@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import text
+
+from db import config
+from db.config import ReplicaRouter, create_db_engine
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(config, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def engines(tmp_path) -> tuple:
+    primary = create_db_engine(f"sqlite:///{tmp_path}/primary.db")
+    return primary, create_db_engine(f"sqlite:///{tmp_path}/replica.db", read_only=True)
+
+
+def _bind(router: ReplicaRouter, max_staleness=None):
+    return router.session_factory(max_staleness).kw["bind"]
+
+
+def test_reads_use_a_fresh_replica_within_the_staleness_bound(engines, clock, monkeypatch):
+    primary, replica = engines
+    router = ReplicaRouter(primary, replica, max_lag=5.0)
+    monkeypatch.setattr(router, "_probe", lambda engine: 3.0)
+
+    assert _bind(router) is replica
+    assert _bind(router, max_staleness=1.0) is not replica
+    assert _bind(router, max_staleness=1.0).get_execution_options()["sqlite_begin"] == "deferred"
+
+
+def test_lag_is_probed_once_per_check_interval(engines, clock, monkeypatch):
+    router = ReplicaRouter(*engines, check_interval=2.0)
+    probes = []
+    monkeypatch.setattr(router, "_probe", lambda engine: probes.append(engine) or 0.0)
+
+    router.lag()
+    clock.now += 1.9
+    router.lag()
+    clock.now += 0.1
+    router.lag()
+
+    assert len(probes) == 2
+
+
+def test_unreachable_or_idle_replicas_route_reads_to_the_primary(engines, tmp_path, clock, monkeypatch):
+    primary, replica = engines
+    missing = create_db_engine(f"sqlite:///{tmp_path}/missing/replica.db", read_only=True)
+
+    assert ReplicaRouter(primary, replica).lag() == 0.0
+    assert ReplicaRouter(primary, missing).lag() is None
+    # A replica that is no longer streaming reports NULL lag.
+    monkeypatch.setattr(config, "text", lambda _: text("SELECT NULL"))
+    router = ReplicaRouter(primary, replica)
+    assert router.lag() is None
+    assert _bind(router) is not replica
+
+
+def test_without_a_replica_reads_go_to_the_primary(engines):
+    primary, _ = engines
+    router = ReplicaRouter(primary)
+
+    assert router.lag() is None
+    assert _bind(router).url == primary.url
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from dnslib import EDNS0, RR, A, DNSRecord
+
+from smartdns import cache as cache_module
+from smartdns.cache import ResponseCache
+from smartdns.dns_server import SmartDNSResolver
+from smartdns.rules import Rule, RuleStore
+
+
+class _Rules:
+    def __init__(self, *rules: Rule) -> None:
+        self.rules = list(rules)
+
+    def load(self) -> list:
+        return self.rules
+
+
+class _Upstreams:
+    """Answers each query once ``release`` is set; ``error`` makes every exchange fail instead."""
+
+    def __init__(self) -> None:
+        self.queries: list = []
+        self.release = asyncio.Event()
+        self.error: Exception | None = None
+
+    async def query(self, packet: bytes) -> bytes:
+        self.queries.append(packet)
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        request = DNSRecord.parse(packet)
+        reply = request.reply()
+        reply.add_answer(RR(str(request.q.qname), rdata=A("192.0.2.1"), ttl=60))
+        return reply.pack()
+
+
+def _resolver(upstreams: _Upstreams, *rules: Rule, **options) -> SmartDNSResolver:
+    store = RuleStore(_Rules(*rules))
+    store.reload()
+    return SmartDNSResolver(store=store, upstreams=upstreams, **options)  # type: ignore[arg-type]
+
+
+def _query(name: str, *, edns: bool = False) -> bytes:
+    query = DNSRecord.question(name)
+    if edns:
+        query.add_ar(EDNS0(udp_len=1232))
+    return query.pack()
+
+
+async def _resolve_together(resolver: SmartDNSResolver, upstreams: _Upstreams, packets: list) -> list:
+    tasks = [asyncio.ensure_future(resolver.resolve_async(packet)) for packet in packets]
+    await asyncio.sleep(0.01)
+    upstreams.release.set()
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_identical_queries_in_flight_share_one_upstream_exchange():
+    async def scenario() -> tuple:
+        upstreams = _Upstreams()
+        packets = [_query("example.com"), _query("EXAMPLE.com"), _query("eXaMpLe.CoM")]
+        return packets, await _resolve_together(_resolver(upstreams), upstreams, packets), upstreams.queries
+
+    packets, replies, forwarded = asyncio.run(scenario())
+
+    assert len(forwarded) == 1
+    for packet, reply in zip(packets, replies):
+        asked, answered = DNSRecord.parse(packet), DNSRecord.parse(reply)
+        assert (answered.header.id, str(answered.q.qname)) == (asked.header.id, str(asked.q.qname))
+        assert str(answered.rr[0].rdata) == "192.0.2.1"
+
+
+def test_queries_with_different_edns_are_forwarded_separately():
+    async def scenario() -> int:
+        upstreams = _Upstreams()
+        packets = [_query("example.com"), _query("example.com", edns=True)]
+        await _resolve_together(_resolver(upstreams), upstreams, packets)
+        return len(upstreams.queries)
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_a_failed_exchange_fails_every_waiter_and_is_not_reused():
+    async def scenario() -> tuple:
+        upstreams = _Upstreams()
+        upstreams.error = OSError("upstreams down")
+        resolver = _resolver(upstreams)
+        results = await _resolve_together(resolver, upstreams, [_query("example.com")] * 3)
+        upstreams.error = None
+        retried = await resolver.resolve_async(_query("example.com"))
+        return results, retried, len(upstreams.queries), resolver._inflight
+
+    results, retried, forwarded, inflight = asyncio.run(scenario())
+
+    assert [type(result) for result in results] == [OSError] * 3
+    assert DNSRecord.parse(retried).rr
+    assert (forwarded, inflight) == (2, {})
+
+
+def test_a_waiter_giving_up_does_not_cancel_the_exchange():
+    async def scenario() -> bytes:
+        upstreams = _Upstreams()
+        resolver = _resolver(upstreams)
+        first = asyncio.ensure_future(resolver.resolve_async(_query("example.com")))
+        second = asyncio.ensure_future(resolver.resolve_async(_query("example.com")))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.sleep(0)
+        upstreams.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        return await first
+
+    assert DNSRecord.parse(asyncio.run(scenario())).rr
+
+
+def test_rules_answer_before_the_cache_and_upstreams():
+    async def scenario() -> tuple:
+        upstreams = _Upstreams()
+        resolver = _resolver(upstreams, Rule("*.example.com", "10.0.0.1", ttl=30), cache=ResponseCache())
+        return await resolver.resolve_async(_query("www.example.com")), upstreams.queries
+
+    reply, forwarded = asyncio.run(scenario())
+
+    assert [(str(record.rdata), record.ttl) for record in DNSRecord.parse(reply).rr] == [("10.0.0.1", 30)]
+    assert forwarded == []
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimpleNamespace:
+    clock = SimpleNamespace(now=1000.0)
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+def _ttl(reply: bytes) -> int:
+    return DNSRecord.parse(reply).rr[0].ttl
+
+
+def test_a_due_hit_is_answered_from_cache_and_refreshed_in_the_background(clock):
+    async def scenario() -> tuple:
+        upstreams = _Upstreams()
+        upstreams.release.set()
+        resolver = _resolver(upstreams, cache=ResponseCache(prefetch_after=0.5, prefetch_min_hits=1))
+        await resolver.resolve_async(_query("example.com"))
+        clock.now += 40
+        stale = await resolver.resolve_async(_query("example.com"))
+        await asyncio.gather(*resolver._prefetches)
+        fresh = await resolver.resolve_async(_query("example.com"))
+        return stale, fresh, len(upstreams.queries)
+
+    stale, fresh, forwarded = asyncio.run(scenario())
+
+    assert (_ttl(stale), _ttl(fresh), forwarded) == (20, 60, 2)
+
+
+def test_prefetches_beyond_the_concurrency_limit_are_skipped(clock):
+    async def scenario(concurrency: int) -> list:
+        upstreams = _Upstreams()
+        upstreams.release.set()
+        cache = ResponseCache(prefetch_after=0.5, prefetch_min_hits=1)
+        resolver = _resolver(upstreams, cache=cache, prefetch_concurrency=concurrency)
+        for name in ("a.example.com", "b.example.com"):
+            await resolver.resolve_async(_query(name))
+        clock.now += 40
+        upstreams.release.clear()
+        for name in ("a.example.com", "b.example.com"):
+            await resolver.resolve_async(_query(name))
+        pending = [len(resolver._prefetches)]
+        upstreams.release.set()
+        await asyncio.gather(*resolver._prefetches)
+        # The skipped entry is offered again on its next hit.
+        upstreams.release.clear()
+        await resolver.resolve_async(_query("b.example.com"))
+        pending.append(len(resolver._prefetches))
+        upstreams.release.set()
+        await asyncio.gather(*resolver._prefetches)
+        return pending
+
+    assert asyncio.run(scenario(1)) == [1, 1]
+    assert asyncio.run(scenario(0)) == [0, 0]
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from smartdns.rules import Rule, RuleIndex
+
+
+def _index(*patterns: str) -> RuleIndex:
+    return RuleIndex(Rule(pattern=pattern, ip_address=f"10.0.0.{number}") for number, pattern in enumerate(patterns, 1))
+
+
+def _ip(index: RuleIndex, domain: str):
+    rule = index.lookup(domain)
+    return rule.ip_address if rule else None
+
+
+def test_exact_rules_win_over_wildcards_and_the_longest_suffix_wins():
+    index = _index("*.example.com", "*.cdn.example.com", "www.example.com")
+
+    assert _ip(index, "www.example.com") == "10.0.0.3"
+    assert _ip(index, "a.b.cdn.example.com") == "10.0.0.2"
+    assert _ip(index, "mail.example.com") == "10.0.0.1"
+    assert _ip(index, "cdn.example.com") == "10.0.0.1"
+
+
+def test_wildcards_do_not_match_the_apex_or_partial_labels():
+    index = _index("*.example.com")
+
+    assert _ip(index, "example.com") is None
+    assert _ip(index, "badexample.com") is None
+    assert _ip(index, "x.example.org") is None
+
+
+def test_names_are_matched_without_case_or_trailing_dot():
+    index = _index("WWW.Example.com.", "*.Example.org")
+
+    assert _ip(index, "www.EXAMPLE.com.") == "10.0.0.1"
+    assert _ip(index, "A.example.ORG.") == "10.0.0.2"
+    assert len(index) == 2
+
+
+def test_removing_the_longest_wildcard_keeps_shorter_ones_reachable():
+    index = _index("*.com", "*.very.long.example.com")
+    index.remove("*.very.long.example.com")
+
+    assert _ip(index, "x.very.long.example.com") == "10.0.0.1"
+    assert index._longest == len("com")
+    index.remove("*.com")
+    assert _ip(index, "x.com") is None
+
+
+def test_copies_are_independent():
+    index = _index("a.example.com")
+    copy = index.copy()
+    copy.add(Rule(pattern="b.example.com", ip_address="10.0.0.9"))
+    copy.remove("a.example.com")
+
+    assert (_ip(index, "a.example.com"), _ip(index, "b.example.com")) == ("10.0.0.1", None)
+    assert (_ip(copy, "a.example.com"), _ip(copy, "b.example.com")) == (None, "10.0.0.9")
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+from smartdns.rules import CompositeRuleSource, DatabaseRuleSource, FileRuleSource, Rule, RuleChanges, RuleStore
+
+HOUR_AGO = datetime.utcnow() - timedelta(hours=1)
+
+
+@pytest.fixture
+def rules_table(database):
+    """Yields ``add(pattern, ip, **columns)``, which stores a rule last modified an hour ago."""
+    from db.models import SmartDNSRule
+
+    def add(pattern: str, ip_address: str, **columns) -> None:
+        columns.setdefault("updated_at", HOUR_AGO)
+        with database() as session:
+            session.add(SmartDNSRule(pattern=pattern, ip_address=ip_address, **columns))
+
+    return add
+
+
+def _edit(match: str, **values) -> None:
+    from db import session_scope
+    from db.models import SmartDNSRule
+
+    values.setdefault("updated_at", datetime.utcnow())
+    with session_scope() as session:
+        session.execute(update(SmartDNSRule).where(SmartDNSRule.pattern == match).values(**values))
+
+
+def test_database_source_reports_only_rows_past_the_watermark(rules_table):
+    rules_table("a.example.com", "10.0.0.1")
+    rules_table("B.example.com", "10.0.0.2", ttl=30)
+    source = DatabaseRuleSource(overlap=0)
+
+    first = source.changes()
+    assert first.complete
+    assert set(first.rules) == {Rule("a.example.com", "10.0.0.1"), Rule("b.example.com", "10.0.0.2", 30)}
+    assert source.changes() == RuleChanges()
+
+    _edit("a.example.com", ip_address="10.0.0.9")
+    rules_table("c.example.com", "10.0.0.3", updated_at=datetime.utcnow())
+
+    assert source.changes() == RuleChanges(
+        rules=(Rule("a.example.com", "10.0.0.9"), Rule("c.example.com", "10.0.0.3")),
+    )
+    assert source.changes() == RuleChanges()
+
+
+def test_database_source_rereads_the_overlap_without_reporting_it_again(rules_table):
+    rules_table("a.example.com", "10.0.0.1", updated_at=datetime.utcnow())
+    source = DatabaseRuleSource(overlap=3600)
+    source.changes()
+
+    assert source.changes() == RuleChanges()
+
+
+def test_deactivated_rows_are_tombstones(rules_table):
+    rules_table("a.example.com", "10.0.0.1")
+    rules_table("b.example.com", "10.0.0.2")
+    source = DatabaseRuleSource(overlap=0)
+    source.changes()
+
+    _edit("a.example.com", is_active=False)
+
+    assert source.changes() == RuleChanges(removed=frozenset({"a.example.com"}))
+
+
+def test_a_renamed_pattern_removes_the_old_one(rules_table):
+    rules_table("a.example.com", "10.0.0.1")
+    source = DatabaseRuleSource(overlap=0)
+    source.changes()
+
+    _edit("a.example.com", pattern="z.example.com")
+
+    assert source.changes() == RuleChanges(
+        rules=(Rule("z.example.com", "10.0.0.1"),),
+        removed=frozenset({"a.example.com"}),
+    )
+
+
+def test_a_deleted_row_forces_a_complete_reload(rules_table):
+    from db import session_scope
+    from db.models import SmartDNSRule
+
+    rules_table("a.example.com", "10.0.0.1")
+    rules_table("b.example.com", "10.0.0.2")
+    source = DatabaseRuleSource(overlap=0)
+    source.changes()
+
+    with session_scope() as session:
+        session.execute(delete(SmartDNSRule).where(SmartDNSRule.pattern == "a.example.com"))
+
+    assert source.changes() == RuleChanges(rules=(Rule("b.example.com", "10.0.0.2"),), complete=True)
+
+
+def test_store_applies_database_deltas_to_its_index(rules_table):
+    rules_table("example.com", "10.0.0.1")
+    rules_table("*.example.org", "10.0.0.2")
+    store = RuleStore(DatabaseRuleSource(overlap=0))
+    assert store.reload()
+    assert not store.reload()
+
+    _edit("*.example.org", is_active=False)
+    _edit("example.com", ip_address="10.0.0.9")
+
+    assert store.reload()
+    assert store.lookup("www.example.org") is None
+    assert store.lookup("example.com") == Rule("example.com", "10.0.0.9")
+    assert store.version == 2
+
+
+def _write(path, text: str) -> None:
+    before = path.stat().st_mtime_ns if path.exists() else 0
+    path.write_text(text, encoding="utf-8")
+    # Coarse filesystem clocks could leave the mtime unchanged by a quick rewrite.
+    os.utime(path, ns=(before + 10**9, before + 10**9))
+
+
+def test_file_source_rereads_only_when_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "smartdns.rules"
+    _write(path, "# comment\nA.example.com 10.0.0.1\nb.example.com 10.0.0.2 30\nbroken\nc.example.com 10.0.0.3 soon\n")
+    source = FileRuleSource(str(path))
+
+    assert source.changes() == RuleChanges(
+        rules=(Rule("a.example.com", "10.0.0.1"), Rule("b.example.com", "10.0.0.2", 30)),
+        complete=True,
+    )
+    reads = []
+    load = source.load
+
+    def counting_load() -> list:
+        reads.append(path.name)
+        return load()
+
+    monkeypatch.setattr(source, "load", counting_load)
+    assert source.changes() == RuleChanges()
+    assert reads == []
+
+    _write(path, "a.example.com 10.0.0.9\nd.example.com 10.0.0.4\n")
+
+    assert source.changes() == RuleChanges(
+        rules=(Rule("a.example.com", "10.0.0.9"), Rule("d.example.com", "10.0.0.4")),
+        removed=frozenset({"b.example.com"}),
+    )
+    assert reads == ["smartdns.rules"]
+
+
+def test_a_missing_file_has_no_rules(tmp_path):
+    path = tmp_path / "smartdns.rules"
+    _write(path, "a.example.com 10.0.0.1\n")
+    source = FileRuleSource(str(path))
+    source.changes()
+
+    path.unlink()
+
+    assert source.changes() == RuleChanges(removed=frozenset({"a.example.com"}))
+
+
+class _Deltas:
+    def __init__(self, *changes: RuleChanges) -> None:
+        self.pending = list(changes)
+
+    def load(self) -> list:
+        raise AssertionError("an incremental source is never loaded in full")
+
+    def changes(self) -> RuleChanges:
+        return self.pending.pop(0) if self.pending else RuleChanges()
+
+
+def test_composite_source_lets_the_last_source_win():
+    first = _Deltas(
+        RuleChanges(rules=(Rule("a.example.com", "10.0.0.1"), Rule("b.example.com", "10.0.0.2")), complete=True),
+        RuleChanges(rules=(Rule("a.example.com", "10.0.0.3"),)),
+    )
+    second = _Deltas(
+        RuleChanges(rules=(Rule("a.example.com", "10.0.1.1"),), complete=True),
+        RuleChanges(),
+        RuleChanges(removed=frozenset({"a.example.com"})),
+    )
+    source = CompositeRuleSource([first, second])
+
+    initial = source.changes()
+    assert initial.complete
+    assert set(initial.rules) == {Rule("a.example.com", "10.0.1.1"), Rule("b.example.com", "10.0.0.2")}
+    # The first source's change stays shadowed by the second one.
+    assert source.changes() == RuleChanges(rules=(Rule("a.example.com", "10.0.1.1"),))
+    # Once the second source drops the pattern, the first source's rule shows through.
+    assert source.changes() == RuleChanges(rules=(Rule("a.example.com", "10.0.0.3"),))
+
+
+def test_composite_source_removes_patterns_no_source_has():
+    first = _Deltas(
+        RuleChanges(rules=(Rule("a.example.com", "10.0.0.1"),), complete=True),
+        RuleChanges(removed=frozenset({"a.example.com"})),
+    )
+    source = CompositeRuleSource([first, _Deltas(RuleChanges(complete=True))])
+    source.changes()
+
+    assert source.changes() == RuleChanges(removed=frozenset({"a.example.com"}))
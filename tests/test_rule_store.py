@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+from smartdns.rules import Rule, RuleStore
+
+
+class _StaticSource:
+    """A source without ``changes``: every reload is a complete load."""
+
+    def __init__(self, *rules: Rule) -> None:
+        self.rules = list(rules)
+
+    def load(self) -> list:
+        return list(self.rules)
+
+
+def test_reload_publishes_a_new_snapshot_and_leaves_the_old_one_alone():
+    source = _StaticSource(Rule("a.example.com", "10.0.0.1"))
+    store = RuleStore(source)
+    store.reload()
+    first = store.snapshot
+
+    source.rules = [Rule("b.example.com", "10.0.0.2")]
+    assert store.reload()
+
+    assert (first.version, store.version) == (1, 2)
+    assert dict(first.rules) == {"a.example.com": Rule("a.example.com", "10.0.0.1")}
+    assert first.index.lookup("a.example.com") is not None
+    assert store.lookup("a.example.com") is None
+    assert store.lookup("b.example.com").ip_address == "10.0.0.2"
+
+
+def test_unchanged_rules_keep_the_snapshot():
+    store = RuleStore(_StaticSource(Rule("a.example.com.", "10.0.0.1")))
+    store.reload()
+    snapshot = store.snapshot
+
+    assert not store.reload()
+    assert store.snapshot is snapshot
+    assert len(store) == 1
+
+
+def test_published_rules_are_read_only():
+    store = RuleStore(_StaticSource(Rule("a.example.com", "10.0.0.1")))
+    store.reload()
+
+    with pytest.raises(TypeError):
+        store.snapshot.rules["b.example.com"] = Rule("b.example.com", "10.0.0.2")  # type: ignore[index]
+
+
+def test_readers_always_see_a_whole_snapshot():
+    source = _StaticSource()
+    store = RuleStore(source)
+    stop = threading.Event()
+    torn = []
+    names = [f"host{number}.example.com" for number in range(20)]
+
+    def read() -> None:
+        while not stop.is_set():
+            index = store.snapshot.index
+            ips = {rule.ip_address for rule in map(index.lookup, names) if rule is not None}
+            if len(ips) > 1:
+                torn.append(ips)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for generation in range(50):
+        source.rules = [Rule(name, f"10.0.{generation}.1") for name in names]
+        store.reload()
+    stop.set()
+    for reader in readers:
+        reader.join()
+
+    assert torn == []
+    assert store.version == 50
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import signal
+from types import SimpleNamespace
+
+import pytest
+
+from smartdns import service
+from smartdns.rules import Rule, RuleStore
+from smartdns.service import RuleReloader, Supervisor, WorkerCrashLoop
+
+
+class _Rules:
+    def __init__(self) -> None:
+        self.rules = [Rule("example.com", "10.0.0.1")]
+        self.error: Exception | None = None
+
+    def load(self) -> list:
+        if self.error is not None:
+            raise self.error
+        return list(self.rules)
+
+
+def test_reloader_calls_on_change_only_when_the_rules_changed():
+    source = _Rules()
+    changes = []
+    reloader = RuleReloader(RuleStore(source), interval=0, on_change=lambda: changes.append(reloader.store.version))
+
+    async def scenario() -> None:
+        await reloader.reload()
+        await reloader.reload()
+        source.rules.append(Rule("example.org", "10.0.0.2"))
+        await reloader.reload()
+        source.error = OSError("database is gone")
+        await reloader.reload()
+
+    asyncio.run(scenario())
+
+    assert changes == [1, 2]
+    assert reloader.store.lookup("example.org") is not None
+
+
+def test_reloader_without_interval_reloads_only_on_request():
+    source = _Rules()
+    reloader = RuleReloader(RuleStore(source), interval=0)
+
+    async def scenario() -> list:
+        task = asyncio.create_task(reloader.run())
+        await asyncio.sleep(0.05)
+        versions = [reloader.store.version]
+        reloader.request()
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if reloader.store.version:
+                break
+        versions.append(reloader.store.version)
+        task.cancel()
+        return versions
+
+    assert asyncio.run(scenario()) == [0, 1]
+
+
+def _process(pid: int | None, exitcode: int | None) -> SimpleNamespace:
+    return SimpleNamespace(pid=pid, exitcode=exitcode)
+
+
+def test_supervisor_signals_only_running_workers(monkeypatch):
+    killed = []
+    monkeypatch.setattr(service, "os", SimpleNamespace(kill=lambda pid, signum: killed.append((pid, signum))))
+    supervisor = Supervisor(SimpleNamespace(workers=3))  # type: ignore[arg-type]
+    supervisor._workers = {0: _process(100, None), 1: _process(101, 1), 2: _process(None, None)}
+
+    supervisor._signal_workers()
+
+    assert killed == [(100, signal.SIGHUP)]
+
+
+@pytest.fixture
+def clock(monkeypatch) -> SimpleNamespace:
+    clock = SimpleNamespace(now=1000.0)
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(service, "time", clock)
+    return clock
+
+
+class _Workers:
+    """A supervisor whose workers are fakes; ``exit(index)`` makes the current process of a worker exit."""
+
+    def __init__(self, monkeypatch, clock, **options) -> None:
+        self.clock = clock
+        self.dead: list = []
+        self.started: list = []
+        monkeypatch.setattr(service, "multiprocess", SimpleNamespace(mark_process_dead=self._mark_process_dead))
+        self.supervisor = Supervisor(SimpleNamespace(workers=2), **options)  # type: ignore[arg-type]
+        self.supervisor._metrics_dir = "/tmp/metrics"
+        monkeypatch.setattr(self.supervisor, "_context", SimpleNamespace(Process=self._process))
+        for index in range(2):
+            self.supervisor._start(index)
+
+    def _process(self, target, args, name) -> SimpleNamespace:
+        process = SimpleNamespace(pid=100 + len(self.started), exitcode=None, start=lambda: None)
+        self.started.append((args[0], self.clock.now))
+        return process
+
+    def _mark_process_dead(self, pid: int, path: str) -> None:
+        self.dead.append((pid, path))
+
+    def exit(self, index: int) -> None:
+        self.supervisor._workers[index].exitcode = 1
+
+    def poll(self, seconds: float) -> None:
+        for _ in range(int(seconds)):
+            self.clock.now += 1
+            self.supervisor._restart_exited()
+
+
+def test_supervisor_restarts_a_worker_that_ran_for_a_while_at_once(monkeypatch, clock):
+    workers = _Workers(monkeypatch, clock, stable_after=30)
+    clock.now += 60
+    workers.exit(1)
+
+    workers.poll(1)
+
+    assert workers.started[2:] == [(1, 1061.0)]
+    assert workers.dead == [(101, "/tmp/metrics")]
+
+
+def test_supervisor_backs_off_workers_that_exit_right_after_starting(monkeypatch, clock):
+    workers = _Workers(monkeypatch, clock, stable_after=30, restart_delay=1, max_fast_exits=10)
+
+    for _ in range(4):
+        workers.exit(0)
+        workers.poll(10)
+
+    assert [started for index, started in workers.started[2:]] == [1002.0, 1013.0, 1025.0, 1039.0]
+    assert [pid for pid, path in workers.dead] == [100, 102, 103, 104]
+
+
+def test_supervisor_gives_up_on_a_worker_that_keeps_exiting(monkeypatch, clock):
+    workers = _Workers(monkeypatch, clock, stable_after=30, restart_delay=1, max_fast_exits=3)
+
+    with pytest.raises(WorkerCrashLoop, match="worker 1 exited 3 times"):
+        for _ in range(3):
+            workers.exit(1)
+            workers.poll(5)
+
+    assert len(workers.started) == 4
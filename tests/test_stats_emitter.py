@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import socket
+
+import pytest
+
+from provisioner.stats_emitter import BufferedStatsClient
+
+
+@pytest.fixture
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1)
+    yield sock
+    sock.close()
+
+
+def _client(receiver, **options) -> BufferedStatsClient:
+    return BufferedStatsClient("127.0.0.1", receiver.getsockname()[1], prefix="app", flush_interval=60, **options)
+
+
+def _received(receiver, count: int) -> list:
+    return [receiver.recv(65535) for _ in range(count)]
+
+
+def test_counters_are_summed_into_one_datagram(receiver):
+    client = _client(receiver)
+    for _ in range(3):
+        client.incr("provision.success")
+    client.decr("provision.success")
+    client.incr("provision.error", 2)
+    client.incr("idle", 0)
+    client.timing("provision.latency", 12.5)
+
+    assert client.flush() == 1
+    lines = _received(receiver, 1)[0].decode().split("\n")
+    assert lines == ["app.provision.success:2|c", "app.provision.error:2|c", "app.provision.latency:12.500|ms"]
+    assert client.flush() == 0
+    client.stop()
+
+
+def test_datagrams_stay_within_the_packet_size(receiver):
+    client = _client(receiver, max_packet_size=512)
+    for index in range(100):
+        client.incr(f"counter.{index:03d}")
+
+    packets = client.flush()
+    datagrams = _received(receiver, packets)
+    client.stop()
+
+    assert packets > 1
+    assert all(len(datagram) <= 512 for datagram in datagrams)
+    lines = b"\n".join(datagrams).decode().split("\n")
+    assert lines == [f"app.counter.{index:03d}:1|c" for index in range(100)]
+
+
+def test_stop_flushes_and_later_metrics_do_not_start_a_thread(receiver):
+    client = _client(receiver, max_timer_samples=2)
+    for sample in (1.0, 2.0, 3.0):
+        client.timing("lookup", sample)
+
+    client.stop()
+    client.incr("late")
+
+    assert _received(receiver, 1)[0] == b"app.lookup:1.000|ms\napp.lookup:2.000|ms"
+    assert not client._thread.is_alive()
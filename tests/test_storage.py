@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import os
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from fastapi.testclient import TestClient
+
+from provisioner import storage
+from provisioner.app import create_app
+from provisioner.storage import LocalObjectStore, ObjectStoreError
+
+
+@pytest.fixture
+def store(tmp_path) -> LocalObjectStore:
+    return LocalObjectStore(str(tmp_path / "objects"), base_url="http://files.test/", secret="secret", presign_ttl=60)
+
+
+def _blobs(store: LocalObjectStore) -> list:
+    return [name for _, _, names in os.walk(store.root / "blobs") for name in names]
+
+
+def test_identical_uploads_share_one_blob_until_the_last_key_is_deleted(store):
+    store.upload_bytes("configs/a.conf", b"same", content_type="text/plain")
+    store.upload_bytes("configs/b.conf", b"same", content_type="text/plain")
+
+    assert os.stat(store.ref_path("configs/a.conf")).st_ino == os.stat(store.ref_path("configs/b.conf")).st_ino
+    assert len(_blobs(store)) == 1
+
+    assert store.delete_objects(["configs/a.conf", "configs/missing.conf"]) == []
+    assert len(_blobs(store)) == 1
+    store.delete_objects(["configs/b.conf"])
+    assert _blobs(store) == []
+    assert store.open("configs/b.conf") is None
+
+
+def test_keys_cannot_leave_the_store(store):
+    for key in ("../escape", "configs/../../escape", "", "/"):
+        with pytest.raises(ObjectStoreError):
+            store.ref_path(key)
+    assert store.open("../escape") is None
+
+
+def test_listing_follows_the_prefix_and_pages(store):
+    for key in ("configs/1.conf", "configs/2.conf", "configs/3.conf", "qrs/1.png"):
+        store.upload_bytes(key, key.encode(), content_type="text/plain")
+
+    pages = list(store.iter_object_pages("configs/", page_size=2))
+
+    assert [len(page) for page in pages] == [2, 1]
+    keys = sorted(item["Key"] for page in pages for item in page)
+    assert keys == ["configs/1.conf", "configs/2.conf", "configs/3.conf"]
+    assert [item["Key"] for page in store.iter_object_pages("qrs/1") for item in page] == ["qrs/1.png"]
+    assert pages[0][0]["LastModified"].tzinfo is not None
+
+
+def _path(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}"
+
+
+def test_signatures_cover_the_key_and_expire(store, monkeypatch):
+    url = urlsplit(store.generate_presigned_url("configs/a b.conf"))
+    query = parse_qs(url.query)
+    expires, signature = int(query["expires"][0]), query["signature"][0]
+
+    assert url.path == "/objects/configs/a%20b.conf"
+    assert store.verify("configs/a b.conf", expires, signature)
+    assert not store.verify("configs/other.conf", expires, signature)
+    monkeypatch.setattr(storage, "time", SimpleNamespace(time=lambda: expires + 1))
+    assert not store.verify("configs/a b.conf", expires, signature)
+    assert (store.content_type("x.ovpn"), store.content_type("x.bin")) == ("text/plain", "application/octet-stream")
+
+
+def test_objects_endpoint_serves_signed_keys_only(database, settings, tmp_path):
+    settings.object_store_backend = "local"
+    settings.local_store_path = str(tmp_path / "objects")
+    settings.local_store_secret = "secret"
+    with TestClient(create_app(settings)) as client:
+        store = client.app.state.service.s3
+        store.upload_bytes("qrs/1.png", b"png", content_type="image/png")
+        url = _path(store.generate_presigned_url("qrs/1.png"))
+        served = client.get(url)
+        forged = client.get(url.split("&signature=")[0] + "&signature=" + "0" * 64)
+        missing = client.get(_path(store.generate_presigned_url("qrs/2.png")))
+
+    assert (served.status_code, served.content, served.headers["content-type"]) == (200, b"png", "image/png")
+    assert forged.status_code == 403
+    assert missing.status_code == 404
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import errno
+import struct
+
+import pytest
+from dnslib import RR, A, DNSRecord
+
+from smartdns.transport import UpstreamTransport, UpstreamTransportPool
+from smartdns.upstreams import Upstream
+
+
+def _answer(query: bytes, ip: str = "192.0.2.1", *, truncated: bool = False) -> bytes:
+    request = DNSRecord.parse(query)
+    reply = request.reply()
+    reply.header.tc = int(truncated)
+    if not truncated:
+        reply.add_answer(RR(str(request.q.qname), rdata=A(ip), ttl=60))
+    return reply.pack()
+
+
+class _UpstreamServer(asyncio.DatagramProtocol):
+    """UDP upstream; ``respond(query)`` returns the datagrams to send back for one query."""
+
+    def __init__(self, respond) -> None:
+        self.respond = respond
+        self.clients: set = set()
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.clients.add(addr)
+        for reply in self.respond(data):
+            self.transport.sendto(reply, addr)
+
+
+async def _serve(respond) -> tuple:
+    loop = asyncio.get_running_loop()
+    server = _UpstreamServer(respond)
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=("127.0.0.1", 0))
+    return Upstream("127.0.0.1", transport.get_extra_info("sockname")[1]), server
+
+
+def _ips(reply: bytes) -> list:
+    return [str(record.rdata) for record in DNSRecord.parse(reply).rr]
+
+
+def test_replies_are_matched_by_id_and_question_and_get_the_askers_id_back():
+    def respond(query: bytes) -> list:
+        wrong_id = bytes([query[0] ^ 0xFF, query[1]]) + _answer(query, "198.51.100.1")[2:]
+        other_question = _answer(query[:2] + DNSRecord.question("other.example.com").pack()[2:], "198.51.100.2")
+        return [wrong_id, other_question, b"\x00", _answer(query)]
+
+    async def scenario() -> tuple:
+        upstream, _ = await _serve(respond)
+        transport = UpstreamTransport(upstream)
+        query = DNSRecord.question("example.com").pack()
+        try:
+            return query, await transport.query(query, timeout=1)
+        finally:
+            transport.close()
+
+    query, reply = asyncio.run(scenario())
+
+    assert reply[:2] == query[:2]
+    assert _ips(reply) == ["192.0.2.1"]
+
+
+def test_concurrent_queries_share_a_few_sockets_that_rotate():
+    async def scenario() -> tuple:
+        upstream, server = await _serve(lambda query: [_answer(query)])
+        transport = UpstreamTransport(upstream, udp_sockets=2, max_queries_per_socket=20)
+        queries = [DNSRecord.question(f"h{number}.example.com").pack() for number in range(10)]
+        try:
+            first = await asyncio.gather(*(transport.query(query, timeout=1) for query in queries))
+            sockets_at_first = len(server.clients)
+            for query in queries * 4:
+                await transport.query(query, timeout=1)
+            return first, queries, sockets_at_first, len(server.clients)
+        finally:
+            transport.close()
+
+    replies, queries, sockets_at_first, sockets_later = asyncio.run(scenario())
+
+    assert [DNSRecord.parse(reply).q for reply in replies] == [DNSRecord.parse(query).q for query in queries]
+    assert sockets_at_first <= 2
+    assert sockets_later > 2
+
+
+def test_truncated_replies_are_retried_over_tcp():
+    tcp_queries = []
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            try:
+                (length,) = struct.unpack("!H", await reader.readexactly(2))
+            except asyncio.IncompleteReadError:
+                break
+            query = await reader.readexactly(length)
+            tcp_queries.append(query)
+            reply = _answer(query, "203.0.113.7")
+            writer.write(struct.pack("!H", len(reply)) + reply)
+        writer.close()
+
+    async def scenario() -> bytes:
+        upstream, _ = await _serve(lambda query: [_answer(query, truncated=True)])
+        server = await asyncio.start_server(handle, "127.0.0.1", upstream.port)
+        pool = UpstreamTransportPool()
+        try:
+            first = await pool.send(upstream, DNSRecord.question("big.example.com", "TXT").pack(), 1)
+            await pool.send(upstream, DNSRecord.question("big2.example.com", "TXT").pack(), 1)
+            return first
+        finally:
+            pool.close()
+            server.close()
+
+    reply = asyncio.run(scenario())
+
+    assert _ips(reply) == ["203.0.113.7"]
+    assert len(tcp_queries) == 2
+
+
+def test_a_tcp_socket_error_fails_pipelined_queries_at_once():
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await reader.read()
+        writer.close()
+
+    async def scenario() -> tuple:
+        upstream, _ = await _serve(lambda query: [_answer(query, truncated=True)])
+        server = await asyncio.start_server(handle, "127.0.0.1", upstream.port)
+        transport = UpstreamTransport(upstream)
+        loop = asyncio.get_running_loop()
+        try:
+            queries = [
+                asyncio.ensure_future(transport.query(DNSRecord.question(name, "TXT").pack(), timeout=5))
+                for name in ("a.example.com", "b.example.com")
+            ]
+            while transport._stream is None or len(transport._pending) < 2:
+                await asyncio.sleep(0.01)
+            started = loop.time()
+            # What the event loop does when a read on the socket fails with EHOSTUNREACH.
+            stream = transport._stream.writer.transport
+            stream.get_protocol().connection_lost(OSError(errno.EHOSTUNREACH, "No route to host"))
+            results = await asyncio.gather(*queries, return_exceptions=True)
+            return results, loop.time() - started, transport._stream
+        finally:
+            transport.close()
+            server.close()
+
+    results, elapsed, stream = asyncio.run(scenario())
+
+    assert [type(result) for result in results] == [ConnectionError, ConnectionError]
+    assert elapsed < 1
+    assert stream is None
+
+
+def test_unanswered_queries_time_out_and_are_forgotten():
+    async def scenario() -> UpstreamTransport:
+        upstream, _ = await _serve(lambda query: [])
+        transport = UpstreamTransport(upstream)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await transport.query(DNSRecord.question("example.com").pack(), timeout=0.05)
+            return transport
+        finally:
+            transport.close()
+
+    assert asyncio.run(scenario())._pending == {}
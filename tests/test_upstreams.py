@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from smartdns import upstreams as upstreams_module
+from smartdns.upstreams import Upstream, UpstreamHealth, UpstreamManager, parse_upstreams
+
+OK = b"\x00\x01\x81\x80"
+SERVFAIL = b"\x00\x01\x81\x82"
+
+
+class _Upstreams:
+    """``send`` for :class:`UpstreamManager`: each upstream answers ``reply`` after ``delay`` or raises it."""
+
+    def __init__(self, **behaviour) -> None:
+        self.behaviour = behaviour
+        self.asked: list = []
+        self.cancelled: list = []
+
+    async def send(self, upstream: Upstream, packet: bytes, timeout: float) -> bytes:
+        self.asked.append(upstream.host)
+        delay, reply = self.behaviour[upstream.host]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(upstream.host)
+            raise
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+
+
+def _manager(fake: _Upstreams, **options) -> UpstreamManager:
+    options.setdefault("timeout", 1.0)
+    return UpstreamManager([Upstream(host, 53) for host in fake.behaviour], send=fake.send, **options)
+
+
+def test_slow_upstreams_are_hedged_and_the_loser_cancelled():
+    fake = _Upstreams(slow=(0.5, OK), fast=(0.0, OK + b"fast"))
+    manager = _manager(fake, max_hedge_delay=0.05)
+
+    reply = asyncio.run(manager.query(b"query"))
+
+    assert reply == OK + b"fast"
+    assert (fake.asked, fake.cancelled) == (["slow", "fast"], ["slow"])
+    slow, fast = manager.health
+    assert slow.latency >= 0.05 and fast.latency < slow.latency
+    assert [health.upstream.host for health in manager.ranked()] == ["fast", "slow"]
+
+
+def test_a_failure_moves_on_without_waiting_for_the_hedge_delay():
+    fake = _Upstreams(broken=(0.0, ConnectionResetError()), good=(0.0, OK))
+    manager = _manager(fake, min_hedge_delay=0.5, max_hedge_delay=0.5, max_parallel=1)
+
+    async def timed() -> tuple:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        reply = await manager.query(b"query")
+        return reply, loop.time() - started
+
+    reply, elapsed = asyncio.run(timed())
+
+    assert reply == OK and elapsed < 0.25
+    assert manager.health[0].failure_rate > 0
+
+
+def test_servfail_is_returned_only_when_nothing_better_arrives():
+    better = _manager(_Upstreams(first=(0.0, SERVFAIL), second=(0.01, OK)))
+    worse = _manager(_Upstreams(first=(0.0, SERVFAIL), second=(0.0, OSError("unreachable"))))
+
+    assert asyncio.run(better.query(b"query")) == OK
+    assert asyncio.run(worse.query(b"query")) == SERVFAIL
+
+
+def test_errors_and_silence_are_raised():
+    failing = _manager(_Upstreams(a=(0.0, OSError("a down")), b=(0.0, OSError("b down"))))
+    silent = _manager(_Upstreams(a=(1.0, OK)), timeout=0.05)
+
+    with pytest.raises(OSError, match="down"):
+        asyncio.run(failing.query(b"query"))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(silent.query(b"query"))
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_failure_rate_fades_so_a_recovered_upstream_is_tried_again(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(upstreams_module, "time", clock)
+    health = UpstreamHealth(Upstream("a", 53), alpha=0.5, recovery=30.0)
+    health.record_success(0.02)
+    health.record_failure()
+
+    failing = health.expected_cost(1.0, clock.now)
+    clock.now += 90
+
+    assert failing == pytest.approx(0.5 * 0.02 + 0.5 * 1.0)
+    assert health.expected_cost(1.0, clock.now) < 0.05
+    assert UpstreamHealth(Upstream("b", 53), alpha=0.5, recovery=30.0).expected_cost(1.0, clock.now) == 0.0
+
+
+def test_hedge_delay_is_clamped():
+    manager = _manager(_Upstreams(a=(0.0, OK)), min_hedge_delay=0.01, max_hedge_delay=0.2)
+    health = manager.health[0]
+
+    assert manager.hedge_delay(health) == 0.2
+    health.record_success(0.02)
+    assert manager.hedge_delay(health) == pytest.approx(0.02 + 4 * 0.01)
+    health.latency, health.deviation = 0.0001, 0.0
+    assert manager.hedge_delay(health) == 0.01
+
+
+def test_parse_upstreams_defaults_the_port_and_skips_bad_ones():
+    parsed = parse_upstreams(["1.1.1.1", "9.9.9.9:5353", "8.8.8.8:dns"])
+
+    assert parsed == [Upstream("1.1.1.1", 53), Upstream("9.9.9.9", 5353)]
+    with pytest.raises(ValueError):
+        parse_upstreams(["8.8.8.8:dns"])
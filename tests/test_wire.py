@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import pytest
+from dnslib import EDNS0, QTYPE, RCODE, RR, SOA, A, DNSRecord
+
+from smartdns.wire import (
+    CD,
+    DO,
+    EDNS,
+    OPT,
+    WireError,
+    error_reply,
+    parse_question,
+    parse_records,
+    query_options,
+    reply_for,
+    soa_minimum,
+)
+
+
+def test_parse_question_lowercases_and_finds_the_end():
+    packet = DNSRecord.question("WwW.Example.COM", "AAAA").pack()
+
+    question = parse_question(packet)
+
+    assert question[:3] == ("www.example.com", QTYPE.AAAA, 1)
+    assert question.end == len(packet)
+
+
+@pytest.mark.parametrize(
+    "packet",
+    [b"\x00" * 5, DNSRecord.question("example.com").pack()[:-3], b"\x12\x34\x01\x00\x00\x02" + b"\x00" * 6],
+)
+def test_parse_question_rejects_short_and_multi_question_packets(packet):
+    with pytest.raises(WireError):
+        parse_question(packet)
+
+
+def test_error_reply_keeps_id_rd_and_question():
+    query = DNSRecord.question("example.com")
+    packet = query.pack()
+
+    reply = DNSRecord.parse(error_reply(packet, parse_question(packet), RCODE.SERVFAIL))
+
+    assert (reply.header.id, reply.header.rd, reply.header.qr) == (query.header.id, 1, 1)
+    assert reply.header.rcode == RCODE.SERVFAIL
+    assert reply.q == query.q
+
+
+def test_reply_for_restores_the_askers_id_and_0x20_case():
+    upstream = DNSRecord.question("example.com")
+    answer = upstream.reply()
+    answer.add_answer(RR("example.com", rdata=A("192.0.2.1"), ttl=60))
+    asked = DNSRecord.question("ExAmPlE.cOm").pack()
+
+    reply = DNSRecord.parse(reply_for(answer.pack(), asked, parse_question(asked)))
+
+    assert reply.header.id == DNSRecord.parse(asked).header.id
+    assert str(reply.q.qname) == "ExAmPlE.cOm."
+    assert str(reply.rr[0].rdata) == "192.0.2.1"
+
+
+def _negative_reply() -> bytes:
+    reply = DNSRecord.question("missing.example.com").reply()
+    reply.header.rcode = RCODE.NXDOMAIN
+    soa = SOA("ns.example.com", "admin.example.com", (1, 2, 3, 4, 300))
+    reply.add_auth(RR("example.com", QTYPE.SOA, rdata=soa, ttl=900))
+    return reply.pack()
+
+
+def test_parse_records_tags_sections_and_reads_the_soa_minimum():
+    packet = _negative_reply()
+    question = parse_question(packet)
+
+    records = parse_records(packet, question)
+
+    assert [(record.section, record.rtype, record.ttl) for record in records] == [(1, QTYPE.SOA, 900)]
+    assert soa_minimum(packet, records[0]) == 300
+    with pytest.raises(WireError):
+        parse_records(packet[:-4], question)
+
+
+def test_query_options_reflects_cd_edns_and_do():
+    plain = DNSRecord.question("example.com")
+    checking_disabled = DNSRecord.question("example.com")
+    checking_disabled.header.cd = 1
+    edns = DNSRecord.question("example.com")
+    edns.add_ar(EDNS0(udp_len=1232))
+    dnssec = DNSRecord.question("example.com")
+    dnssec.add_ar(EDNS0(udp_len=1232, flags="do"))
+
+    packets = [record.pack() for record in (plain, checking_disabled, edns, dnssec)]
+    options = [query_options(packet, parse_question(packet)) for packet in packets]
+
+    assert options == [0, CD, EDNS, EDNS | DO]
+    assert OPT == QTYPE.OPT